@@ -1,5 +1,9 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash, current_app
 from werkzeug.security import generate_password_hash, check_password_hash
+from pymongo.errors import DuplicateKeyError
+from reports.geo import location_latlng
+from auth.users import current_user, invalidate_user
+from reports.versioning import bump_version, next_version
 
 auth_bp = Blueprint('auth', __name__, template_folder='../templates')
 
@@ -47,10 +51,17 @@ def register():
         "name": name,
         "email": email,
         "password": hashed_password,
-        "role": role  # store the role in the DB
+        "role": role,  # store the role in the DB
+        "version": next_version(mongo.db)
     }
 
-    mongo.db.users.insert_one(user_data)
+    try:
+        mongo.db.users.insert_one(user_data)
+        bump_version(mongo.db)
+    except DuplicateKeyError:
+        # lost a race with a concurrent registration (unique index on email)
+        flash("Email already exists. Please choose another.", "danger")
+        return redirect(url_for("auth.root"))
     flash("Registration successful! Please log in.", "success")
     return redirect(url_for("auth.root"))
 
@@ -64,11 +75,10 @@ def dashboard():
 
     # 2. Load & sanitize user
     mongo = current_app.mongo
-    user_data = mongo.db.users.find_one({"email": session["user"]})
+    user_data = current_user()
     if not user_data:
         flash("User not found", "danger")
         return redirect(url_for("auth.root"))
-    user_data.pop("password", None)
 
     # 3. Fetch issues based on role
     role = user_data.get("role", "user")
@@ -88,7 +98,7 @@ def dashboard():
         # convert Mongo ObjectId to string
         i["_id"] = str(i["_id"])
         # guarantee there's always a dict at issue.location
-        i["location"] = i.get("location", {})
+        i["location"] = location_latlng(i.get("location"))
     # ─────────────────────────────
     # 4. Choose the correct template
     template_map = {
@@ -114,6 +124,7 @@ def logout():
         current_app.mongo.db.users.update_one(
             {"email": user_email}, {"$set": {"logged_in": False}}
         )
+        invalidate_user(user_email)
     session.clear()
 
     print(f"[LOGOUT] {request.method} logout triggered by {user_email or 'Unknown'}")
@@ -0,0 +1,44 @@
+# auth/users.py
+
+from flask import current_app, g, has_app_context, session
+
+from cache import TTLCache
+
+USER_CACHE_TTL_SECONDS = 30
+
+# The password hash never leaves the database through this loader
+_PUBLIC_FIELDS = {"password": 0}
+
+# email -> user document, shared by the requests of one worker process.
+# Writes to a user call invalidate_user(); other workers catch up within the TTL.
+_user_cache = TTLCache(ttl=USER_CACHE_TTL_SECONDS, maxsize=1024)
+
+
+def load_user(email):
+    """User document (without the password) by email, or None."""
+    if not email:
+        return None
+    user = _user_cache.get(email)
+    if user is None:
+        user = current_app.mongo.db.users.find_one({"email": email}, _PUBLIC_FIELDS)
+        if user is None:
+            # don't remember misses, the account may be registered any moment
+            return None
+        _user_cache.set(email, user)
+    # views decorate the document for their templates: hand out a copy
+    return dict(user)
+
+
+def current_user():
+    """The logged-in user, loaded at most once per request."""
+    if "current_user" not in g:
+        g.current_user = load_user(session.get("user"))
+    return g.current_user
+
+
+def invalidate_user(email):
+    """Forget the cached document after a write to the user."""
+    if email:
+        _user_cache.pop(email)
+    if has_app_context():
+        g.pop("current_user", None)
@@ -0,0 +1,80 @@
+# benchmarks/bench_api.py
+#
+# Seed synthetic issues and time the JSON issue APIs through Flask's test
+# client, printing requests/sec per endpoint. Runs on the in-memory storage
+# backend only (seeding wipes the issues), so it needs no database and the
+# data is the same on every run (fixed seed):
+#
+#     python benchmarks/bench_api.py [--count 5000] [--requests 20] [--repeat 3]
+#
+# Memory-backend numbers measure the app's own work (query building,
+# pagination, serialization), not MongoDB; compare them with each other.
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("SECRET_KEY", "bench")
+
+from bench_serialize import synthetic_issues
+from indexes import ensure_indexes
+from reports.versioning import bump_version, next_version
+import run
+
+ENDPOINTS = [
+    ("first page",        "/api/issues?limit=50"),
+    ("map markers",       "/api/issues?limit=200&fields=_id,location,status,category"),
+    ("filtered + facets", "/api/issues?category=pothole&status=pending&facets=1"),
+    ("viewport",          "/api/issues/bbox?sw=31.72,35.22&ne=31.78,35.28"),
+    ("clusters",          "/api/issues/clusters?sw=31.7,35.2&ne=31.8,35.3&zoom=14"),
+    ("delta sync",        "/api/issues/changes?since=0&limit=200"),
+    ("stats",             "/api/stats"),
+]
+
+
+def seed(db, count):
+    db.issues.delete_many({})
+    version = next_version(db)
+    docs = synthetic_issues(count)
+    for doc in docs:
+        doc["version"] = version
+    db.issues.insert_many(docs)
+    bump_version(db)
+    ensure_indexes(db)
+
+
+def bench(client, name, url, requests, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(requests):
+            rv = client.get(url)
+            assert rv.status_code == 200, f"{url}: {rv.status_code}"
+        best = min(best, time.perf_counter() - t0)
+    print(f"{name:<20} {requests / best:>10,.1f} req/sec  ({best:.3f}s best of {repeat})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Issue API throughput")
+    parser.add_argument("--count", type=int, default=5_000)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    app = run.app
+    if app.config["STORAGE_BACKEND"] != "memory":
+        # seeding replaces every issue in the database
+        sys.exit("bench_api.py runs on STORAGE_BACKEND=memory only")
+    seed(app.mongo.db, args.count)
+    client = app.test_client()
+
+    print(f"{args.count:,} synthetic issues, storage: {app.config['STORAGE_BACKEND']}")
+    for name, url in ENDPOINTS:
+        bench(client, name, url, args.requests, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# benchmarks/bench_serialize.py
+#
+# Serialize synthetic issues through the legacy path (serialize_issue_for_json
+# + Flask's JSON provider) and the reports.serializers layer, and print docs/sec
+# so the numbers can be compared across releases:
+#
+#     python benchmarks/bench_serialize.py [--count 100000] [--repeat 3]
+
+import argparse
+import copy
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from bson import ObjectId
+from flask import Flask
+
+from reports import serializers
+from reports.reports import serialize_issue_for_json
+
+STATUSES   = ["pending", "assigned", "in progress", "resolved", "done"]
+CATEGORIES = ["pothole", "water_leak", "street_lighting", "missing_signage", "power_cut"]
+
+
+def synthetic_issues(count, seed=42):
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    return [{
+        "_id":               ObjectId(),
+        "reporter_email":    f"user{rng.randrange(5000)}@example.com",
+        "description":       "Broken street lamp next to the bus stop " * rng.randint(1, 4),
+        "city_street":       f"Herzl St {rng.randrange(200)}",
+        "category":          rng.choice(CATEGORIES),
+        "location":          {"type": "Point",
+                              "coordinates": [35.2 + rng.random() / 10, 31.7 + rng.random() / 10]},
+        "image_file_id":     ObjectId() if rng.random() < 0.7 else None,
+        "status":            rng.choice(STATUSES),
+        "assigned_to":       None,
+        "maintenance_email": None,
+        "timestamp":         start + timedelta(seconds=rng.randrange(10_000_000)),
+    } for _ in range(count)]
+
+
+def bench(name, fn, docs, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        # the legacy serializer mutates its input, give every run fresh copies
+        batch = copy.deepcopy(docs)
+        t0 = time.perf_counter()
+        fn(batch)
+        best = min(best, time.perf_counter() - t0)
+    print(f"{name:<28} {len(docs) / best:>12,.0f} docs/sec  ({best:.3f}s best of {repeat})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Issue serializer throughput")
+    parser.add_argument("--count", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    docs = synthetic_issues(args.count)
+    app = Flask(__name__)
+
+    def legacy(batch):
+        with app.app_context():
+            app.json.dumps({"issues": [serialize_issue_for_json(d) for d in batch]})
+
+    def current(batch):
+        serializers.dumps({"issues": [serializers.issue_view(d) for d in batch]})
+
+    print(f"{args.count:,} synthetic issues, backend: {serializers.BACKEND}")
+    bench("legacy (flask json)", legacy, docs, args.repeat)
+    bench(f"serializers ({serializers.BACKEND})", current, docs, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# cache.py
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Small thread-safe in-process cache: entries expire after `ttl` seconds
+    and the least recently used entry is evicted once `maxsize` is reached.
+    Each worker process has its own copy, so keep TTLs short.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, ttl, maxsize=128):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, self._MISSING)
+            if entry is self._MISSING:
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_set(self, key, factory):
+        value = self.get(key, self._MISSING)
+        if value is self._MISSING:
+            value = factory()
+            self.set(key, value)
+        return value
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
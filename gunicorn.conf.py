@@ -0,0 +1,105 @@
+# gunicorn.conf.py
+#
+# Production serving:
+#
+#     gunicorn -c gunicorn.conf.py run:app
+#
+# Every setting can be overridden from the environment (below) or on the
+# command line. Each worker opens its own MongoClient and starts its own
+# background services after the fork, so no socket or thread crosses one;
+# of those services only the derivative renderer runs in every worker, the
+# rest in the one holding the leader lease (reports/leader.py).
+#
+# Worker classes:
+#   gevent (default)   Every open page holds a /api/issues/events stream,
+#                      which costs a greenlet here; up to
+#                      GUNICORN_WORKER_CONNECTIONS per worker. Preloading is
+#                      off: the worker must monkey-patch before the app is
+#                      imported, so indexes come from `flask migrate`.
+#   gthread            WEB_CONCURRENCY processes x GUNICORN_THREADS threads,
+#                      app preloaded in the master. Each event stream holds
+#                      a thread: only for deployments without live pages.
+
+import multiprocessing
+import os
+import threading
+import time
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '5000')}")
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gevent")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+# keep MONGO_MAX_POOL_SIZE at or above this, or requests queue for connections
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 1000))
+preload_app = worker_class != "gevent"
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 60))
+# on SIGTERM, workers get this long to finish in-flight requests
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+# recycle workers now and then, staggered so they don't restart together
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 2000))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 200))
+
+accesslog = "-"
+errorlog = "-"
+
+
+def _app():
+    from run import app
+    return app
+
+
+def when_ready(server):
+    """Master, once: create missing indexes, then drop its connections."""
+    if not server.cfg.preload_app:
+        return  # don't import the app before the workers patch; `flask migrate` indexes
+    from indexes import ensure_indexes
+
+    app = _app()
+    failed = ensure_indexes(app.mongo.db)
+    if failed:
+        server.log.warning("Indexes not created: %s", ", ".join(failed))
+    app.mongo.cx.close()
+
+
+def post_worker_init(worker):
+    """Worker, after the fork (and after gevent patched): own client and services."""
+    from run import init_mongo, start_services
+
+    app = _app()
+    # the master's client stays with the master
+    init_mongo(app)
+    if app.config["BACKGROUND_SERVICES"]:
+        start_services(app)
+    threading.Thread(target=_stop_when_draining, args=(worker, app),
+                     name="drain-watch", daemon=True).start()
+
+
+def _stop_when_draining(worker, app):
+    """
+    worker.alive turns False on SIGTERM, at max_requests and when the master
+    goes away; the worker then waits up to graceful_timeout for its requests
+    to finish. Open event streams never would, so end them right away.
+    """
+    from run import stop_services
+
+    while worker.alive:
+        time.sleep(1)
+    stop_services(app)
+
+
+def worker_int(worker):
+    """Worker, on SIGINT/SIGQUIT."""
+    from run import stop_services
+
+    stop_services(_app())
+
+
+def worker_exit(server, worker):
+    from run import stop_services
+
+    app = _app()
+    stop_services(app)
+    app.mongo.cx.close()
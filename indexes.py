@@ -0,0 +1,156 @@
+# indexes.py
+#
+# Every index the app relies on, per collection. ensure_indexes() is
+# idempotent (create_index is a no-op for an existing identical index), so it
+# runs on every start-up and from the CLI:
+#
+#     flask --app run ensure-indexes
+
+import logging
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+
+log = logging.getLogger(__name__)
+
+# newest-first listings page on (timestamp, _id), see reports/pagination.py
+NEWEST_FIRST = [("timestamp", DESCENDING), ("_id", DESCENDING)]
+# delta sync pages on (version, _id), see reports/changes.py
+SYNC_ORDER = [("version", ASCENDING), ("_id", ASCENDING)]
+
+INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+        IndexModel([("role", ASCENDING)], name="role"),
+        IndexModel(SYNC_ORDER, name="version_id"),
+    ],
+    "issues": [
+        IndexModel(NEWEST_FIRST, name="timestamp_id"),
+        IndexModel([("reporter_email", ASCENDING)] + NEWEST_FIRST, name="reporter_timestamp"),
+        IndexModel([("assigned_to", ASCENDING)] + NEWEST_FIRST, name="assigned_timestamp"),
+        IndexModel([("status", ASCENDING)], name="status"),
+        IndexModel(SYNC_ORDER, name="version_id"),
+        # public reports filters and the category list, see reports/filters.py
+        IndexModel([("category", ASCENDING)] + NEWEST_FIRST, name="category_timestamp"),
+        IndexModel([("city_street", ASCENDING)] + NEWEST_FIRST, name="street_timestamp"),
+        IndexModel([("location", GEOSPHERE)], name="location_2dsphere"),
+        # /api/issues/search, see reports/search.py
+        IndexModel([("description", TEXT), ("city_street", TEXT), ("category", TEXT)],
+                   weights={"category": 5, "city_street": 3, "description": 1},
+                   default_language="english", name="issues_text"),
+    ],
+    "done_issues": [
+        IndexModel([("original_issue_id", ASCENDING)], name="original_issue"),
+        IndexModel(NEWEST_FIRST, name="timestamp_id"),
+        IndexModel([("status", ASCENDING)] + NEWEST_FIRST, name="status_timestamp"),
+        IndexModel(SYNC_ORDER, name="version_id"),
+    ],
+    "tombstones": [
+        IndexModel([("collection", ASCENDING), ("doc_id", ASCENDING)], unique=True, name="collection_doc"),
+        IndexModel(SYNC_ORDER, name="version_id"),
+    ],
+    "version_leases": [
+        IndexModel([("floor", ASCENDING)], name="floor"),
+        # leases of crashed writers, long past LEASE_TIMEOUT (reports/versioning.py)
+        IndexModel([("at", ASCENDING)], expireAfterSeconds=3600, name="at_ttl"),
+    ],
+    "fs.files": [
+        IndexModel([("metadata.derivative_of", ASCENDING), ("metadata.size", ASCENDING)],
+                   name="derivative_of_size"),
+        # content-addressed uploads, see reports/filestore.py
+        IndexModel([("metadata.sha256", ASCENDING)], unique=True, sparse=True, name="sha256_unique"),
+        # finished uploads held until claimed, see reports/uploads.py
+        IndexModel([("metadata.pending_until", ASCENDING)], sparse=True, name="pending_until"),
+        # originals still waiting for derivatives, see reports/derivatives.py
+        IndexModel([("metadata.derivatives", ASCENDING), ("metadata.derivative_of", ASCENDING)],
+                   name="derivatives_pending"),
+    ],
+    # same spec and name as the driver's own, so either may create it first
+    "fs.chunks": [
+        IndexModel([("files_id", ASCENDING), ("n", ASCENDING)], unique=True, name="files_id_1_n_1"),
+    ],
+    "email_digests": [
+        IndexModel([("to", ASCENDING), ("flush_at", ASCENDING)], name="to_flush_at"),
+        IndexModel([("flush_at", ASCENDING)], name="flush_at"),
+    ],
+    # expired by the server, see reports/events.py
+    "issue_events": [
+        IndexModel([("at", ASCENDING)], expireAfterSeconds=24 * 3600, name="at_ttl"),
+    ],
+    "outbox": [
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)], name="status_next_attempt"),
+    ],
+    "upload_sessions": [
+        IndexModel([("updated", ASCENDING)], name="updated"),
+    ],
+    "rejected_reports": [
+        IndexModel([("technician", ASCENDING), ("timestamp", DESCENDING)], name="technician_timestamp"),
+        IndexModel([("original_issue_id", ASCENDING)], name="original_issue"),
+    ],
+}
+
+# Representative (collection, filter, sort) shapes of the hot-path queries.
+# tests/test_indexes.py explains each one and fails on a COLLSCAN, so add the
+# shape here whenever a route starts querying on a new field. The listing,
+# viewport and review-queue filters are checked there as the routes build
+# them (route_shapes()).
+QUERY_SHAPES = [
+    ("users",            {"email": "someone@example.com"}, None),
+    ("users",            {"role": "maintenance"}, None),
+    ("issues",           {}, NEWEST_FIRST),
+    ("issues",           {"reporter_email": "someone@example.com"}, NEWEST_FIRST),
+    ("issues",           {"assigned_to": "tech@example.com"}, NEWEST_FIRST),
+    ("issues",           {"status": {"$in": ["in progress", "assigned"]}}, None),
+    ("issues",           {"$text": {"$search": "pothole herzl"}}, None),
+    ("issues",           {"category": "pothole"}, NEWEST_FIRST),
+    ("issues",           {"city_street": {"$regex": "^Herzl"}}, NEWEST_FIRST),
+    ("issues",           {"location": {"$geoWithin": {"$geometry": {
+                             "type": "Polygon",
+                             "coordinates": [[[35.1, 31.7], [35.3, 31.7], [35.3, 31.8],
+                                              [35.1, 31.8], [35.1, 31.7]]]}}}}, None),
+    ("done_issues",      {"original_issue_id": ObjectId("000000000000000000000000")}, None),
+    ("done_issues",      {}, NEWEST_FIRST),
+    ("done_issues",      {"status": "accepted"}, NEWEST_FIRST),
+    ("fs.files",         {"metadata.derivative_of": ObjectId("000000000000000000000000"),
+                          "metadata.size": "thumb"}, None),
+    ("fs.files",         {"metadata.sha256": "0" * 64}, None),
+    ("fs.files",         {"metadata.derivatives": None, "metadata.derivative_of": None,
+                          "contentType": {"$regex": "^image/"}}, None),
+    ("fs.files",         {"metadata.refcount": 0, "metadata.pending_until": {"$lt": datetime(2000, 1, 1)}},
+                         None),
+    ("fs.chunks",        {"files_id": ObjectId("000000000000000000000000")}, [("n", ASCENDING)]),
+    ("email_digests",    {"to": "someone@example.com", "flush_at": {"$gt": datetime(2000, 1, 1)}}, None),
+    ("email_digests",    {"flush_at": {"$lte": datetime(2000, 1, 1)}}, [("flush_at", ASCENDING)]),
+    ("issues",           {"version": {"$gt": 0, "$lte": 10}}, SYNC_ORDER),
+    ("issues",           {"$or": [{"version": {"$gt": 3, "$lte": 10}},
+                                  {"version": 3, "_id": {"$gt": ObjectId("000000000000000000000000")}}]},
+                         SYNC_ORDER),
+    ("done_issues",      {"version": {"$gt": 0, "$lte": 10}}, SYNC_ORDER),
+    ("users",            {"version": {"$gt": 0, "$lte": 10}}, SYNC_ORDER),
+    ("tombstones",       {"version": {"$gt": 0, "$lte": 10}, "collection": {"$in": ["issues"]}},
+                         SYNC_ORDER),
+    ("version_leases",   {"at": {"$gt": datetime(2000, 1, 1)}}, [("floor", ASCENDING)]),
+    ("issue_events",     {"_id": {"$gt": ObjectId("000000000000000000000000")}}, [("_id", ASCENDING)]),
+    ("outbox",           {"status": "pending", "next_attempt_at": {"$lte": datetime(2000, 1, 1)}},
+                         [("next_attempt_at", ASCENDING)]),
+    ("upload_sessions",  {"updated": {"$lt": datetime(2000, 1, 1)}}, None),
+    ("rejected_reports", {"technician": "tech@example.com"}, [("timestamp", DESCENDING)]),
+    ("rejected_reports", {"original_issue_id": "000000000000000000000000"}, None),
+]
+
+
+def ensure_indexes(db):
+    """Create every registered index. Returns the names that failed."""
+    failed = []
+    for collection, models in INDEXES.items():
+        for model in models:
+            try:
+                db[collection].create_indexes([model])
+            except OperationFailure as e:
+                # e.g. duplicate emails block the unique index: keep booting
+                name = model.document["name"]
+                log.error("Could not create index %s.%s: %s", collection, name, e)
+                failed.append(f"{collection}.{name}")
+    return failed
@@ -2,6 +2,10 @@ from flask import Blueprint, render_template, session, flash, redirect, url_for,
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 from gridfs import GridFS
+from reports.counters import get_user_counters
+from reports.digests import NOTIFICATION_MODES
+from reports.versioning import bump_version, next_version, record_deletion
+from auth.users import current_user, invalidate_user
 main_bp = Blueprint('main', __name__, template_folder='../static/templates')
 @main_bp.route("/")
 @main_bp.route("/home")
@@ -15,15 +19,11 @@ def home():
     my_issues_count = 0
 
     if user_email:
-        # -- بيانات المستخدم (لا نُرسل كلمة المرور إلى القالب)
-        user_data = mongo.db.users.find_one({"email": user_email})
-        if user_data and "password" in user_data:
-            user_data.pop("password")
+        # -- بيانات المستخدم (المُحمِّل لا يُعيد كلمة المرور)
+        user_data = current_user()
 
-        # -- عدّ التقارير التي أبلغها
-        my_issues_count = mongo.db.issues.count_documents(
-            {"reporter_email": user_email}
-        )
+        # -- عدّ التقارير التي أبلغها (عدّاد مُخزَّن، قراءة واحدة)
+        my_issues_count = get_user_counters(mongo.db, user_email)["issues_reported"]
 
     return render_template(
         "home.html",
@@ -38,22 +38,19 @@ def profile():
         flash("Please log in first", "warning")
         return redirect(url_for("auth.root"))  # 'auth.root' is your login form route
 
-    mongo = current_app.mongo
-    user_data = mongo.db.users.find_one({"email": session["user"]})
-    if user_data and "password" in user_data:
-        del user_data["password"]
+    user_data = current_user()
 
     return render_template("profile.html", user=user_data)
 
 @main_bp.route("/update_profile", methods=["POST"])
 def update_profile():
-    """Handle profile edits for name and password."""
+    """Handle profile edits for name, password and notification mode."""
     if "user" not in session:
         flash("Please log in first", "warning")
         return redirect(url_for("auth.root"))
 
     mongo = current_app.mongo
-    user_data = mongo.db.users.find_one({"email": session["user"]})
+    user_data = current_user()
     if not user_data:
         flash("User not found", "danger")
         return redirect(url_for("main.profile"))
@@ -61,6 +58,7 @@ def update_profile():
     # Get updated fields from form
     new_name = request.form.get("name")
     new_password = request.form.get("password")
+    new_mode = request.form.get("notification_mode")
 
     update_fields = {}
     if new_name:
@@ -68,9 +66,14 @@ def update_profile():
     if new_password:
         hashed_password = generate_password_hash(new_password)
         update_fields["password"] = hashed_password
+    if new_mode in NOTIFICATION_MODES and new_mode != user_data.get("notification_mode"):
+        update_fields["notification_mode"] = new_mode
 
     if update_fields:
+        update_fields["version"] = next_version(mongo.db)
         mongo.db.users.update_one({"email": session["user"]}, {"$set": update_fields})
+        invalidate_user(session["user"])
+        bump_version(mongo.db)
         flash("Profile updated successfully", "success")
     else:
         flash("No changes made.", "info")
@@ -92,14 +95,10 @@ def about():
     my_issues_count = 0
 
     if user_email:
-        # fetch & sanitize user
-        user_data = mongo.db.users.find_one({"email": user_email})
-        if user_data and "password" in user_data:
-            user_data.pop("password")
+        # fetch user (without the password)
+        user_data = current_user()
         # count their reports
-        my_issues_count = mongo.db.issues.count_documents(
-            {"reporter_email": user_email}
-        )
+        my_issues_count = get_user_counters(mongo.db, user_email)["issues_reported"]
 
     return render_template(
         "about.html",
@@ -118,7 +117,11 @@ def delete_my_account():
 
     # remove user from DB
     mongo = current_app.mongo
-    mongo.db.users.delete_one({"email": session["user"]})
+    user = mongo.db.users.find_one_and_delete({"email": session["user"]}, projection={"_id": 1})
+    invalidate_user(session["user"])
+    if user:
+        record_deletion(mongo.db, "users", user["_id"], next_version(mongo.db))
+        bump_version(mongo.db)
     session.clear()
     flash("Your account has been deleted.", "info")
     return redirect(url_for("auth.root"))
\ No newline at end of file
@@ -2,6 +2,8 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash, current_app
 from bson import ObjectId
 from werkzeug.security import generate_password_hash
+from auth.users import invalidate_user
+from reports.versioning import bump_version, next_version, record_deletion
 
 user_roles_bp = Blueprint(
     'user_roles',
@@ -29,10 +31,15 @@ def edit_user_roles():
         if new_pass:
             update_obj["password"] = generate_password_hash(new_pass)
         if update_obj:
-            mongo.db.users.update_one(
+            update_obj["version"] = next_version(mongo.db)
+            user = mongo.db.users.find_one_and_update(
                 {"_id": ObjectId(user_id)},
-                {"$set": update_obj}
+                {"$set": update_obj},
+                projection={"email": 1}
             )
+            if user:
+                invalidate_user(user.get("email"))
+                bump_version(mongo.db)
             flash("User updated successfully.", "success")
         else:
             flash("No changes submitted.", "info")
@@ -53,8 +60,14 @@ def delete_user(user_id):
     Only admins can hit this because of @before_request.
     """
     mongo = current_app.mongo
-    result = mongo.db.users.delete_one({"_id": ObjectId(user_id)})
-    if result.deleted_count:
+    user = mongo.db.users.find_one_and_delete(
+        {"_id": ObjectId(user_id)},
+        projection={"email": 1}
+    )
+    if user:
+        invalidate_user(user.get("email"))
+        record_deletion(mongo.db, "users", user["_id"], next_version(mongo.db))
+        bump_version(mongo.db)
         flash("User deleted successfully.", "success")
     else:
         flash("User not found or already deleted.", "warning")
@@ -0,0 +1,167 @@
+# migrations.py
+#
+# Idempotent, batched data migrations. Each one only touches documents that
+# still have the old shape, so they are safe to re-run and to run while the
+# app is serving traffic:
+#
+#     flask --app run migrate
+
+from bson import ObjectId
+from pymongo import ASCENDING, UpdateOne
+
+from reports.geo import to_point
+from reports.pagination import parse_datetime
+from reports.counters import reconcile_counters
+from reports.versioning import bump_version, next_version
+
+
+def backfill_geojson_locations(db, batch_size=500):
+    """Rewrite legacy {"lat", "lng"} issue locations as GeoJSON points."""
+    legacy = {"location.lat": {"$exists": True}}
+    migrated = 0
+    while True:
+        batch = list(db.issues.find(legacy, {"location": 1}).limit(batch_size))
+        if not batch:
+            return migrated
+        ops = []
+        for doc in batch:
+            loc = doc["location"]
+            try:
+                point = to_point(loc["lat"], loc["lng"])
+            except (KeyError, TypeError, ValueError):
+                point = None
+            # match the old value too, so a concurrent write is never overwritten
+            ops.append(UpdateOne(
+                {"_id": doc["_id"], "location": loc},
+                {"$set": {"location": point}}
+            ))
+        migrated += db.issues.bulk_write(ops, ordered=False).modified_count
+
+
+def normalize_done_issues(db, batch_size=500):
+    """
+    done_issues.original_issue_id as an ObjectId (so the review queue can
+    $lookup the issue) and an explicit review status on every report.
+    """
+    legacy = {"$or": [
+        {"original_issue_id": {"$type": "string"}},
+        {"status": {"$exists": False}},
+    ]}
+    migrated = 0
+    last_id = None
+    while True:
+        query = legacy if last_id is None else {"$and": [legacy, {"_id": {"$gt": last_id}}]}
+        batch = list(
+            db.done_issues.find(query, {"original_issue_id": 1, "status": 1})
+            .sort("_id", ASCENDING).limit(batch_size)
+        )
+        if not batch:
+            return migrated
+        last_id = batch[-1]["_id"]
+
+        issue_ids = {}
+        for doc in batch:
+            try:
+                issue_ids[doc["_id"]] = ObjectId(doc.get("original_issue_id"))
+            except Exception:
+                issue_ids[doc["_id"]] = None
+        done = {
+            i["_id"] for i in db.issues.find(
+                {"_id": {"$in": [oid for oid in issue_ids.values() if oid]}, "status": "done"},
+                {"_id": 1}
+            )
+        }
+
+        ops = []
+        for doc in batch:
+            oid = issue_ids[doc["_id"]]
+            update = {}
+            if oid and isinstance(doc.get("original_issue_id"), str):
+                update["original_issue_id"] = oid
+            if "status" not in doc:
+                update["status"] = "accepted" if oid in done else "pending"
+            if update:
+                ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": update}))
+        if ops:
+            migrated += db.done_issues.bulk_write(ops, ordered=False).modified_count
+
+
+TIMESTAMPED = ("issues", "done_issues", "rejected_reports")
+
+
+def backfill_datetime_timestamps(db, batch_size=500):
+    """Rewrite legacy ISO-string timestamps as BSON dates (naive UTC)."""
+    migrated = 0
+    for name in TIMESTAMPED:
+        collection = db[name]
+        legacy = {"timestamp": {"$type": "string"}}
+        last_id = None
+        while True:
+            query = legacy if last_id is None else {"$and": [legacy, {"_id": {"$gt": last_id}}]}
+            batch = list(
+                collection.find(query, {"timestamp": 1})
+                .sort("_id", ASCENDING).limit(batch_size)
+            )
+            if not batch:
+                break
+            # unparseable values are skipped (and reported by the count)
+            last_id = batch[-1]["_id"]
+            ops = []
+            for doc in batch:
+                try:
+                    ts = parse_datetime(doc["timestamp"])
+                except ValueError:
+                    continue
+                ops.append(UpdateOne(
+                    {"_id": doc["_id"], "timestamp": doc["timestamp"]},
+                    {"$set": {"timestamp": ts}}
+                ))
+            if ops:
+                migrated += collection.bulk_write(ops, ordered=False).modified_count
+    return migrated
+
+
+VERSIONED = ("issues", "done_issues", "users")
+
+
+def backfill_versions(db, batch_size=500):
+    """
+    Stamp documents written before delta sync (reports/changes.py) with one
+    fresh change-version, so a sync from 0 picks them up.
+    """
+    missing = {"version": {"$exists": False}}
+    version = None
+    migrated = 0
+    for name in VERSIONED:
+        collection = db[name]
+        last_id = None
+        while True:
+            query = missing if last_id is None else {"$and": [missing, {"_id": {"$gt": last_id}}]}
+            batch = list(collection.find(query, {"_id": 1}).sort("_id", ASCENDING).limit(batch_size))
+            if not batch:
+                break
+            last_id = batch[-1]["_id"]
+            if version is None:
+                version = next_version(db)
+            ops = [UpdateOne({"_id": doc["_id"], **missing}, {"$set": {"version": version}})
+                   for doc in batch]
+            migrated += collection.bulk_write(ops, ordered=False).modified_count
+    if migrated:
+        bump_version(db)
+    return migrated
+
+
+# Run in order by `flask migrate`
+MIGRATIONS = [
+    ("issues.location -> GeoJSON", backfill_geojson_locations),
+    ("done_issues review fields",  normalize_done_issues),
+    ("timestamps -> BSON dates",   backfill_datetime_timestamps),
+    ("change-versions",            backfill_versions),
+    ("user_counters rebuild",      reconcile_counters),
+]
+
+
+def run_all(db, log=print):
+    for name, migration in MIGRATIONS:
+        result = migration(db)
+        log(f"{name}: {result if result is not None else 'ok'}")
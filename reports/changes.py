@@ -0,0 +1,112 @@
+# reports/changes.py
+#
+# Delta sync. Every write stamps the documents it touches with a number from
+# the change-version counter (versioning.py) and leaves a tombstone for the
+# ones it deletes:
+#
+#     tombstones  {collection, doc_id, version, deleted_at}
+#
+# so a client that has synced up to version V asks for everything above it:
+#
+#     GET /api/issues/changes?since=V
+#     -> {"version", "has_more", "next_cursor", "issues", "done_reports",
+#         "deleted"[, "users"]}
+#
+# While `has_more` is set it follows `next_cursor` (?cursor=...); after the
+# last page it keeps `version` for next time. Pages are cut in (version,
+# kind, _id) order, so documents sharing a version (one write touching
+# several, or a backfill) are never skipped, and `version` is the newest
+# version whose writes have all landed, never one still being written.
+# Users and their tombstones are only included for admins.
+
+import base64
+import binascii
+
+from bson import json_util
+
+from .pagination import PaginationError, MAX_LIMIT
+from .versioning import committed_version
+
+USER_SYNC_FIELDS = {"email": 1, "name": 1, "role": 1, "version": 1}
+# cursor order of the kinds
+KINDS = ("issues", "done_reports", "deleted", "users")
+PAGE_ORDER = [("version", 1), ("_id", 1)]
+
+
+def parse_since(value):
+    try:
+        since = int(value)
+    except (TypeError, ValueError):
+        raise PaginationError("since must be a version number")
+    if since < 0:
+        raise PaginationError("since must be a version number")
+    return since
+
+
+def encode_changes_cursor(upto, version, kind, last_id):
+    raw = json_util.dumps({"u": upto, "v": version, "k": kind, "i": last_id})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_changes_cursor(token):
+    padded = token + "=" * (-len(token) % 4)
+    try:
+        data = json_util.loads(base64.urlsafe_b64decode(padded.encode()))
+        return data["u"], (data["v"], data["k"], data["i"])
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise PaginationError("Invalid cursor")
+
+
+def _after(position, kind, upto):
+    """Versions of `kind` after `position` = (version, kind index, _id)."""
+    version, after_kind, last_id = position
+    if kind < after_kind:
+        return {"version": {"$gt": version, "$lte": upto}}
+    if kind > after_kind:
+        return {"version": {"$gte": version, "$lte": upto}}
+    return {"$or": [
+        {"version": {"$gt": version, "$lte": upto}},
+        {"version": version, "_id": {"$gt": last_id}},
+    ]}
+
+
+def changes_since(db, since=0, limit=MAX_LIMIT, include_users=False, cursor=None):
+    """
+    Documents and tombstones with a version in (since, committed], oldest
+    first, at most `limit` in all. With `cursor` (a previous page's
+    next_cursor), the page after that one, up to the same version.
+    """
+    if cursor:
+        upto, position = decode_changes_cursor(cursor)
+    else:
+        upto, position = committed_version(db), (since, len(KINDS), None)
+
+    deleted_from = ["issues", "done_issues"] + (["users"] if include_users else [])
+    sources = {
+        "issues":       (db.issues, {}, None),
+        "done_reports": (db.done_issues, {}, None),
+        "deleted":      (db.tombstones, {"collection": {"$in": deleted_from}},
+                         {"deleted_at": 0}),
+    }
+    if include_users:
+        sources["users"] = (db.users, {}, USER_SYNC_FIELDS)
+
+    merged = []
+    for key, (collection, query, projection) in sources.items():
+        kind = KINDS.index(key)
+        query = dict(query, **_after(position, kind, upto))
+        for doc in collection.find(query, projection).sort(PAGE_ORDER).limit(limit + 1):
+            merged.append(((doc["version"], kind, doc["_id"]), key, doc))
+    merged.sort(key=lambda item: item[0])
+
+    result = {key: [] for key in sources}
+    for _, key, doc in merged[:limit]:
+        if key == "deleted":
+            doc.pop("_id")
+        result[key].append(doc)
+    # a client ahead of the committed version keeps its own
+    result["version"] = max(upto, position[0])
+    result["has_more"] = len(merged) > limit
+    result["next_cursor"] = encode_changes_cursor(upto, *merged[limit - 1][0]) \
+        if result["has_more"] else None
+    return result
@@ -0,0 +1,118 @@
+# reports/counters.py
+
+import logging
+import threading
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+log = logging.getLogger(__name__)
+
+# Materialized per-user counters, one document per email in `user_counters`:
+#   issues_reported  issues whose reporter_email is the user
+#   open_rejections  rejected completion reports of the technician whose
+#                    issue is still open (not done / fixed)
+# Write paths keep them current with $inc; reconcile_counters() rebuilds them
+# from the source collections to repair any drift.
+CLOSED_STATUSES = ("done", "fixed")
+_FIELDS = ("issues_reported", "open_rejections")
+
+
+def get_user_counters(db, email):
+    """Single point read by _id; missing counters read as 0."""
+    doc = db.user_counters.find_one({"_id": email}) if email else None
+    return {f: max(0, (doc or {}).get(f, 0)) for f in _FIELDS}
+
+
+def _inc(db, email, field, amount):
+    if email:
+        db.user_counters.update_one({"_id": email}, {"$inc": {field: amount}}, upsert=True)
+
+
+def issue_created(db, reporter_email):
+    _inc(db, reporter_email, "issues_reported", 1)
+
+
+def issue_rejected(db, technician):
+    _inc(db, technician, "open_rejections", 1)
+
+
+def _close_rejections(db, issue_id):
+    """The issue stopped being open: its rejections no longer count."""
+    for r in db.rejected_reports.find({"original_issue_id": str(issue_id)}, {"technician": 1}):
+        _inc(db, r.get("technician"), "open_rejections", -1)
+
+
+def issue_completed(db, issue):
+    """Call with the issue as it was *before* it was marked done."""
+    if issue.get("status") not in CLOSED_STATUSES:
+        _close_rejections(db, issue["_id"])
+
+
+def issue_reopened(db, issue):
+    """Call with the issue as it was *before* it went back to in progress."""
+    if issue.get("status") in CLOSED_STATUSES:
+        for r in db.rejected_reports.find({"original_issue_id": str(issue["_id"])}, {"technician": 1}):
+            _inc(db, r.get("technician"), "open_rejections", 1)
+
+
+def issue_deleted(db, issue):
+    """Call with the deleted issue document."""
+    _inc(db, issue.get("reporter_email"), "issues_reported", -1)
+    if issue.get("status") not in CLOSED_STATUSES:
+        _close_rejections(db, issue["_id"])
+
+
+def reconcile_counters(db):
+    """Recompute every counter from issues / rejected_reports. Returns the number of users."""
+    counts = {}
+
+    for row in db.issues.aggregate([
+        {"$group": {"_id": "$reporter_email", "n": {"$sum": 1}}}
+    ]):
+        if row["_id"]:
+            counts.setdefault(row["_id"], dict.fromkeys(_FIELDS, 0))["issues_reported"] = row["n"]
+
+    rejected = []
+    for r in db.rejected_reports.find({}, {"technician": 1, "original_issue_id": 1}):
+        try:
+            rejected.append((r.get("technician"), ObjectId(r.get("original_issue_id"))))
+        except Exception:
+            continue
+    open_ids = {
+        i["_id"] for i in db.issues.find(
+            {"_id": {"$in": list({oid for _, oid in rejected})},
+             "status": {"$nin": list(CLOSED_STATUSES)}},
+            {"_id": 1}
+        )
+    }
+    for technician, oid in rejected:
+        if technician and oid in open_ids:
+            counts.setdefault(technician, dict.fromkeys(_FIELDS, 0))["open_rejections"] += 1
+
+    ops = [UpdateOne({"_id": email}, {"$set": values}, upsert=True)
+           for email, values in counts.items()]
+    if ops:
+        db.user_counters.bulk_write(ops, ordered=False)
+    # users that no longer have anything to count
+    db.user_counters.update_many(
+        {"_id": {"$nin": list(counts)}},
+        {"$set": dict.fromkeys(_FIELDS, 0)}
+    )
+    return len(counts)
+
+
+def start_reconciler(app, interval):
+    """Re-run reconcile_counters every `interval` seconds in a daemon thread."""
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                with app.app_context():
+                    reconcile_counters(app.mongo.db)
+            except Exception:
+                log.exception("Counter reconciliation failed")
+
+    threading.Thread(target=loop, name="counter-reconciler", daemon=True).start()
+    return stop
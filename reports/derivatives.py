@@ -0,0 +1,273 @@
+# reports/derivatives.py
+#
+# Downscaled copies ("derivatives") of uploaded photos for dashboards and
+# lists. Upload routes only enqueue the new file id; a dispatcher thread reads
+# the original from GridFS and renders the sizes in a process pool, then the
+# results are stored in GridFS next to the original:
+#
+#     fs.files  {metadata: {derivative_of: <original id>, size: "thumb"}}
+#
+# and the original is marked {metadata: {derivatives: "done"}}. An original
+# Pillow fails to render MAX_RENDER_ATTEMPTS times (corrupt, HEIC, ...) is
+# marked "failed" instead, so it is neither read nor rendered again.
+#
+# Served through /uploads/<id>?size=thumb|medium|full (see images.py).
+#
+# The queue is in memory: ids dropped when it is full, or still pending when
+# a process stops, are queued again by the periodic sweep.
+
+import io
+import logging
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from gridfs import GridFS
+from pymongo import ReturnDocument
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # in requirements.txt; dev setups without it serve the originals
+    Image = None
+
+log = logging.getLogger(__name__)
+
+AVAILABLE = Image is not None
+
+# size name -> longest edge in pixels ("full" is the original)
+SIZES = {"thumb": 320, "medium": 1280}
+SERVED_SIZES = tuple(SIZES) + ("full",)
+QUALITY = 80
+QUEUE_SIZE = 1000
+MAX_RENDER_ATTEMPTS = 3
+
+_queue = queue.Queue(maxsize=QUEUE_SIZE)
+
+
+def _output_format():
+    if features.check("webp"):
+        return "WEBP", "image/webp", "webp"
+    return "JPEG", "image/jpeg", "jpg"
+
+
+def render_derivatives(data, sizes=SIZES):
+    """
+    Original image bytes -> {size name: (bytes, content type)}.
+
+    Runs in a pool worker. The EXIF orientation is applied to the pixels and
+    no metadata (EXIF, GPS, ICC) is written to the output. Images are only
+    ever scaled down.
+    """
+    fmt, content_type, _ = _output_format()
+    with Image.open(io.BytesIO(data)) as original:
+        img = ImageOps.exif_transpose(original)
+        has_alpha = img.mode in ("RGBA", "LA") or "transparency" in img.info
+        img = img.convert("RGBA" if has_alpha and fmt == "WEBP" else "RGB")
+        out = {}
+        for name, edge in sizes.items():
+            scaled = img.copy()
+            scaled.thumbnail((edge, edge), Image.LANCZOS)
+            buf = io.BytesIO()
+            scaled.save(buf, fmt, quality=QUALITY)
+            out[name] = (buf.getvalue(), content_type)
+    return out
+
+
+def find_derivative(db, file_id, size):
+    """fs.files document of one derivative, or None if it isn't rendered (yet)."""
+    return db.fs.files.find_one({"metadata.derivative_of": file_id, "metadata.size": size})
+
+
+def _mark(db, file_id, state):
+    db.fs.files.update_one({"_id": file_id}, {"$set": {"metadata.derivatives": state}})
+
+
+def _render_failed(db, file_id):
+    doc = db.fs.files.find_one_and_update(
+        {"_id": file_id},
+        {"$inc": {"metadata.derivative_failures": 1}},
+        return_document=ReturnDocument.AFTER
+    )
+    if doc and doc["metadata"]["derivative_failures"] >= MAX_RENDER_ATTEMPTS:
+        log.warning("Giving up on the derivatives of %s", file_id)
+        _mark(db, file_id, "failed")
+
+
+def _needs_derivatives(db, file_doc):
+    if not (file_doc.get("contentType") or "").startswith("image/"):
+        return False
+    metadata = file_doc.get("metadata") or {}
+    if metadata.get("derivative_of") or metadata.get("derivatives"):
+        return False
+    have = db.fs.files.count_documents({"metadata.derivative_of": file_doc["_id"]})
+    if have >= len(SIZES):
+        # rendered before originals were marked
+        _mark(db, file_doc["_id"], "done")
+        return False
+    return True
+
+
+def store_derivatives(db, file_doc, rendered):
+    fs = GridFS(db)
+    _, _, ext = _output_format()
+    stem = (file_doc.get("filename") or str(file_doc["_id"])).rsplit(".", 1)[0]
+    for name, (data, content_type) in rendered.items():
+        if find_derivative(db, file_doc["_id"], name):
+            continue
+        fs.put(
+            data,
+            filename=f"{stem}-{name}.{ext}",
+            content_type=content_type,
+            metadata={"derivative_of": file_doc["_id"], "size": name}
+        )
+    _mark(db, file_doc["_id"], "done")
+
+
+def generate_derivatives(db, file_id):
+    """Render and store the missing derivatives of one file, in-process."""
+    file_doc = db.fs.files.find_one({"_id": file_id})
+    if not AVAILABLE or not file_doc or not _needs_derivatives(db, file_doc):
+        return False
+    data = GridFS(db).get(file_id).read()
+    try:
+        rendered = render_derivatives(data)
+    except Exception:
+        _render_failed(db, file_id)
+        raise
+    store_derivatives(db, file_doc, rendered)
+    return True
+
+
+def _originals(db):
+    """Images neither rendered nor given up on (index derivatives_pending)."""
+    return db.fs.files.find({
+        "metadata.derivatives": None,
+        "metadata.derivative_of": None,
+        "contentType": {"$regex": "^image/"},
+    })
+
+
+def generate_missing(db):
+    """Backfill derivatives for every original image. Returns the number rendered."""
+    rendered = 0
+    for doc in _originals(db):
+        try:
+            rendered += generate_derivatives(db, doc["_id"])
+        except Exception:
+            log.exception("Could not render derivatives of %s", doc["_id"])
+    return rendered
+
+
+def enqueue_missing(db):
+    """
+    Queue every original still missing derivatives, as far as the queue has
+    room; the rest waits for the next pass. Returns the number queued.
+    """
+    queued = 0
+    for doc in _originals(db):
+        if not _needs_derivatives(db, doc):
+            continue
+        try:
+            _queue.put_nowait(doc["_id"])
+        except queue.Full:
+            break
+        queued += 1
+    return queued
+
+
+def enqueue(*file_ids):
+    """Ask for the derivatives of freshly uploaded files. Never blocks."""
+    if not AVAILABLE:
+        return
+    for file_id in file_ids:
+        if file_id is None:
+            continue
+        try:
+            _queue.put_nowait(file_id)
+        except queue.Full:
+            log.warning("Derivative queue full, dropped %s (the next sweep queues it again)", file_id)
+
+
+def start_derivative_worker(app, processes=2):
+    """
+    Dispatcher thread feeding a process pool. At most 2 x `processes` images
+    are in flight, so originals waiting for a worker don't pile up in memory.
+    Returns a stop Event, or None when Pillow isn't installed.
+    """
+    if not AVAILABLE:
+        log.info("Pillow is not installed, image derivatives are disabled")
+        return None
+
+    stop = threading.Event()
+    slots = threading.BoundedSemaphore(processes * 2)
+    # spawn: never fork a process that is running threads
+    pool = ProcessPoolExecutor(
+        max_workers=processes, mp_context=multiprocessing.get_context("spawn")
+    )
+
+    def finished(file_doc, future):
+        slots.release()
+        if future.cancelled():
+            # shutting down; the sweep queues it again
+            return
+        try:
+            with app.app_context():
+                db = app.mongo.db
+                try:
+                    rendered = future.result()
+                except Exception:
+                    _render_failed(db, file_doc["_id"])
+                    raise
+                store_derivatives(db, file_doc, rendered)
+        except Exception:
+            log.exception("Could not render derivatives of %s", file_doc["_id"])
+
+    def loop():
+        while not stop.is_set():
+            try:
+                file_id = _queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                with app.app_context():
+                    db = app.mongo.db
+                    file_doc = db.fs.files.find_one({"_id": file_id})
+                    if not file_doc or not _needs_derivatives(db, file_doc):
+                        continue
+                    data = GridFS(db).get(file_id).read()
+                slots.acquire()
+                pool.submit(render_derivatives, data).add_done_callback(partial(finished, file_doc))
+            except Exception:
+                log.exception("Could not queue derivatives of %s", file_id)
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    threading.Thread(target=loop, name="image-derivatives", daemon=True).start()
+    return stop
+
+
+def start_derivative_sweeper(app, interval):
+    """
+    Every `interval` seconds, queue the originals whose derivatives were never
+    rendered: the queue lives in memory, so work dropped when it was full or
+    cancelled when a process stopped is picked up again. Returns a stop
+    Event, or None when Pillow isn't installed.
+    """
+    if not AVAILABLE:
+        return None
+
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                with app.app_context():
+                    queued = enqueue_missing(app.mongo.db)
+                if queued:
+                    log.info("Queued %d images missing derivatives", queued)
+            except Exception:
+                log.exception("Derivative sweep failed")
+
+    threading.Thread(target=loop, name="derivative-sweeper", daemon=True).start()
+    return stop
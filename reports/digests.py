@@ -0,0 +1,85 @@
+# reports/digests.py
+#
+# Notification digests. Users whose `notification_mode` is "digest" don't get
+# one email per notification: send_email (email_utils.py) appends it to their
+# open digest instead, and a flusher merges everything collected during
+# DIGEST_WINDOW_SECONDS into a single outbox message:
+#
+#     email_digests  {to, items: [{subject, body, at}], created, flush_at}
+#
+# Notifications only go into a digest whose flush_at is still ahead, so a due
+# digest no longer changes. The flusher enqueues it under the digest's own id
+# (enqueueing twice after a crash is a no-op) and only then deletes it.
+
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+from .outbox import enqueue_email
+
+log = logging.getLogger(__name__)
+
+NOTIFICATION_MODES = ("immediate", "digest")
+DEFAULT_MODE = "immediate"
+
+# a due digest is left alone this long, in case a request with a slower
+# clock is still adding to it
+FLUSH_GRACE_SECONDS = 5
+
+
+def notification_mode(user):
+    mode = (user or {}).get("notification_mode")
+    return mode if mode in NOTIFICATION_MODES else DEFAULT_MODE
+
+
+def add_to_digest(db, to_email, subject, body, window_seconds):
+    now = datetime.utcnow()
+    result = db.email_digests.update_one(
+        {"to": to_email, "flush_at": {"$gt": now}},
+        {"$push": {"items": {"subject": subject, "body": body, "at": now}},
+         "$setOnInsert": {"created": now, "flush_at": now + timedelta(seconds=window_seconds)}},
+        upsert=True
+    )
+    return result.upserted_id
+
+
+def compose_digest(items):
+    """(subject, body) of the one message replacing `items`."""
+    if len(items) == 1:
+        return items[0]["subject"], items[0]["body"]
+    subject = f"CityFix: {len(items)} updates on your reports"
+    parts = [f"{item['subject']}\n\n{item['body']}" for item in items]
+    return subject, ("\n\n" + "-" * 40 + "\n\n").join(parts)
+
+
+def flush_digests(db):
+    """Move every due digest to the outbox. Returns the number flushed."""
+    cutoff = datetime.utcnow() - timedelta(seconds=FLUSH_GRACE_SECONDS)
+    flushed = 0
+    for digest in db.email_digests.find({"flush_at": {"$lte": cutoff}}).sort("flush_at", 1):
+        subject, body = compose_digest(digest["items"])
+        try:
+            enqueue_email(db, digest["to"], subject, body, _id=digest["_id"])
+        except DuplicateKeyError:
+            pass  # enqueued by a run that died before the delete
+        db.email_digests.delete_one({"_id": digest["_id"]})
+        flushed += 1
+    return flushed
+
+
+def start_digest_flusher(app, interval):
+    """Run flush_digests every `interval` seconds in a daemon thread."""
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                with app.app_context():
+                    flush_digests(app.mongo.db)
+            except Exception:
+                log.exception("Digest flush failed")
+
+    threading.Thread(target=loop, name="email-digests", daemon=True).start()
+    return stop
@@ -2,14 +2,22 @@
 from flask import (
     Blueprint, render_template, current_app,
     session, flash, redirect, url_for, abort,
-    request, jsonify, send_file
+    request
 )
 from bson import ObjectId
 from datetime import datetime
-from gridfs import GridFS
-import io
 
 from .email_utils import send_email
+from .versioning import bump_version, next_version, record_deletion, etag_by_version
+from .events import publish_event
+from .serializers import json_response
+from .images import send_gridfs_file
+from auth.users import current_user
+from . import counters
+from .pagination import (
+    paginate, stream_ndjson, wants_stream, split_fields, parse_limit,
+    page_filter, encode_cursor, parse_datetime, PaginationError, DONE_REPORT_FIELDS
+)
 
 
 done_reports_bp = Blueprint(
@@ -21,33 +29,118 @@ done_reports_bp = Blueprint(
 # ---------- Serve before/after images from GridFS ----------
 @done_reports_bp.route("/done_uploads/<file_id>")
 def serve_done_upload(file_id):
-    mongo = current_app.mongo
-    fs = GridFS(mongo.db)
-    try:
-        grid_out = fs.get(ObjectId(file_id))
-    except Exception:
-        abort(404)
-    return send_file(
-        io.BytesIO(grid_out.read()),
-        mimetype=grid_out.content_type or "application/octet-stream",
-        as_attachment=False,
-        download_name=grid_out.filename
-    )
+    """?size=thumb|medium|full (default)"""
+    return send_gridfs_file(current_app.mongo.db, file_id, request.args.get("size", "full"))
 
 # ---------- JSON API for done reports ----------
+def serialize_done_report(dr, projected=False):
+    """API view of a done report; the default shape is kept for full documents."""
+    if projected:
+        return dr
+    return {
+        "_id":                    str(dr["_id"]),
+        "before_file_id":         str(dr.get("before_file_id", "")),
+        "after_file_id":          str(dr.get("after_file_id", "")),
+        "completion_description": dr.get("completion_description", ""),
+        "timestamp":              dr.get("timestamp", "")
+    }
+
 @done_reports_bp.route("/api/done_reports")
+@etag_by_version
 def api_done_reports():
-    docs = current_app.mongo.db.done_issues.find().sort("timestamp", -1)
-    out = []
-    for dr in docs:
-        out.append({
-            "_id":                    str(dr["_id"]),
-            "before_file_id":         str(dr.get("before_file_id", "")),
-            "after_file_id":          str(dr.get("after_file_id", "")),
-            "completion_description": dr.get("completion_description", ""),
-            "timestamp":              dr.get("timestamp", "")
-        })
-    return jsonify(done_reports=out)
+    """
+    One page of done reports, newest first (limit / cursor / fields like
+    /api/issues), or the whole listing as NDJSON with ?stream=1.
+    """
+    projected = bool(split_fields(request.args.get("fields")))
+    try:
+        if wants_stream():
+            return stream_ndjson(
+                current_app.mongo.db.done_issues, {}, DONE_REPORT_FIELDS,
+                lambda dr: serialize_done_report(dr, projected)
+            )
+        docs, next_cursor = paginate(
+            current_app.mongo.db.done_issues, {}, DONE_REPORT_FIELDS
+        )
+    except PaginationError as e:
+        return json_response({"error": str(e)}, 400)
+
+    return json_response({
+        "done_reports": [serialize_done_report(dr, projected) for dr in docs],
+        "next_cursor":  next_cursor
+    })
+
+# ---------- Admin review queue ----------
+# done_issues.status is "pending" until an admin accepts the work (rejected
+# reports are moved to rejected_reports). Legacy documents without a status
+# count as pending until `flask migrate` backfills them.
+REVIEW_FILTERS = {
+    "pending":  {"status": {"$in": ["pending", None]}},
+    "accepted": {"status": "accepted"},
+    "all":      {},
+}
+REVIEW_PAGE_SIZE = 20
+
+def review_queue_page(db, status, cursor=None, limit=REVIEW_PAGE_SIZE):
+    """
+    One page of done reports (newest first) with the original issue's status
+    joined in by a single aggregation; the page is cut before the $lookup, so
+    the join only ever touches `limit` issues.
+    """
+    if status not in REVIEW_FILTERS:
+        raise PaginationError("Unknown status")
+    docs = list(db.done_issues.aggregate([
+        {"$match": page_filter(REVIEW_FILTERS[status], cursor)},
+        {"$sort": {"timestamp": -1, "_id": -1}},
+        {"$limit": limit + 1},
+        {"$lookup": {
+            "from":         "issues",
+            "localField":   "original_issue_id",
+            "foreignField": "_id",
+            "as":           "issue",
+        }},
+        {"$addFields": {"issue_status": {"$ifNull": [{"$arrayElemAt": ["$issue.status", 0]}, ""]}}},
+        {"$project": {"issue": 0}},
+    ]))
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+def _display_fields(dr):
+    """Template-friendly copy of a review queue row."""
+    dr["_id"] = str(dr["_id"])
+    dr["original_issue_id"] = str(dr.get("original_issue_id", ""))
+    dr["before_file_id"] = str(dr.get("before_file_id", ""))
+    dr["after_file_id"] = str(dr.get("after_file_id", ""))
+    dr["completion_description"] = dr.get("completion_description", "")
+
+    # Format timestamp (legacy ISO strings until `flask migrate`)
+    ts = dr.get("timestamp")
+    try:
+        dt = ts if isinstance(ts, datetime) else parse_datetime(ts)
+    except (TypeError, ValueError, AttributeError):
+        dt = datetime.utcnow()
+    dr["display_date"] = dt.strftime("%Y-%m-%d")
+    dr["display_time"] = dt.strftime("%H:%M:%S")
+    return dr
+
+@done_reports_bp.route("/api/admin/review_queue")
+def api_review_queue():
+    """?status=pending|accepted|all, cursor, limit -> one page of the review queue."""
+    if "user" not in session:
+        return json_response({"error": "Please log in first"}, 401)
+    user_data = current_user()
+    if not user_data or user_data.get("role") != "admin":
+        return json_response({"error": "Admins only."}, 403)
+    try:
+        docs, next_cursor = review_queue_page(
+            current_app.mongo.db,
+            request.args.get("status", "pending"),
+            request.args.get("cursor"),
+            parse_limit(request.args.get("limit"), default=REVIEW_PAGE_SIZE)
+        )
+    except PaginationError as e:
+        return json_response({"error": str(e)}, 400)
+    return json_response({"done_reports": docs, "next_cursor": next_cursor})
 
 # ---------- Admin view of done reports ----------
 @done_reports_bp.route("/admin/done_reports")
@@ -55,40 +148,25 @@ def done_issue():
     if "user" not in session:
         flash("Please log in first", "warning")
         return redirect(url_for("auth.root"))
-    user_data = current_app.mongo.db.users.find_one({"email": session["user"]})
+    user_data = current_user()
     if not user_data or user_data.get("role") != "admin":
         flash("Admins only.", "danger")
         return redirect(url_for("auth.dashboard"))
 
-    done_reports = []
-    for dr in current_app.mongo.db.done_issues.find().sort("timestamp", -1):
-        dr["_id"] = str(dr["_id"])
-        dr["before_file_id"] = str(dr.get("before_file_id", ""))
-        dr["after_file_id"] = str(dr.get("after_file_id", ""))
-        dr["completion_description"] = dr.get("completion_description", "")
-
-        # Format timestamp
-        try:
-            dt = datetime.fromisoformat(dr.get("timestamp", ""))
-        except:
-            dt = datetime.now()
-        dr["display_date"] = dt.strftime("%Y-%m-%d")
-        dr["display_time"] = dt.strftime("%H:%M:%S")
-
-        # Pull main issue status
-        try:
-            orig_id = ObjectId(dr.get("original_issue_id"))
-            main_issue = current_app.mongo.db.issues.find_one({"_id": orig_id})
-            dr["issue_status"] = main_issue.get("status", "") if main_issue else ""
-        except:
-            dr["issue_status"] = ""
-
-        done_reports.append(dr)
+    status = request.args.get("status", "pending")
+    try:
+        docs, next_cursor = review_queue_page(
+            current_app.mongo.db, status, request.args.get("cursor")
+        )
+    except PaginationError:
+        abort(400)
 
     return render_template(
         "done_reports.html",
         user=user_data,
-        done_reports=done_reports
+        done_reports=[_display_fields(dr) for dr in docs],
+        status=status,
+        next_cursor=next_cursor
     )
 
 # ---------- Review (accept/reject) ----------
@@ -97,7 +175,7 @@ def review_done_report(dr_id):
     if "user" not in session:
         flash("Please log in", "warning")
         return redirect(url_for("auth.root"))
-    user_data = current_app.mongo.db.users.find_one({"email": session["user"]})
+    user_data = current_user()
     if not user_data or user_data.get("role") != "admin":
         flash("Admins only.", "danger")
         return redirect(url_for("auth.dashboard"))
@@ -114,7 +192,16 @@ def review_done_report(dr_id):
     reporter_email = issue.get("reporter_email")
 
     if status == "accepted":
-        current_app.mongo.db.issues.update_one({"_id": orig_id}, {"$set": {"status": "done"}})
+        version = next_version(current_app.mongo.db)
+        current_app.mongo.db.issues.update_one(
+            {"_id": orig_id}, {"$set": {"status": "done", "version": version}}
+        )
+        current_app.mongo.db.done_issues.update_one(
+            {"_id": dr_obj}, {"$set": {"status": "accepted", "version": version}}
+        )
+        counters.issue_completed(current_app.mongo.db, issue)
+        bump_version(current_app.mongo.db)
+        publish_event(current_app.mongo.db, "status", orig_id, status="done")
         subject = "Your Report Has Been Completed"
         body = (
             f"Hello,\n\nGreat news! Your report #{orig_id} was marked done.\n\n"
@@ -133,15 +220,26 @@ def review_done_report(dr_id):
         if not reason:
             flash("Rejection reason required.", "danger")
             return redirect(url_for("done_reports.done_issue"))
+        version = next_version(current_app.mongo.db)
         current_app.mongo.db.done_issues.delete_one({"_id": dr_obj})
-        current_app.mongo.db.issues.update_one({"_id": orig_id}, {"$set": {"status": "in progress"}})
+        record_deletion(current_app.mongo.db, "done_issues", dr_obj, version)
+        current_app.mongo.db.issues.update_one(
+            {"_id": orig_id}, {"$set": {"status": "in progress", "version": version}}
+        )
+        bump_version(current_app.mongo.db)
+        publish_event(current_app.mongo.db, "status", orig_id, status="in progress")
+        counters.issue_reopened(current_app.mongo.db, issue)
         current_app.mongo.db.rejected_reports.insert_one({
-            "original_issue_id": dr.get("original_issue_id"),
+            "original_issue_id": str(orig_id),
+            # the photos' references move here (they are often resubmitted)
+            "before_file_id": dr.get("before_file_id"),
+            "after_file_id": dr.get("after_file_id"),
             "technician": dr.get("technician"),
             "rejection_reason": reason,
             "admin": session["user"],
-            "timestamp": datetime.utcnow().isoformat()
+            "timestamp": datetime.utcnow()
         })
+        counters.issue_rejected(current_app.mongo.db, dr.get("technician"))
         flash("Report rejected and sent back.", "warning")
 
     else:
@@ -1,31 +1,18 @@
 # reports/email_utils.py
 
-import smtplib
-from email.message import EmailMessage
-from email.utils import formataddr
 from flask import current_app
 
-def send_email(to_email: str, subject: str, body: str):
-    msg = EmailMessage()
-    msg["Subject"] = subject
-
-    # combine display name + address
-    display_name = current_app.config.get("MAIL_DEFAULT_SENDER_NAME")
-    sender_addr  = current_app.config["MAIL_DEFAULT_SENDER"]
-    msg["From"]  = formataddr((display_name, sender_addr))
+from auth.users import load_user
+from .digests import add_to_digest, notification_mode
+from .outbox import enqueue_email
 
-    msg["To"]     = to_email
-    msg.set_content(body)
-
-    server = smtplib.SMTP(
-        current_app.config["MAIL_SERVER"],
-        current_app.config["MAIL_PORT"]
-    )
-    if current_app.config["MAIL_USE_TLS"]:
-        server.starttls()
-    server.login(
-        current_app.config["MAIL_USERNAME"],
-        current_app.config["MAIL_PASSWORD"]
-    )
-    server.send_message(msg)
-    server.quit()
+def send_email(to_email: str, subject: str, body: str):
+    """
+    Queue a message; the outbox worker (outbox.py) delivers it. Recipients
+    who chose digest delivery get it merged into their next digest instead.
+    """
+    db = current_app.mongo.db
+    if notification_mode(load_user(to_email)) == "digest":
+        add_to_digest(db, to_email, subject, body, current_app.config["DIGEST_WINDOW_SECONDS"])
+        return None
+    return enqueue_email(db, to_email, subject, body)
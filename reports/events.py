@@ -0,0 +1,235 @@
+# reports/events.py
+#
+# Live issue changes pushed to browsers as Server-Sent Events:
+#
+#     GET /api/issues/events        text/event-stream
+#
+# Write routes call publish_event() next to bump_version(), which appends to
+# the `issue_events` collection (a TTL index drops them after a day):
+#
+#     issue_events  {kind, issue_id, data, at}
+#
+# kind: created (data.issue), assigned (assigned_to, status), status (status),
+# completed (done_report_id, technician), deleted.
+#
+# One EventBroadcaster per process follows the collection, through a change
+# stream where the server has them and by polling on a standalone server,
+# and fans every event out to the per-client queues of the open streams.
+# A stream that falls too far behind is closed; the browser reconnects with
+# Last-Event-ID and the missed events are replayed from the collection.
+#
+# Each open stream is an idle generator waiting on its queue. Run the app
+# under gevent (gunicorn -k gevent) so hundreds of them cost greenlets, not
+# worker threads. A worker on its way out calls close() (see
+# gunicorn.conf.py), which ends its streams at once instead of letting them
+# hold up the shutdown; browsers reconnect to another worker.
+
+import logging
+import queue
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from flask import Blueprint, Response, current_app, request
+from pymongo.errors import OperationFailure, PyMongoError
+
+from .serializers import dumps, issue_view
+
+log = logging.getLogger(__name__)
+
+events_bp = Blueprint("events", __name__)
+
+POLL_SECONDS      = 1.0
+# events of other processes may carry a slightly older ObjectId than the
+# newest one seen, so polling looks back this far and skips repeats
+POLL_LOOKBACK     = timedelta(seconds=5)
+HEARTBEAT_SECONDS = 15
+CLIENT_QUEUE_SIZE = 256
+REPLAY_LIMIT      = 1000
+RECONNECT_MS      = 3000
+# "The $changeStream stage is only supported on replica sets"
+CHANGE_STREAMS_UNSUPPORTED = 40573
+
+_CLOSE = object()
+
+
+def publish_event(db, kind, issue_id, **data):
+    db.issue_events.insert_one({
+        "kind":     kind,
+        "issue_id": issue_id,
+        "data":     data,
+        "at":       datetime.utcnow()
+    })
+
+
+def format_event(event):
+    """One SSE frame; the event id is what Last-Event-ID sends back."""
+    data = event.get("data") or {}
+    if "issue" in data:
+        data = dict(data, issue=issue_view(data["issue"]))
+    payload = dumps({"kind": event["kind"], "issue_id": event["issue_id"], **data}).decode()
+    return f"id: {event['_id']}\nevent: {event['kind']}\ndata: {payload}\n\n"
+
+
+def replay(db, last_event_id):
+    """Events after `last_event_id` still in the collection, oldest first."""
+    try:
+        after = ObjectId(last_event_id)
+    except (InvalidId, TypeError):
+        return []
+    return list(db.issue_events.find({"_id": {"$gt": after}}).sort("_id", 1).limit(REPLAY_LIMIT))
+
+
+class EventBroadcaster:
+    """Follows issue_events in a daemon thread and fans out to subscriber queues."""
+
+    def __init__(self, app, change_streams=True, poll_interval=POLL_SECONDS,
+                 queue_size=CLIENT_QUEUE_SIZE):
+        self.app = app
+        self.change_streams = change_streams
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._started = False
+        self.stop = threading.Event()
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.add(q)
+            if not self._started:
+                self._started = True
+                threading.Thread(target=self._run, name="issue-events", daemon=True).start()
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def close(self):
+        """Stop following the collection and end every open stream."""
+        self.stop.set()
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, set()
+        for q in subscribers:
+            _drain(q)
+            q.put_nowait(_CLOSE)
+
+    def dispatch(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                # a stalled client: drop it, it resumes from Last-Event-ID
+                self.unsubscribe(q)
+                _drain(q)
+                q.put_nowait(_CLOSE)
+
+    def _run(self):
+        with self.app.app_context():
+            db = self.app.mongo.db
+        if not self.change_streams:
+            return self._poll(db)
+        while not self.stop.is_set():
+            try:
+                self._watch(db)
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    log.info("No change streams on this server, polling issue_events")
+                    return self._poll(db)
+                log.exception("Issue event stream failed, reconnecting")
+                self.stop.wait(self.poll_interval)
+            except PyMongoError:
+                log.exception("Issue event stream failed, reconnecting")
+                self.stop.wait(self.poll_interval)
+
+    def _watch(self, db):
+        with db.issue_events.watch([{"$match": {"operationType": "insert"}}]) as stream:
+            while not self.stop.is_set():
+                change = stream.try_next()
+                if change is not None:
+                    self.dispatch(change["fullDocument"])
+
+    def _poll(self, db):
+        seen = OrderedDict()
+        since = datetime.now(timezone.utc)
+        # already there before we started: not news
+        for event in db.issue_events.find(self._recent(since), {"_id": 1}):
+            seen[event["_id"]] = True
+        while not self.stop.wait(self.poll_interval):
+            try:
+                for event in db.issue_events.find(self._recent(since)).sort("_id", 1):
+                    if event["_id"] in seen:
+                        continue
+                    seen[event["_id"]] = True
+                    since = max(since, event["_id"].generation_time)
+                    self.dispatch(event)
+                while len(seen) > 10000:
+                    seen.popitem(last=False)
+            except PyMongoError:
+                log.exception("Polling issue_events failed")
+
+    @staticmethod
+    def _recent(since):
+        return {"_id": {"$gt": ObjectId.from_datetime(since - POLL_LOOKBACK)}}
+
+
+def _drain(q):
+    try:
+        while True:
+            q.get_nowait()
+    except queue.Empty:
+        pass
+
+
+def get_broadcaster(app):
+    broadcaster = app.extensions.get("issue_events")
+    if broadcaster is None:
+        broadcaster = app.extensions.setdefault(
+            "issue_events", EventBroadcaster(app, app.config["EVENT_CHANGE_STREAMS"])
+        )
+    return broadcaster
+
+
+@events_bp.route("/api/issues/events")
+def issue_events():
+    """
+    Server-Sent Events for issue changes. Reconnecting browsers send
+    Last-Event-ID and get the events they missed first.
+    """
+    db = current_app.mongo.db
+    broadcaster = get_broadcaster(current_app._get_current_object())
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+
+    def generate():
+        q = broadcaster.subscribe()
+        try:
+            yield f"retry: {RECONNECT_MS}\n\n"
+            last = None
+            for event in replay(db, last_event_id):
+                last = event["_id"]
+                yield format_event(event)
+            while not broadcaster.stop.is_set():
+                try:
+                    event = q.get(timeout=HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if event is _CLOSE:
+                    return
+                if last is not None and event["_id"] <= last:
+                    continue  # already replayed
+                yield format_event(event)
+        finally:
+            broadcaster.unsubscribe(q)
+
+    return Response(generate(), mimetype="text/event-stream", headers={
+        "Cache-Control":     "no-cache",
+        # nginx would otherwise buffer the stream
+        "X-Accel-Buffering": "no",
+    })
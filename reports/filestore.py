@@ -0,0 +1,174 @@
+# reports/filestore.py
+#
+# Content-addressed photo storage. Every upload is hashed while it streams
+# into GridFS; when a file with the same content already exists, the new copy
+# is dropped and the existing file id is handed out again:
+#
+#     fs.files.metadata  {sha256, refcount, owners: [email, ...], pending_until}
+#
+# `refcount` counts the issues / completion reports pointing at the file;
+# release() drops one and deletes the file (and its derivatives) with the
+# last. A finished chunked upload (uploads.py) takes no reference: it is held
+# until `pending_until`, and the issue or report it is attached to takes one
+# with claim(). The upload janitor purges held files nobody claimed. Files
+# stored before hashing have no sha256 / refcount and are left alone.
+#
+# The hash is the sha256 of the concatenated sha256 digests of the file's
+# GridFS-sized chunks, so a chunked upload (uploads.py) can compute it one
+# request at a time without keeping hash state between requests.
+
+import hashlib
+from datetime import datetime
+from functools import partial
+
+from gridfs import DEFAULT_CHUNK_SIZE, GridFS
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from . import derivatives
+
+
+def chunk_digest(data):
+    return hashlib.sha256(data).digest()
+
+
+def content_hash(chunk_digests):
+    return hashlib.sha256(b"".join(chunk_digests)).hexdigest()
+
+
+class ContentHasher:
+    """Incremental content_hash() over arbitrarily sized writes."""
+
+    def __init__(self):
+        self._digests = []
+        self._chunk = hashlib.sha256()
+        self._filled = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        while view:
+            take = min(len(view), DEFAULT_CHUNK_SIZE - self._filled)
+            self._chunk.update(view[:take])
+            self._filled += take
+            view = view[take:]
+            if self._filled == DEFAULT_CHUNK_SIZE:
+                self._digests.append(self._chunk.digest())
+                self._chunk = hashlib.sha256()
+                self._filled = 0
+
+    def hexdigest(self):
+        tail = [self._chunk.digest()] if self._filled else []
+        return content_hash(self._digests + tail)
+
+
+def reuse(db, sha256, owner):
+    """Take a reference on an existing file with this content. Returns its id or None."""
+    # any refcount: the $inc lands before release()'s delete, or the file is gone
+    doc = db.fs.files.find_one_and_update(
+        {"metadata.sha256": sha256},
+        {"$inc": {"metadata.refcount": 1}, "$addToSet": {"metadata.owners": owner}},
+        projection={"_id": 1}
+    )
+    return doc["_id"] if doc else None
+
+
+def hold(db, sha256, owner, until):
+    """
+    An existing file with this content, kept from deletion until `until`
+    without taking a reference. Returns its id or None.
+    """
+    doc = db.fs.files.find_one_and_update(
+        {"metadata.sha256": sha256},
+        {"$max": {"metadata.pending_until": until}, "$addToSet": {"metadata.owners": owner}},
+        projection={"_id": 1}
+    )
+    return doc["_id"] if doc else None
+
+
+def claim(db, file_id, owner):
+    """Take a reference on a stored file of `owner`. Returns False when there is none."""
+    return db.fs.files.update_one(
+        {"_id": file_id, "metadata.owners": owner, "metadata.refcount": {"$exists": True}},
+        {"$inc": {"metadata.refcount": 1}}
+    ).modified_count == 1
+
+
+def _discard(db, file_id):
+    db.fs.chunks.delete_many({"files_id": file_id})
+    db.fs.files.delete_one({"_id": file_id})
+
+
+def store_upload(db, stream, filename, content_type, owner):
+    """
+    Write `stream` to GridFS, hashing on the way. Returns the id of the new
+    file, or of the existing identical one (the new copy is then deleted).
+    """
+    hasher = ContentHasher()
+    with GridFS(db).new_file(filename=filename, content_type=content_type,
+                             metadata={"owners": [owner]}) as grid_in:
+        for block in iter(partial(stream.read, DEFAULT_CHUNK_SIZE), b""):
+            hasher.update(block)
+            grid_in.write(block)
+    file_id = grid_in._id
+    sha256 = hasher.hexdigest()
+
+    existing = reuse(db, sha256, owner)
+    if not existing:
+        try:
+            db.fs.files.update_one(
+                {"_id": file_id},
+                {"$set": {"metadata.sha256": sha256, "metadata.refcount": 1}}
+            )
+            derivatives.enqueue(file_id)
+            return file_id
+        except DuplicateKeyError:
+            # the same bytes finished uploading concurrently
+            existing = reuse(db, sha256, owner)
+            if not existing:
+                derivatives.enqueue(file_id)
+                return file_id
+    _discard(db, file_id)
+    return existing
+
+
+def _unreferenced(now):
+    return {"metadata.refcount": 0, "$or": [
+        {"metadata.pending_until": {"$exists": False}},
+        {"metadata.pending_until": {"$lt": now}},
+    ]}
+
+
+def _delete_unreferenced(db, file_id, now):
+    # a concurrent reuse() / claim() / hold() makes the filter miss
+    if db.fs.files.delete_one(dict(_unreferenced(now), _id=file_id)).deleted_count:
+        db.fs.chunks.delete_many({"files_id": file_id})
+        for d in db.fs.files.find({"metadata.derivative_of": file_id}, {"_id": 1}):
+            _discard(db, d["_id"])
+        return True
+    return False
+
+
+def release(db, file_id):
+    """Drop one reference; the last one deletes the file and its derivatives."""
+    if not file_id:
+        return
+    doc = db.fs.files.find_one_and_update(
+        {"_id": file_id, "metadata.refcount": {"$gt": 0}},
+        {"$inc": {"metadata.refcount": -1}},
+        projection={"metadata.refcount": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not doc or doc["metadata"]["refcount"] > 0:
+        return
+    # still held for an upload that may yet be claimed: the janitor decides
+    _delete_unreferenced(db, file_id, datetime.utcnow())
+
+
+def purge_unclaimed(db):
+    """Delete finished uploads whose hold expired with no reference taken."""
+    now = datetime.utcnow()
+    purged = 0
+    for doc in db.fs.files.find({"metadata.refcount": 0, "metadata.pending_until": {"$lt": now}},
+                                {"_id": 1}):
+        purged += _delete_unreferenced(db, doc["_id"], now)
+    return purged
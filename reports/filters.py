@@ -0,0 +1,74 @@
+# reports/filters.py
+#
+# Listing filters shared by /api/issues, the map clusters and the public
+# reports page, applied in Mongo instead of in the browser:
+#
+#     ?category=pothole&status=pending&street=Herzl&since=...&until=...
+#
+# `street` matches the start of city_street (case-sensitive, so the
+# street_timestamp index can serve it). With ?facets=1, /api/issues also
+# returns the category and status counts for the current filters.
+
+import re
+
+from .pagination import listing_query
+
+FACET_FIELDS = ("category", "status")
+
+
+def _equal(args, fields):
+    return {f: args[f] for f in fields if args.get(f)}
+
+
+def issue_filters(args, exclude=()):
+    """
+    Mongo query for the filter params in `args`, minus the `exclude` ones.
+    since / until are left to listing_query(), which paginate() applies.
+    """
+    query = _equal(args, [f for f in FACET_FIELDS if f not in exclude])
+    street = (args.get("street") or "").strip()
+    if street:
+        query["city_street"] = {"$regex": "^" + re.escape(street)}
+    return query
+
+
+def facet_pipeline(args):
+    """
+    Counts per category and per status, plus the total, in one round trip.
+
+    The street and date filters narrow the input once, ahead of $facet (which
+    can't use indexes). Each dimension is then counted under the other
+    dimension's filter only, so picking a category still shows the counts of
+    the categories to switch to.
+    """
+    facets = {
+        f: [
+            {"$match": _equal(args, [g for g in FACET_FIELDS if g != f])},
+            {"$group": {"_id": f"${f}", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1, "_id": 1}},
+        ]
+        for f in FACET_FIELDS
+    }
+    facets["total"] = [{"$match": _equal(args, FACET_FIELDS)}, {"$count": "n"}]
+    return [
+        {"$match": listing_query(issue_filters(args, exclude=FACET_FIELDS), args)},
+        {"$facet": facets},
+    ]
+
+
+def get_facets(collection, args):
+    """{"category": [{"value", "count"}, ...], "status": [...], "total": n}"""
+    result = next(collection.aggregate(facet_pipeline(args)), {})
+    facets = {
+        f: [{"value": row["_id"], "count": row["count"]}
+            for row in result.get(f, []) if row["_id"] is not None]
+        for f in FACET_FIELDS
+    }
+    total = result.get("total") or [{"n": 0}]
+    facets["total"] = total[0]["n"]
+    return facets
+
+
+def categories(collection):
+    """Every category in use, from the category index."""
+    return sorted(c for c in collection.distinct("category") if c)
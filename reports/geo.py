@@ -0,0 +1,135 @@
+# reports/geo.py
+
+"""
+Issue locations are stored as GeoJSON points so they can sit behind a
+2dsphere index:
+
+    {"type": "Point", "coordinates": [lng, lat]}
+
+Templates and the JSON APIs keep seeing the old {"lat", "lng"} shape,
+converted on the way out by `location_latlng`.
+"""
+
+import math
+
+
+def to_point(lat, lng):
+    """GeoJSON point for a (lat, lng) pair (note GeoJSON is lng first)."""
+    return {"type": "Point", "coordinates": [float(lng), float(lat)]}
+
+
+def location_latlng(location):
+    """
+    {"lat", "lng"} view of a stored location.
+    Accepts GeoJSON points and legacy {"lat", "lng"} documents; anything
+    else becomes an empty dict, which templates treat as "no location".
+    """
+    if not isinstance(location, dict):
+        return {}
+    if location.get("type") == "Point":
+        coords = location.get("coordinates") or []
+        if len(coords) == 2:
+            return {"lat": coords[1], "lng": coords[0]}
+        return {}
+    if "lat" in location and "lng" in location:
+        return {"lat": location["lat"], "lng": location["lng"]}
+    return {}
+
+
+def parse_latlng(value):
+    """Parse a "lat,lng" query parameter; raises ValueError when malformed."""
+    lat_str, lng_str = (value or "").split(",")
+    lat, lng = float(lat_str), float(lng_str)
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError("Coordinates out of range")
+    return lat, lng
+
+
+# widest longitude span of one $geoWithin polygon, see bbox_query()
+MAX_STRIP_DEGREES = 90
+
+
+def bbox_query(sw, ne, field="location"):
+    """
+    $geoWithin filter for the viewport spanned by the south-west and
+    north-east corners. The box is sent as a GeoJSON polygon so the
+    2dsphere index is used; at city scale the geodesic edges are
+    indistinguishable from the map's straight ones.
+    """
+    (south, west), (north, east) = sw, ne
+    if south >= north or west >= east:
+        raise ValueError("sw must be south-west of ne")
+    # an edge of half the globe or more has no single shortest path, so the
+    # server rejects the polygon or reads it the wrong way round: cut wide
+    # boxes (the world view at low zoom) into strips of at most 90 degrees
+    strips = math.ceil((east - west) / MAX_STRIP_DEGREES)
+    if strips == 1:
+        return {field: _within(south, west, north, east)}
+    step = (east - west) / strips
+    edges = [west + i * step for i in range(strips)] + [east]
+    return {"$or": [
+        {field: _within(south, left, north, right)} for left, right in zip(edges, edges[1:])
+    ]}
+
+
+def _within(south, west, north, east):
+    ring = [[west, south], [east, south], [east, north], [west, north], [west, south]]
+    return {"$geoWithin": {"$geometry": {"type": "Polygon", "coordinates": [ring]}}}
+
+
+# Cluster cells are a fraction of a 256px map tile, so clusters keep
+# roughly the same on-screen size at every zoom level.
+CELLS_PER_TILE = 4
+MAX_CLUSTERS   = 2000
+
+
+def cluster_cell_size(zoom):
+    """Cell edge in degrees for a web-mercator zoom level."""
+    return 360.0 / (2 ** zoom) / CELLS_PER_TILE
+
+
+def cluster_pipeline(query, zoom, field="location"):
+    """
+    Aggregation that snaps every matching issue to a grid cell and returns
+    one record per non-empty cell: count, centroid and status breakdown.
+    Single-issue cells carry the issue id so they can be drawn as markers.
+    """
+    cell = cluster_cell_size(zoom)
+    coords = f"${field}.coordinates"
+    return [
+        {"$match": query},
+        {"$project": {
+            "status": {"$ifNull": ["$status", "pending"]},
+            "lng":    {"$arrayElemAt": [coords, 0]},
+            "lat":    {"$arrayElemAt": [coords, 1]},
+        }},
+        {"$group": {
+            "_id": {
+                "x":      {"$floor": {"$divide": ["$lng", cell]}},
+                "y":      {"$floor": {"$divide": ["$lat", cell]}},
+                "status": "$status",
+            },
+            "count":    {"$sum": 1},
+            "lat":      {"$sum": "$lat"},
+            "lng":      {"$sum": "$lng"},
+            "issue_id": {"$first": "$_id"},
+        }},
+        {"$group": {
+            "_id":      {"x": "$_id.x", "y": "$_id.y"},
+            "count":    {"$sum": "$count"},
+            "lat":      {"$sum": "$lat"},
+            "lng":      {"$sum": "$lng"},
+            "statuses": {"$push": {"k": "$_id.status", "v": "$count"}},
+            "issue_id": {"$first": "$issue_id"},
+        }},
+        {"$project": {
+            "_id":      0,
+            "count":    1,
+            "lat":      {"$divide": ["$lat", "$count"]},
+            "lng":      {"$divide": ["$lng", "$count"]},
+            "statuses": {"$arrayToObject": "$statuses"},
+            "issue_id": {"$cond": [{"$eq": ["$count", 1]}, "$issue_id", None]},
+        }},
+        {"$sort": {"count": -1}},
+        {"$limit": MAX_CLUSTERS},
+    ]
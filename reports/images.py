@@ -0,0 +1,75 @@
+# reports/images.py
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from flask import abort, current_app, request
+from gridfs import GridOut
+from werkzeug.wsgi import wrap_file
+
+from .derivatives import SERVED_SIZES, find_derivative
+
+# A GridFS file id always names the same bytes, so browsers and proxies may
+# keep the response for good
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# ...except the original standing in for a derivative that isn't rendered yet
+FALLBACK_MAX_AGE = 60
+
+
+def file_etag(file_doc):
+    """
+    The content hash (filestore.py), the md5 older drivers stored, or else
+    id + upload date.
+    """
+    sha256 = (file_doc.get("metadata") or {}).get("sha256")
+    if sha256:
+        return sha256
+    if file_doc.get("md5"):
+        return file_doc["md5"]
+    return f"{file_doc['_id']}-{int(file_doc['uploadDate'].timestamp() * 1000)}"
+
+
+def send_gridfs_file(db, file_id, size="full"):
+    """
+    Stream one GridFS file (or its `size` derivative) as an HTTP response.
+
+    Only the files document is read up front. The body is handed to the WSGI
+    server as a file wrapper that reads one GridFS chunk at a time, so a worker
+    never holds a whole photo in memory. Range requests are answered with 206
+    and the matching chunks only; If-None-Match / If-Modified-Since with 304.
+    """
+    if size not in SERVED_SIZES:
+        abort(400)
+    try:
+        file_doc = db.fs.files.find_one({"_id": ObjectId(file_id)})
+    except (InvalidId, TypeError):
+        file_doc = None
+    if not file_doc:
+        abort(404)
+    immutable = True
+    if size != "full":
+        derivative = find_derivative(db, file_doc["_id"], size)
+        if derivative:
+            file_doc = derivative
+        else:
+            immutable = False
+    grid_out = GridOut(db.fs, file_document=file_doc)
+
+    response = current_app.response_class(
+        wrap_file(request.environ, grid_out, buffer_size=grid_out.chunk_size),
+        mimetype=file_doc.get("contentType") or "application/octet-stream",
+        direct_passthrough=True
+    )
+    response.content_length = grid_out.length
+    response.last_modified = grid_out.upload_date
+    response.set_etag(file_etag(file_doc))
+    if grid_out.filename:
+        response.headers.set("Content-Disposition", "inline", filename=grid_out.filename)
+    response.cache_control.public = True
+    if immutable:
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.max_age = FALLBACK_MAX_AGE
+    return response.make_conditional(
+        request, accept_ranges=True, complete_length=grid_out.length
+    )
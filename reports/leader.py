@@ -0,0 +1,86 @@
+# reports/leader.py
+#
+# One process at a time runs the singleton background services (counter
+# reconciler, outbox, digests, upload janitor), however many gunicorn
+# workers or containers are up. They compete for a lease in `meta`:
+#
+#     meta  {_id: "leader:<name>", holder, until}
+#
+# The holder renews it every third of its lifetime; when the holder dies,
+# the lease runs out and another process takes over.
+
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+log = logging.getLogger(__name__)
+
+
+class LeaderLease:
+    def __init__(self, name, seconds):
+        self.key = f"leader:{name}"
+        self.seconds = seconds
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def acquire(self, db):
+        """Take or renew the lease. True while this process holds it."""
+        now = datetime.utcnow()
+        try:
+            db.meta.update_one(
+                {"_id": self.key, "$or": [{"holder": self.holder}, {"until": {"$lt": now}}]},
+                {"$set": {"holder": self.holder, "until": now + timedelta(seconds=self.seconds)}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # the lease document exists and is someone else's
+            return False
+        return True
+
+    def release(self, db):
+        db.meta.delete_one({"_id": self.key, "holder": self.holder})
+
+
+def start_leader(app, name, seconds, start):
+    """
+    Compete for the `name` lease in a daemon thread. While held, the services
+    started by `start()` (which returns their stop Events) run here; they are
+    stopped when the lease is lost or the returned stop Event is set.
+    """
+    stop = threading.Event()
+    lease = LeaderLease(name, seconds)
+
+    def loop():
+        running = []
+        wait = 0
+        while not stop.wait(wait):
+            wait = seconds / 3
+            try:
+                with app.app_context():
+                    leader = lease.acquire(app.mongo.db)
+            except PyMongoError:
+                log.exception("Could not renew the %s lease", name)
+                leader = False
+            if leader and not running:
+                log.info("Running the %s services in this process", name)
+                running = [s for s in start() if s is not None]
+            elif not leader and running:
+                log.info("Lost the %s lease, stopping its services", name)
+                for s in running:
+                    s.set()
+                running = []
+        for s in running:
+            s.set()
+        if running:
+            try:
+                with app.app_context():
+                    lease.release(app.mongo.db)
+            except PyMongoError:
+                pass
+
+    threading.Thread(target=loop, name=f"leader-{name}", daemon=True).start()
+    return stop
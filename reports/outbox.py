@@ -0,0 +1,183 @@
+# reports/outbox.py
+#
+# Persistent email outbox. Routes only insert a document (send_email in
+# email_utils.py); a background worker delivers them over one SMTP
+# connection, kept open between rounds for OUTBOX_SMTP_IDLE_SECONDS:
+#
+#     outbox  {to, subject, body, status, attempts, next_attempt_at,
+#              locked_until, last_error, created, sent_at}
+#
+# status: pending -> sending -> sent, or back to pending with an exponential
+# backoff after a failure, or dead after OUTBOX_MAX_ATTEMPTS (or a permanent
+# SMTP error). A message left in "sending" by a crashed worker is picked up
+# again once its lease (locked_until) has expired.
+
+import logging
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.utils import formataddr
+
+from pymongo import ReturnDocument
+
+log = logging.getLogger(__name__)
+
+LEASE_SECONDS = 60
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 3600
+
+# the server refused the message itself, retrying won't help
+PERMANENT_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused,
+                    smtplib.SMTPDataError, smtplib.SMTPNotSupportedError)
+
+
+def enqueue_email(db, to_email, subject, body, _id=None):
+    now = datetime.utcnow()
+    doc = {} if _id is None else {"_id": _id}
+    doc.update({
+        "to":              to_email,
+        "subject":         subject,
+        "body":            body,
+        "status":          "pending",
+        "attempts":        0,
+        "next_attempt_at": now,
+        "created":         now
+    })
+    return db.outbox.insert_one(doc).inserted_id
+
+
+def build_message(config, doc):
+    msg = EmailMessage()
+    msg["Subject"] = doc["subject"]
+    # combine display name + address
+    msg["From"] = formataddr((config.get("MAIL_DEFAULT_SENDER_NAME"), config["MAIL_DEFAULT_SENDER"]))
+    msg["To"] = doc["to"]
+    msg.set_content(doc["body"])
+    return msg
+
+
+def smtp_connection(config):
+    """Default smtp_factory: a logged-in connection to the configured server."""
+    server = smtplib.SMTP(config["MAIL_SERVER"], config["MAIL_PORT"], timeout=30)
+    if config["MAIL_USE_TLS"]:
+        server.starttls()
+    if config.get("MAIL_USERNAME"):
+        server.login(config["MAIL_USERNAME"], config["MAIL_PASSWORD"])
+    return server
+
+
+def backoff(attempts):
+    return min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS)
+
+
+class OutboxWorker:
+    """
+    Delivers the outbox. `smtp_factory(config)` returns a connected object
+    with send_message() / noop() / quit(); tests pass a local stand-in.
+    """
+
+    def __init__(self, app, smtp_factory=smtp_connection):
+        self.app = app
+        self.smtp_factory = smtp_factory
+        self.max_attempts = app.config["OUTBOX_MAX_ATTEMPTS"]
+        self.idle_seconds = app.config["OUTBOX_SMTP_IDLE_SECONDS"]
+        self._smtp = None
+        self._last_used = 0.0
+
+    def _claim(self, db):
+        now = datetime.utcnow()
+        return db.outbox.find_one_and_update(
+            {"$or": [
+                {"status": "pending", "next_attempt_at": {"$lte": now}},
+                {"status": "sending", "locked_until": {"$lt": now}},
+            ]},
+            {"$set": {"status": "sending", "locked_until": now + timedelta(seconds=LEASE_SECONDS)},
+             "$inc": {"attempts": 1}},
+            sort=[("next_attempt_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _check_connection(self):
+        """Hang up a connection idle for too long, or one the server has dropped."""
+        if self._smtp is None:
+            return
+        if time.monotonic() - self._last_used > self.idle_seconds:
+            self.close()
+            return
+        try:
+            alive = self._smtp.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            alive = False
+        if not alive:
+            self._smtp = None
+
+    def _send(self, msg):
+        if self._smtp is None:
+            self._smtp = self.smtp_factory(self.app.config)
+        try:
+            self._smtp.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # dropped since the noop() check: redial once
+            self._smtp = self.smtp_factory(self.app.config)
+            self._smtp.send_message(msg)
+        self._last_used = time.monotonic()
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+    def _deliver(self, db, doc):
+        try:
+            self._send(build_message(self.app.config, doc))
+        except Exception as e:
+            permanent = isinstance(e, PERMANENT_ERRORS)
+            if not permanent:
+                # the connection may be in an unknown state
+                self._smtp = None
+            dead = permanent or doc["attempts"] >= self.max_attempts
+            update = {"status": "dead" if dead else "pending", "last_error": repr(e)}
+            if not dead:
+                update["next_attempt_at"] = datetime.utcnow() + timedelta(seconds=backoff(doc["attempts"]))
+            db.outbox.update_one({"_id": doc["_id"]}, {"$set": update, "$unset": {"locked_until": ""}})
+            log.warning("Email %s to %s failed (attempt %d): %r", doc["_id"], doc["to"], doc["attempts"], e)
+            return False
+        db.outbox.update_one(
+            {"_id": doc["_id"]},
+            {"$set": {"status": "sent", "sent_at": datetime.utcnow()}, "$unset": {"locked_until": ""}}
+        )
+        return True
+
+    def drain(self):
+        """Send every message that is due. Returns the number sent."""
+        self._check_connection()
+        sent = 0
+        with self.app.app_context():
+            db = self.app.mongo.db
+            while True:
+                doc = self._claim(db)
+                if doc is None:
+                    return sent
+                sent += self._deliver(db, doc)
+
+
+def start_outbox_worker(app, interval, smtp_factory=smtp_connection):
+    """Drain the outbox every `interval` seconds in a daemon thread."""
+    stop = threading.Event()
+    worker = OutboxWorker(app, smtp_factory)
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                worker.drain()
+            except Exception:
+                log.exception("Outbox delivery failed")
+        worker.close()
+
+    threading.Thread(target=loop, name="email-outbox", daemon=True).start()
+    return stop
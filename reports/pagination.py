@@ -0,0 +1,196 @@
+# reports/pagination.py
+
+import base64
+import binascii
+from datetime import datetime, timezone
+
+from bson import json_util
+from flask import request, Response, stream_with_context
+
+from .serializers import dumps
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT     = 500
+STREAM_BATCH  = 500
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+# Columns a client may ask for through ?fields=  (_id is always returned)
+ISSUE_FIELDS = (
+    "reporter_email", "description", "city_street", "category", "location",
+    "image_file_id", "status", "assigned_to", "maintenance_email", "timestamp"
+)
+DONE_REPORT_FIELDS = (
+    "original_issue_id", "completion_description", "before_file_id",
+    "after_file_id", "technician", "timestamp"
+)
+
+
+class PaginationError(ValueError):
+    """Raised when a client sends a malformed cursor, limit or field list."""
+
+
+def encode_cursor(doc, key="timestamp"):
+    """Opaque keyset cursor pointing just after `doc` in (key, _id) order."""
+    raw = json_util.dumps({"t": doc.get(key), "i": doc["_id"]})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    padded = token + "=" * (-len(token) % 4)
+    try:
+        data = json_util.loads(base64.urlsafe_b64decode(padded.encode()))
+        return data["t"], data["i"]
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise PaginationError("Invalid cursor")
+
+
+def parse_limit(value, default=DEFAULT_LIMIT, maximum=MAX_LIMIT):
+    if value in (None, ""):
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise PaginationError("Invalid limit")
+    if limit < 1:
+        raise PaginationError("Invalid limit")
+    return limit if maximum is None else min(limit, maximum)
+
+
+def split_fields(value):
+    return [f.strip() for f in (value or "").split(",") if f.strip()]
+
+
+def parse_fields(value, allowed):
+    """Turn ?fields=a,b,c into a Mongo projection, or None for the full document."""
+    fields = split_fields(value)
+    if not fields:
+        return None
+    unknown = [f for f in fields if f != "_id" and f not in allowed]
+    if unknown:
+        raise PaginationError(f"Unknown field(s): {', '.join(unknown)}")
+    projection = {f: 1 for f in fields if f != "_id"}
+    # the cursor is built from the timestamp, so always read it
+    projection["timestamp"] = 1
+    return projection
+
+
+def parse_datetime(value):
+    """
+    ISO 8601 date or datetime -> naive UTC datetime, the way timestamps are
+    stored. Raises ValueError on anything else.
+    """
+    dt = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def date_range(args):
+    """?since= (inclusive) and ?until= (exclusive) as a timestamp condition."""
+    bounds = {}
+    for param, op in (("since", "$gte"), ("until", "$lt")):
+        value = args.get(param)
+        if value:
+            try:
+                bounds[op] = parse_datetime(value)
+            except ValueError:
+                raise PaginationError(f"Invalid {param}")
+    return {"timestamp": bounds} if bounds else {}
+
+
+def listing_query(query, args):
+    """The base query narrowed to the requested date range, if any."""
+    window = date_range(args)
+    if not window:
+        return query
+    return {"$and": [query, window]} if query else window
+
+
+def page_filter(query, cursor):
+    """Combine a base query with the keyset condition for the next page."""
+    if not cursor:
+        return query
+    ts, last_id = decode_cursor(cursor)
+    after = {"$or": [
+        {"timestamp": {"$lt": ts}},
+        {"timestamp": ts, "_id": {"$lt": last_id}},
+    ]}
+    return {"$and": [query, after]} if query else after
+
+
+def paginate(collection, query, allowed_fields, args=None):
+    """
+    Run one keyset page of `collection.find(query)` newest first.
+
+    Reads `cursor`, `limit`, `fields`, `since` and `until` from the request
+    args and returns (docs, next_cursor); next_cursor is None on the last page.
+    """
+    args = request.args if args is None else args
+    limit      = parse_limit(args.get("limit"))
+    projection = parse_fields(args.get("fields"), allowed_fields)
+    query      = listing_query(query, args)
+
+    docs = list(
+        collection.find(page_filter(query, args.get("cursor")), projection)
+        .sort([("timestamp", -1), ("_id", -1)])
+        .limit(limit + 1)
+    )
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    docs = docs[:limit]
+
+    if projection is not None and "timestamp" not in split_fields(args.get("fields")):
+        for d in docs:
+            d.pop("timestamp", None)
+    return docs, next_cursor
+
+
+def wants_stream(args=None):
+    """?stream=1 or an Accept header that prefers NDJSON."""
+    args = request.args if args is None else args
+    if args.get("stream") in ("1", "true"):
+        return True
+    best = request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+def stream_ndjson(collection, query, allowed_fields, serialize, args=None,
+                  batch_size=STREAM_BATCH):
+    """
+    Stream every matching document newest first as newline-delimited JSON.
+
+    `serialize` maps a document to the encodable value of one line.
+    The cursor is read one server batch at a time and each batch is written
+    out as a single chunk, so only `batch_size` documents are held in memory
+    and the first chunk leaves as soon as the first batch arrives. `cursor`,
+    `fields`, `since` and `until` behave as in `paginate`; `limit` is
+    optional here.
+    """
+    args = request.args if args is None else args
+    projection = parse_fields(args.get("fields"), allowed_fields)
+    query = listing_query(query, args)
+    limit = parse_limit(args.get("limit"), default=0, maximum=None)
+    keep_timestamp = projection is None or "timestamp" in split_fields(args.get("fields"))
+
+    cursor = (
+        collection.find(page_filter(query, args.get("cursor")), projection)
+        .sort([("timestamp", -1), ("_id", -1)])
+        .batch_size(batch_size)
+        .limit(limit)
+    )
+    def generate():
+        lines = []
+        try:
+            for doc in cursor:
+                if not keep_timestamp:
+                    doc.pop("timestamp", None)
+                lines.append(dumps(serialize(doc)))
+                if len(lines) >= batch_size:
+                    yield b"\n".join(lines) + b"\n"
+                    lines = []
+            if lines:
+                yield b"\n".join(lines) + b"\n"
+        finally:
+            cursor.close()
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
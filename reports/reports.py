@@ -1,14 +1,29 @@
 from flask import (
     Blueprint, render_template, request, redirect,
-    url_for, session, flash, current_app, abort, send_file
+    url_for, session, flash, current_app, abort
 )
 from werkzeug.utils import secure_filename
 from bson import ObjectId
 from datetime import datetime
-from gridfs import GridFS
-import io
 
 from .email_utils import send_email
+from .pagination import (
+    paginate, stream_ndjson, wants_stream, listing_query, parse_limit,
+    PaginationError, ISSUE_FIELDS, MAX_LIMIT
+)
+from .stats import get_stats
+from . import counters
+from .versioning import bump_version, current_version, next_version, record_deletion, etag_by_version
+from .events import publish_event
+from .serializers import issue_view, json_response
+from .search import search_issues
+from .changes import changes_since, parse_since
+from .filters import issue_filters, get_facets, categories
+from .geo import to_point, location_latlng, parse_latlng, bbox_query, cluster_pipeline
+from .images import send_gridfs_file
+from .filestore import store_upload, release
+from .uploads import claim_upload
+from auth.users import current_user
 
 reports_bp = Blueprint(
     "reports",
@@ -28,6 +43,10 @@ def serialize_issue_for_json(issue):
     
     if "image_file_id" in issue and issue["image_file_id"]:
         issue["image_file_id"] = str(issue["image_file_id"])
+
+    # GeoJSON point -> {"lat", "lng"} for templates and API clients
+    if "location" in issue:
+        issue["location"] = location_latlng(issue["location"])
     
     # Handle timestamp conversion
     if "timestamp" in issue:
@@ -39,28 +58,39 @@ def serialize_issue_for_json(issue):
     
     return issue
 
+def open_rejections(db, technician):
+    """
+    (rejected report, original issue) pairs for `technician`, newest first,
+    skipping issues that are gone or already done. Two queries in total,
+    however many rejections the technician has.
+    """
+    rejected = []
+    for r in db.rejected_reports.find({"technician": technician}).sort("timestamp", -1):
+        try:
+            rejected.append((r, ObjectId(r.get("original_issue_id"))))
+        except Exception:
+            continue
+    open_issues = {
+        i["_id"]: i for i in db.issues.find(
+            {"_id": {"$in": [oid for _, oid in rejected]},
+             "status": {"$nin": ["done", "fixed"]}},
+            {"status": 1, "image_file_id": 1}
+        )
+    }
+    return [(r, open_issues[oid]) for r, oid in rejected if oid in open_issues]
+
 # ---------- Utility: serve files from GridFS ----------
 @reports_bp.route("/uploads/<file_id>")
 def serve_upload(file_id):
-    mongo = current_app.mongo
-    fs = GridFS(mongo.db)
-    try:
-        grid_out = fs.get(ObjectId(file_id))
-    except Exception:
-        abort(404)
-    return send_file(
-        io.BytesIO(grid_out.read()),
-        mimetype=grid_out.content_type or "application/octet-stream",
-        as_attachment=False,
-        download_name=grid_out.filename
-    )
+    """?size=thumb|medium|full (default)"""
+    return send_gridfs_file(current_app.mongo.db, file_id, request.args.get("size", "full"))
 
 # ---------- Test SMTP Email (Admin) ----------
 @reports_bp.route("/admin/test-email")
 def test_email():
     if "user" not in session:
         return "", 200
-    user = current_app.mongo.db.users.find_one({"email": session["user"]})
+    user = current_user()
     if user and user.get("role") == "admin":
         send_email(
             user["email"],
@@ -88,17 +118,10 @@ def report_detail(issue_id):
 # ---------- Public list of all reports ----------
 @reports_bp.route("/reports")
 def public_reports():
-    mongo = current_app.mongo
-    issues = list(mongo.db.issues.find().sort("timestamp", -1))
-    categories = sorted({i.get("category", "") for i in issues if i.get("category")})
-    
-    # Serialize all issues
-    serialized_issues = [serialize_issue_for_json(issue) for issue in issues]
-    
+    # the list itself is paged in by the page's JS from /api/issues
     return render_template(
         "public_reports.html",
-        issues=serialized_issues,
-        categories=categories
+        categories=categories(current_app.mongo.db.issues)
     )
 
 # ---------- Submit a new report (store image in GridFS) ----------
@@ -109,7 +132,6 @@ def report_issue():
         return redirect(url_for("auth.root"))
 
     mongo = current_app.mongo
-    fs = GridFS(mongo.db)
 
     if request.method == "POST":
         description = request.form.get("description", "").strip()
@@ -128,26 +150,35 @@ def report_issue():
             flash("Coordinates out of range.", "danger")
             return redirect(url_for("reports.report_issue"))
 
-        # Save image in GridFS
+        # Image: finished chunked upload (see uploads.py), or a plain multipart file
         image_file = request.files.get("image")
         image_id = None
-        if image_file and image_file.filename:
+        if request.form.get("image_file_id"):
+            image_id = claim_upload(mongo.db, request.form["image_file_id"], session["user"])
+            if not image_id:
+                flash("Uploaded photo not found, please attach it again.", "danger")
+                return redirect(url_for("reports.report_issue"))
+        elif image_file and image_file.filename:
             filename = secure_filename(image_file.filename)
-            image_id = fs.put(image_file.stream, filename=filename, content_type=image_file.mimetype)
+            image_id = store_upload(mongo.db, image_file.stream, filename, image_file.mimetype, session["user"])
 
         issue_data = {
             "reporter_email": session["user"],
             "description":    description,
             "city_street":    city_street,
             "category":       category,
-            "location":       {"lat": lat_f, "lng": lng_f},
+            "location":       to_point(lat_f, lng_f),
             "image_file_id":  image_id,
             "status":         "pending",
             "assigned_to":    None,
             "maintenance_email": None,
-            "timestamp":      datetime.utcnow().isoformat()
+            "timestamp":      datetime.utcnow(),
+            "version":        next_version(mongo.db)
         }
-        mongo.db.issues.insert_one(issue_data)
+        issue_id = mongo.db.issues.insert_one(issue_data).inserted_id
+        counters.issue_created(mongo.db, session["user"])
+        bump_version(mongo.db)
+        publish_event(mongo.db, "created", issue_id, issue=issue_data)
         flash("Issue reported successfully!", "success")
         return redirect(url_for("reports.report_issue"))
 
@@ -171,13 +202,18 @@ def delete_issue(issue_id):
         flash("Issue not found.", "danger")
         return redirect(request.referrer or url_for("reports.admin_dashboard"))
 
-    user_data = mongo.db.users.find_one({"email": session["user"]})
+    user_data = current_user()
     is_admin = user_data and user_data.get("role") == "admin"
     if issue["reporter_email"] != session["user"] and not is_admin:
         flash("Permission denied.", "danger")
         return redirect(request.referrer or url_for("reports.admin_dashboard"))
 
-    mongo.db.issues.delete_one({"_id": oid})
+    if mongo.db.issues.delete_one({"_id": oid}).deleted_count:
+        record_deletion(mongo.db, "issues", oid, next_version(mongo.db))
+        counters.issue_deleted(mongo.db, issue)
+        release(mongo.db, issue.get("image_file_id"))
+        publish_event(mongo.db, "deleted", oid)
+    bump_version(mongo.db)
     flash("Issue deleted successfully.", "success")
     return redirect(request.referrer or url_for("reports.admin_dashboard"))
 
@@ -189,7 +225,7 @@ def admin_dashboard():
         return redirect(url_for("auth.root"))
 
     mongo = current_app.mongo
-    user_data = mongo.db.users.find_one({"email": session["user"]})
+    user_data = current_user()
     if not user_data or user_data.get("role") != "admin":
         flash("Admins only.", "danger")
         return redirect(url_for("auth.dashboard"))
@@ -199,7 +235,7 @@ def admin_dashboard():
     serialized_issues = [serialize_issue_for_json(issue) for issue in issues]
     
     maintenance_users = list(mongo.db.users.find({"role": "maintenance"}))
-    my_issue_count = mongo.db.issues.count_documents({"reporter_email": session["user"]})
+    my_issue_count = counters.get_user_counters(mongo.db, session["user"])["issues_reported"]
     user_data.pop("password", None)
 
     return render_template(
@@ -222,15 +258,19 @@ def assign_issue(issue_id):
     update_fields = {
         "maintenance_email": maintenance_email or None,
         "assigned_to":       maintenance_email or None,
-        "status":            "assigned" if maintenance_email else "unassigned"
+        "status":            "assigned" if maintenance_email else "unassigned",
+        "version":           next_version(mongo.db)
     }
     mongo.db.issues.update_one({"_id": oid}, {"$set": update_fields})
+    bump_version(mongo.db)
+    publish_event(mongo.db, "assigned", oid,
+                  assigned_to=update_fields["assigned_to"], status=update_fields["status"])
 
     issue = mongo.db.issues.find_one({"_id": oid})
     reporter_email = issue.get("reporter_email")
 
     if maintenance_email:
-        loc = issue.get("location", {})
+        loc = location_latlng(issue.get("location"))
         map_link = f"https://www.google.com/maps/search/?api=1&query={loc.get('lat','')},"f"{loc.get('lng','')}" if loc.get('lat') is not None else ""
         # notify maintenance
         try:
@@ -240,10 +280,10 @@ def assign_issue(issue_id):
                 f"Hello,\n\nDescription: {issue.get('description')}\nLocation: {map_link}\n"
                 f"{url_for('reports.report_detail', issue_id=issue_id, _external=True)}"
             )
-            flash("Issue assigned and emailed.", "success")
+            flash("Issue assigned; the technician will be notified.", "success")
         except Exception as e:
             current_app.logger.error(e)
-            flash("Assigned but email failed.", "warning")
+            flash("Issue assigned, but the technician notification could not be queued.", "warning")
         # notify reporter
         try:
             send_email(
@@ -270,8 +310,7 @@ def my_reports():
     # Serialize issues for template
     serialized_issues = [serialize_issue_for_json(issue) for issue in issues]
     
-    user_data = mongo.db.users.find_one({"email": session["user"]})
-    user_data.pop("password", None)
+    user_data = current_user()
     return render_template(
         "user_dashboard.html",
         issues=serialized_issues,
@@ -280,17 +319,144 @@ def my_reports():
 
 # ---------- JSON API for all issues ----------
 @reports_bp.route("/api/issues")
+@etag_by_version
 def get_all_issues():
+    """
+    One page of issues, newest first.
+    Query params: limit, cursor (from the previous page's next_cursor),
+    fields (comma separated, e.g. _id,location,status,category for map markers),
+    the filters category, status, street, since, until, and facets=1 for the
+    category / status counts under those filters.
+    With ?stream=1 or Accept: application/x-ndjson the whole listing is
+    streamed as NDJSON instead, one issue per line.
+    """
     mongo = current_app.mongo
-    issues = list(mongo.db.issues.find())
-    
-    # Use the helper function to serialize each issue
-    serialized_issues = [serialize_issue_for_json(issue) for issue in issues]
-    
-    return {"issues": serialized_issues}, 200
+    try:
+        query = issue_filters(request.args)
+        if wants_stream():
+            return stream_ndjson(mongo.db.issues, query, ISSUE_FIELDS, issue_view)
+        issues, next_cursor = paginate(mongo.db.issues, query, ISSUE_FIELDS)
+        facets = get_facets(mongo.db.issues, request.args) if request.args.get("facets") == "1" else None
+    except PaginationError as e:
+        return {"error": str(e)}, 400
+
+    payload = {
+        "issues":      [issue_view(issue) for issue in issues],
+        "next_cursor": next_cursor
+    }
+    if facets is not None:
+        payload["facets"] = facets
+    return json_response(payload)
+
+# ---------- JSON API for full-text search ----------
+@reports_bp.route("/api/issues/search")
+@etag_by_version
+def search_issues_api():
+    """
+    Issues matching ?q= (text index on description, street and category),
+    best match first, each with a score and highlighted snippets.
+    Optional: category, status, since, until, limit, cursor, fields.
+    """
+    try:
+        issues, next_cursor = search_issues(current_app.mongo.db.issues, request.args)
+    except PaginationError as e:
+        return {"error": str(e)}, 400
+
+    return json_response({
+        "issues":      [issue_view(issue) for issue in issues],
+        "next_cursor": next_cursor
+    })
+
+# ---------- JSON API for delta sync ----------
+@reports_bp.route("/api/issues/changes")
+@etag_by_version(private=True)
+def get_issue_changes():
+    """
+    Issues and done reports written after ?since=<version>, and tombstones
+    of the deleted ones (see changes.py). Admins also get user changes.
+    Further pages: ?cursor=<next_cursor>, with an optional limit.
+    """
+    cursor = request.args.get("cursor")
+    try:
+        since = 0 if cursor else parse_since(request.args.get("since"))
+        limit = parse_limit(request.args.get("limit"), default=MAX_LIMIT)
+        user = current_user()
+        changes = changes_since(current_app.mongo.db, since, limit, cursor=cursor,
+                                include_users=bool(user and user.get("role") == "admin"))
+    except PaginationError as e:
+        return {"error": str(e)}, 400
+
+    changes["issues"] = [issue_view(issue) for issue in changes["issues"]]
+    return json_response(changes)
+
+# ---------- JSON API for the home page counters ----------
+@reports_bp.route("/api/stats")
+@etag_by_version
+def get_issue_stats():
+    """Totals, this week's reports, fixed this month and in-progress counts."""
+    db = current_app.mongo.db
+    return get_stats(db, current_version(db)), 200
+
+# ---------- JSON API for the issues inside a map viewport ----------
+@reports_bp.route("/api/issues/bbox")
+@etag_by_version
+def get_issues_in_bbox():
+    """
+    Issues inside the viewport ?sw=lat,lng&ne=lat,lng (2dsphere index).
+    Accepts the same limit / cursor / fields params as /api/issues.
+    """
+    mongo = current_app.mongo
+    try:
+        query = bbox_query(
+            parse_latlng(request.args.get("sw")),
+            parse_latlng(request.args.get("ne"))
+        )
+    except ValueError:
+        return {"error": "sw and ne must be lat,lng pairs with sw south-west of ne"}, 400
+    try:
+        issues, next_cursor = paginate(mongo.db.issues, query, ISSUE_FIELDS)
+    except PaginationError as e:
+        return {"error": str(e)}, 400
+
+    return json_response({
+        "issues":      [issue_view(issue) for issue in issues],
+        "next_cursor": next_cursor
+    })
+
+# ---------- JSON API for pre-aggregated map clusters ----------
+@reports_bp.route("/api/issues/clusters")
+@etag_by_version
+def get_issue_clusters():
+    """
+    Grid clusters for ?sw=lat,lng&ne=lat,lng&zoom=N, optionally narrowed by
+    the /api/issues filters (category, status, street, since, until).
+    Dense areas come back as a few cluster records (count, centroid, status
+    breakdown) instead of one record per issue.
+    """
+    mongo = current_app.mongo
+    try:
+        query = bbox_query(
+            parse_latlng(request.args.get("sw")),
+            parse_latlng(request.args.get("ne"))
+        )
+        zoom = int(request.args.get("zoom", ""))
+    except ValueError:
+        return {"error": "sw, ne (lat,lng) and zoom are required"}, 400
+    if not 0 <= zoom <= 22:
+        return {"error": "zoom must be between 0 and 22"}, 400
+
+    query.update(issue_filters(request.args))
+    try:
+        query = listing_query(query, request.args)
+    except PaginationError as e:
+        return {"error": str(e)}, 400
+
+    clusters = list(mongo.db.issues.aggregate(cluster_pipeline(query, zoom)))
+    return json_response({"clusters": clusters, "zoom": zoom})
 
 # ---------- Additional API endpoints ----------
 @reports_bp.route("/api/issues/<issue_id>")
+@etag_by_version
 def get_issue_by_id(issue_id):
     """Get a single issue by ID"""
     mongo = current_app.mongo
@@ -299,20 +465,26 @@ def get_issue_by_id(issue_id):
         if not issue:
             return {"error": "Issue not found"}, 404
         
-        serialized_issue = serialize_issue_for_json(issue)
-        return {"issue": serialized_issue}, 200
+        return json_response({"issue": issue_view(issue)})
     except Exception as e:
         return {"error": "Invalid issue ID"}, 400
 
 @reports_bp.route("/api/issues/user/<user_email>")
+@etag_by_version
 def get_user_issues(user_email):
-    """Get all issues for a specific user"""
+    """Get one page of issues for a specific user (same params as /api/issues)"""
     mongo = current_app.mongo
-    issues = list(mongo.db.issues.find({"reporter_email": user_email}))
-    
-    serialized_issues = [serialize_issue_for_json(issue) for issue in issues]
-    
-    return {"issues": serialized_issues}, 200
+    try:
+        issues, next_cursor = paginate(
+            mongo.db.issues, {"reporter_email": user_email}, ISSUE_FIELDS
+        )
+    except PaginationError as e:
+        return {"error": str(e)}, 400
+
+    return json_response({
+        "issues":      [issue_view(issue) for issue in issues],
+        "next_cursor": next_cursor
+    })
 
 # ---------- Maintenance dashboard ----------
 @reports_bp.route("/maintenance/dashboard")
@@ -321,18 +493,29 @@ def maintenance_dashboard():
         flash("Please log in first", "warning")
         return redirect(url_for("auth.root"))
     mongo = current_app.mongo
-    user = mongo.db.users.find_one({"email": session["user"]})
+    user = current_user()
     if not user or user.get("role") != "maintenance":
         flash("Access denied.", "danger")
         return redirect(url_for("auth.dashboard"))
 
-    raw_issues = mongo.db.issues.find({"assigned_to": session["user"]}).sort("timestamp", -1)
+    raw_issues = list(mongo.db.issues.find({"assigned_to": session["user"]}).sort("timestamp", -1))
+
+    # one query for the completion reports of every assigned issue
+    # (original_issue_id is an ObjectId; legacy string ids until `flask migrate`)
+    issue_ids = [i["_id"] for i in raw_issues]
+    done_by_issue = {}
+    for dr in mongo.db.done_issues.find(
+        {"original_issue_id": {"$in": issue_ids + [str(oid) for oid in issue_ids]}},
+        {"original_issue_id": 1, "status": 1, "rejection_reason": 1}
+    ).sort("timestamp", -1):
+        done_by_issue.setdefault(str(dr["original_issue_id"]), dr)
+
     issues = []
     for i in raw_issues:
         str_id = str(i["_id"])
         i["_id"] = str_id
-        i["location"] = i.get("location", {})
-        dr = mongo.db.done_issues.find_one({"original_issue_id": str_id})
+        i["location"] = location_latlng(i.get("location"))
+        dr = done_by_issue.get(str_id)
         if dr and dr.get("status") == "accepted":
             continue
         if dr and dr.get("status") == "rejected":
@@ -347,15 +530,7 @@ def maintenance_dashboard():
             
         issues.append(i)
 
-    rejected_count = 0
-    for r in mongo.db.rejected_reports.find({"technician": session["user"]}):
-        try:
-            orig_id = ObjectId(r.get("original_issue_id"))
-            main_issue = mongo.db.issues.find_one({"_id": orig_id})
-        except:
-            continue
-        if main_issue and main_issue.get("status") not in ("done", "fixed"):
-            rejected_count += 1
+    rejected_count = counters.get_user_counters(mongo.db, session["user"])["open_rejections"]
 
     return render_template(
         "maintenance_dashboard.html",
@@ -371,7 +546,7 @@ def maintenance_update_status(issue_id):
         flash("Please log in first", "warning")
         return redirect(url_for("auth.root"))
     mongo = current_app.mongo
-    user = mongo.db.users.find_one({"email": session["user"]})
+    user = current_user()
     if not user or user.get("role") != "maintenance":
         flash("Access denied.", "danger")
         return redirect(url_for("reports.maintenance_dashboard"))
@@ -385,7 +560,11 @@ def maintenance_update_status(issue_id):
     else:
         new_status = request.form.get("status")
         if new_status in ["in progress", "resolved"]:
-            mongo.db.issues.update_one({"_id": oid}, {"$set": {"status": new_status}})
+            mongo.db.issues.update_one(
+                {"_id": oid}, {"$set": {"status": new_status, "version": next_version(mongo.db)}}
+            )
+            bump_version(mongo.db)
+            publish_event(mongo.db, "status", oid, status=new_status)
             flash("Status updated!", "success")
     return redirect(url_for("reports.maintenance_dashboard"))
 
@@ -396,8 +575,7 @@ def maintenance_complete_issue(issue_id):
         flash("Please log in first", "warning")
         return redirect(url_for("auth.root"))
     mongo = current_app.mongo
-    fs = GridFS(mongo.db)
-    user = mongo.db.users.find_one({"email": session["user"]})
+    user = current_user()
     if not user or user.get("role") != "maintenance":
         abort(403)
     try:
@@ -409,21 +587,33 @@ def maintenance_complete_issue(issue_id):
         abort(403)
 
     desc   = request.form.get("completion_description", "").strip()
-    before = request.files.get("before_image")
-    after  = request.files.get("after_image")
 
-    before_id = fs.put(before.stream, filename=secure_filename(before.filename), content_type=before.mimetype) if before and before.filename else None
-    after_id  = fs.put(after.stream, filename=secure_filename(after.filename), content_type=after.mimetype) if after and after.filename else None
+    def photo(field):
+        # finished chunked upload first, then a plain multipart file
+        if request.form.get(f"{field}_file_id"):
+            return claim_upload(mongo.db, request.form[f"{field}_file_id"], session["user"])
+        upload = request.files.get(f"{field}_image")
+        if upload and upload.filename:
+            return store_upload(mongo.db, upload.stream, secure_filename(upload.filename),
+                                upload.mimetype, session["user"])
+        return None
+
+    before_id = photo("before")
+    after_id  = photo("after")
 
     done_doc = {
-        "original_issue_id":      str(oid),
+        "original_issue_id":      oid,
         "completion_description": desc,
         "before_file_id":         before_id,
         "after_file_id":          after_id,
         "technician":             session["user"],
-        "timestamp":              datetime.utcnow().isoformat()
+        "status":                 "pending",
+        "timestamp":              datetime.utcnow(),
+        "version":                next_version(mongo.db)
     }
-    mongo.db.done_issues.insert_one(done_doc)
+    done_id = mongo.db.done_issues.insert_one(done_doc).inserted_id
+    bump_version(mongo.db)
+    publish_event(mongo.db, "completed", oid, done_report_id=done_id, technician=session["user"])
 
     flash("Work completion report submitted!", "success")
     return redirect(url_for("reports.maintenance_dashboard"))
@@ -434,23 +624,17 @@ def rejected_reports():
     if "user" not in session:
         flash("Please log in first", "warning")
         return redirect(url_for("auth.root"))
-    user = current_app.mongo.db.users.find_one({"email": session["user"]})
+    user = current_user()
     if not user or user.get("role") != "maintenance":
         flash("Access denied.", "danger")
         return redirect(url_for("reports.maintenance_dashboard"))
 
-    raw = current_app.mongo.db.rejected_reports.find({"technician": session["user"]}).sort("timestamp", -1)
     reports = []
-    for r in raw:
-        try:
-            oid = ObjectId(r.get("original_issue_id"))
-        except:
-            continue
-        issue = current_app.mongo.db.issues.find_one({"_id": oid})
-        if not issue or issue.get("status") in ("done","fixed"):
-            continue
+    for r, issue in open_rejections(current_app.mongo.db, session["user"]):
         r["_id"] = str(r["_id"])
         r["original_issue_id"] = str(r["original_issue_id"])
+        if isinstance(r.get("timestamp"), datetime):
+            r["timestamp"] = r["timestamp"].strftime("%Y-%m-%d %H:%M")
         
         # Serialize image_file_id if present in the original issue
         if issue.get("image_file_id"):
@@ -471,16 +655,7 @@ def inject_rejected_count():
     if not tech:
         return dict(rejected_count=0)
 
-    count = 0
-    for r in current_app.mongo.db.rejected_reports.find({"technician": tech}):
-        try:
-            oid = ObjectId(r.get("original_issue_id"))
-            issue = current_app.mongo.db.issues.find_one({"_id": oid})
-        except:
-            continue
-        if issue and issue.get("status") not in ("done","fixed"):
-            count += 1
-
+    count = counters.get_user_counters(current_app.mongo.db, tech)["open_rejections"]
     return dict(rejected_count=count)
 
 # ---------- Tracking page ----------
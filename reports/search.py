@@ -0,0 +1,132 @@
+# reports/search.py
+#
+# Full-text search over issues, backed by the `issues_text` index (see
+# indexes.py) on description, city_street and category. Results come best
+# match first and page on (score, _id) with the same opaque cursors as the
+# listings; each hit carries HTML snippets with the matched words in <mark>.
+
+import re
+
+from markupsafe import Markup, escape
+
+from .pagination import (
+    PaginationError, date_range, decode_cursor, encode_cursor, parse_fields,
+    parse_limit, split_fields, ISSUE_FIELDS
+)
+
+SEARCH_LIMIT     = 20
+MAX_SEARCH_LIMIT = 100
+MAX_QUERY_CHARS  = 200
+SNIPPET_CHARS    = 160
+
+# fields that get a snippet, in the order they are shown
+HIGHLIGHT_FIELDS = ("description", "city_street")
+FILTER_FIELDS    = ("category", "status")
+
+# skipped when highlighting; the text index ignores them too
+_STOPWORDS = {"a", "an", "and", "at", "by", "for", "in", "near", "of", "on", "or", "the", "to", "with"}
+
+
+def highlight_pattern(q):
+    """
+    Regex matching the words of a $text query. Negated terms are left out and
+    each word matches by prefix, so "potholes" still marks "pothole".
+    """
+    words = []
+    for token in re.findall(r'-?"[^"]*"|\S+', q):
+        if token.startswith("-"):
+            continue
+        for word in re.findall(r"\w+", token.lower()):
+            if word not in _STOPWORDS and len(word) > 1:
+                words.append(re.escape(word[:max(4, len(word) - 2)]))
+    if not words:
+        return None
+    return re.compile(r"\b(?:%s)\w*" % "|".join(sorted(set(words), key=len, reverse=True)),
+                      re.IGNORECASE)
+
+
+def highlight(text, pattern, width=SNIPPET_CHARS):
+    """
+    Up to `width` characters of `text` around the first match, HTML-escaped
+    and with every match wrapped in <mark>. None when nothing matches.
+    """
+    if not isinstance(text, str) or pattern is None:
+        return None
+    first = pattern.search(text)
+    if not first:
+        return None
+    start = 0
+    if len(text) > width:
+        start = max(0, min(first.start() - width // 3, len(text) - width))
+    end = min(len(text), start + width)
+    piece = text[start:end]
+
+    out, pos = [], 0
+    for m in pattern.finditer(piece):
+        out.append(escape(piece[pos:m.start()]))
+        out.append(Markup("<mark>%s</mark>") % m.group())
+        pos = m.end()
+    out.append(escape(piece[pos:]))
+    return ("…" if start else "") + "".join(out) + ("…" if end < len(text) else "")
+
+
+def search_pipeline(q, filters=None, cursor=None, limit=SEARCH_LIMIT, projection=None):
+    """Aggregation for one page of `limit` + 1 hits, best match first."""
+    match = {"$text": {"$search": q}}
+    match.update(filters or {})
+    pipeline = [
+        {"$match": match},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+    ]
+    if cursor:
+        score, last_id = decode_cursor(cursor)
+        pipeline.append({"$match": {"$or": [
+            {"score": {"$lt": score}},
+            {"score": score, "_id": {"$lt": last_id}},
+        ]}})
+    pipeline += [
+        {"$sort": {"score": -1, "_id": -1}},
+        {"$limit": limit + 1},
+    ]
+    if projection is not None:
+        pipeline.append({"$project": dict(projection, score=1)})
+    return pipeline
+
+
+def search_issues(collection, args):
+    """
+    One page of issues matching ?q=, as (docs, next_cursor).
+
+    Also reads category, status, since, until, limit, cursor and fields.
+    Every doc gets its `score` and a `highlights` dict of snippets.
+    """
+    q = (args.get("q") or "").strip()
+    if not q:
+        raise PaginationError("Missing q")
+    if len(q) > MAX_QUERY_CHARS:
+        raise PaginationError("Query too long")
+    limit = parse_limit(args.get("limit"), default=SEARCH_LIMIT, maximum=MAX_SEARCH_LIMIT)
+    requested = split_fields(args.get("fields"))
+    projection = parse_fields(args.get("fields"), ISSUE_FIELDS)
+    if projection is not None:
+        # read the snippet sources even when they aren't returned
+        projection.update({f: 1 for f in HIGHLIGHT_FIELDS})
+
+    filters = {f: args[f] for f in FILTER_FIELDS if args.get(f)}
+    filters.update(date_range(args))
+
+    docs = list(collection.aggregate(
+        search_pipeline(q, filters, args.get("cursor"), limit, projection)
+    ))
+    next_cursor = encode_cursor(docs[limit - 1], key="score") if len(docs) > limit else None
+    docs = docs[:limit]
+
+    pattern = highlight_pattern(q)
+    for doc in docs:
+        snippets = {f: highlight(doc.get(f), pattern) for f in HIGHLIGHT_FIELDS}
+        doc["highlights"] = {f: s for f, s in snippets.items() if s}
+        if projection is not None:
+            for f in ("timestamp",) + HIGHLIGHT_FIELDS:
+                if f not in requested:
+                    doc.pop(f, None)
+    return docs, next_cursor
@@ -0,0 +1,74 @@
+# reports/serializers.py
+
+import json
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from flask import Response
+
+from .geo import location_latlng
+
+try:
+    import orjson
+except ImportError:  # optional fast backend
+    orjson = None
+
+BACKEND = "orjson" if orjson else "json"
+
+
+def _utc_iso(dt):
+    # same wire format as orjson's OPT_NAIVE_UTC | OPT_UTC_Z
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt.isoformat() + "Z"
+
+
+def _default(o):
+    """Encode the BSON types the JSON backends don't know about."""
+    if isinstance(o, ObjectId):
+        return str(o)
+    if isinstance(o, datetime):
+        return _utc_iso(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+if orjson:
+    _OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z
+
+    def dumps(obj):
+        return orjson.dumps(obj, default=_default, option=_OPTIONS)
+else:
+    _encoder = json.JSONEncoder(default=_default, separators=(",", ":"), ensure_ascii=False)
+
+    def dumps(obj):
+        return _encoder.encode(obj).encode()
+
+
+def issue_view(doc):
+    """
+    Issue document as the API exposes it. ObjectIds and dates are left for
+    the encoder; only the two fields with a different wire shape are
+    replaced, in a shallow copy so the caller's document is untouched.
+    """
+    loc = doc.get("location")
+    ts = doc.get("timestamp")
+    if loc is None and not isinstance(ts, str):
+        return doc
+    view = dict(doc)
+    if loc is not None:
+        view["location"] = location_latlng(loc)
+    if isinstance(ts, str):
+        # legacy ISO strings: naive ones are UTC, make browsers read them as such
+        try:
+            view["timestamp"] = _utc_iso(datetime.fromisoformat(ts.replace("Z", "+00:00")))
+        except ValueError:
+            pass
+    return view
+
+
+def encode_issue(doc):
+    return dumps(issue_view(doc))
+
+
+def json_response(payload, status=200):
+    return Response(dumps(payload), status=status, mimetype="application/json")
@@ -0,0 +1,60 @@
+# reports/stats.py
+
+from datetime import datetime, timedelta
+
+from cache import TTLCache
+
+STATS_TTL_SECONDS = 30
+
+FIXED_STATUSES       = ["done", "completed"]
+IN_PROGRESS_STATUSES = ["in progress", "assigned"]
+
+# One entry, keyed by the change-version (versioning.py) it was computed at:
+# a write in another worker process moves the version and so misses this
+# process's entry. Writes in this process also clear it.
+_stats_cache = TTLCache(ttl=STATS_TTL_SECONDS, maxsize=1)
+
+
+def _since(cutoff):
+    return {"timestamp": {"$gte": cutoff}}
+
+
+def stats_pipeline(now=None):
+    now = now or datetime.utcnow()
+    week_ago  = now - timedelta(days=7)
+    month_ago = now - timedelta(days=30)
+    return [{"$facet": {
+        "total":        [{"$count": "n"}],
+        "week_reports": [{"$match": _since(week_ago)}, {"$count": "n"}],
+        "month_fixed":  [
+            {"$match": {"$and": [_since(month_ago), {"status": {"$in": FIXED_STATUSES}}]}},
+            {"$count": "n"},
+        ],
+        "in_progress":  [{"$match": {"status": {"$in": IN_PROGRESS_STATUSES}}}, {"$count": "n"}],
+        "by_status":    [{"$group": {"_id": {"$ifNull": ["$status", "pending"]}, "n": {"$sum": 1}}}],
+    }}]
+
+
+def compute_stats(db):
+    """Home page counters from a single $facet aggregation over issues."""
+    facets = next(db.issues.aggregate(stats_pipeline()), {})
+
+    def count(name):
+        rows = facets.get(name) or []
+        return rows[0]["n"] if rows else 0
+
+    return {
+        "total":        count("total"),
+        "week_reports": count("week_reports"),
+        "month_fixed":  count("month_fixed"),
+        "in_progress":  count("in_progress"),
+        "by_status":    {row["_id"]: row["n"] for row in facets.get("by_status", [])},
+    }
+
+
+def get_stats(db, version):
+    return _stats_cache.get_or_set(("stats", version), lambda: compute_stats(db))
+
+
+def invalidate_stats():
+    _stats_cache.clear()
@@ -0,0 +1,263 @@
+# reports/uploads.py
+#
+# Resumable chunked uploads straight into GridFS:
+#
+#   POST /api/uploads                   {"filename", "content_type", "size"}
+#                                       -> {"upload_id", "offset", "max_chunk"}
+#   GET  /api/uploads/<id>              -> {"offset", "size"}   (where to resume)
+#   PUT  /api/uploads/<id>?offset=<n>   raw bytes starting at <n> -> {"offset"}
+#   POST /api/uploads/<id>/complete     -> {"file_id"}
+#
+# The upload id is the id of the future GridFS file. Each GridFS chunk is
+# written to fs.chunks as soon as its bytes have arrived; the remainder past
+# the last chunk boundary waits in the session document. `complete` writes
+# that tail as the last chunk and inserts the fs.files document, which is what
+# makes the file visible. Forms then send the file id instead of the image.
+#
+# The digest of every chunk is kept on the session, so `complete` knows the
+# content hash (see filestore.py) and reuses an identical stored file instead.
+# The finished file is held, unreferenced, for UPLOAD_SESSION_MAX_AGE_SECONDS;
+# attaching it to an issue or report (claim_upload) takes the reference, and
+# the janitor deletes it if nobody does.
+
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from bson import Binary, ObjectId
+from bson.errors import InvalidId
+from flask import Blueprint, current_app, request, session
+from gridfs import DEFAULT_CHUNK_SIZE
+from pymongo.errors import DuplicateKeyError
+from werkzeug.utils import secure_filename
+
+from .serializers import json_response
+from .filestore import chunk_digest, content_hash, claim, hold, purge_unclaimed
+from . import derivatives
+
+log = logging.getLogger(__name__)
+
+uploads_bp = Blueprint("uploads", __name__)
+
+
+def _error(message, status):
+    return json_response({"error": message}, status)
+
+
+def _session_for(upload_id):
+    try:
+        oid = ObjectId(upload_id)
+    except (InvalidId, TypeError):
+        return None
+    return current_app.mongo.db.upload_sessions.find_one({"_id": oid, "owner": session["user"]})
+
+
+@uploads_bp.before_request
+def require_login():
+    if "user" not in session:
+        return _error("Please log in first", 401)
+
+
+@uploads_bp.route("/api/uploads", methods=["POST"])
+def initiate_upload():
+    body = request.get_json(silent=True) or {}
+    content_type = str(body.get("content_type") or "")
+    try:
+        size = int(body.get("size"))
+    except (TypeError, ValueError):
+        return _error("Invalid size", 400)
+    if not content_type.startswith("image/"):
+        return _error("Only images can be uploaded", 415)
+    if not 0 < size <= current_app.config["MAX_UPLOAD_BYTES"]:
+        return _error("File too large", 413)
+
+    now = datetime.utcnow()
+    upload_id = current_app.mongo.db.upload_sessions.insert_one({
+        "owner":        session["user"],
+        "filename":     secure_filename(str(body.get("filename") or "")) or "upload",
+        "content_type": content_type,
+        "length":       size,
+        "received":     0,
+        "tail":         Binary(b""),
+        "chunk_digests": [],
+        "created":      now,
+        "updated":      now
+    }).inserted_id
+    return json_response({
+        "upload_id": str(upload_id),
+        "offset":    0,
+        "max_chunk": current_app.config["UPLOAD_CHUNK_BYTES"]
+    }, 201)
+
+
+@uploads_bp.route("/api/uploads/<upload_id>", methods=["GET"])
+def upload_status(upload_id):
+    upload = _session_for(upload_id)
+    if not upload:
+        return _error("Unknown upload", 404)
+    return json_response({"offset": upload["received"], "size": upload["length"]})
+
+
+@uploads_bp.route("/api/uploads/<upload_id>", methods=["PUT"])
+def upload_chunk(upload_id):
+    upload = _session_for(upload_id)
+    if not upload:
+        return _error("Unknown upload", 404)
+    if (request.content_length or 0) > current_app.config["UPLOAD_CHUNK_BYTES"]:
+        return _error("Chunk too large", 413)
+    try:
+        offset = int(request.args.get("offset", ""))
+    except ValueError:
+        return _error("Invalid offset", 400)
+    received = upload["received"]
+    if offset != received:
+        # a retried or out-of-order chunk: tell the client where to resume
+        return json_response({"error": "Offset mismatch", "offset": received}, 409)
+
+    data = request.get_data(cache=False)
+    if len(data) > current_app.config["UPLOAD_CHUNK_BYTES"]:
+        return _error("Chunk too large", 413)
+    if received + len(data) > upload["length"]:
+        return _error("More data than announced", 413)
+
+    db = current_app.mongo.db
+    buf = bytes(upload["tail"]) + data
+    first = received // DEFAULT_CHUNK_SIZE
+    full = len(buf) // DEFAULT_CHUNK_SIZE
+    digests = []
+    for i in range(full):
+        chunk = buf[i * DEFAULT_CHUNK_SIZE:(i + 1) * DEFAULT_CHUNK_SIZE]
+        # replace_one: a retry after a lost response rewrites the same chunk
+        db.fs.chunks.replace_one(
+            {"files_id": upload["_id"], "n": first + i},
+            {"files_id": upload["_id"], "n": first + i, "data": Binary(chunk)},
+            upsert=True
+        )
+        digests.append(Binary(chunk_digest(chunk)))
+    result = db.upload_sessions.update_one(
+        {"_id": upload["_id"], "received": received},
+        {"$set": {
+            "received": received + len(data),
+            "tail":     Binary(buf[full * DEFAULT_CHUNK_SIZE:]),
+            "updated":  datetime.utcnow()
+        },
+         "$push": {"chunk_digests": {"$each": digests}}}
+    )
+    if not result.matched_count:
+        # a concurrent PUT for the same offset won
+        current = db.upload_sessions.find_one({"_id": upload["_id"]}, {"received": 1})
+        return json_response({"error": "Offset mismatch",
+                              "offset": (current or {}).get("received", 0)}, 409)
+    return json_response({"offset": received + len(data)})
+
+
+@uploads_bp.route("/api/uploads/<upload_id>/complete", methods=["POST"])
+def complete_upload(upload_id):
+    db = current_app.mongo.db
+    upload = _session_for(upload_id)
+    if not upload:
+        # completing twice returns the same file
+        file_id = owned_upload(db, upload_id, session["user"])
+        if file_id:
+            return json_response({"file_id": str(file_id)})
+        return _error("Unknown upload", 404)
+    if upload["received"] != upload["length"]:
+        return json_response({"error": "Upload incomplete", "offset": upload["received"]}, 409)
+
+    held_until = datetime.utcnow() + timedelta(seconds=current_app.config["UPLOAD_SESSION_MAX_AGE_SECONDS"])
+    tail = bytes(upload["tail"])
+    digests = [bytes(d) for d in upload["chunk_digests"]] + ([chunk_digest(tail)] if tail else [])
+    sha256 = content_hash(digests)
+    existing = hold(db, sha256, upload["owner"], held_until)
+    if existing:
+        # identical photo already stored: keep that one, drop these chunks
+        db.fs.chunks.delete_many({"files_id": upload["_id"]})
+        db.upload_sessions.delete_one({"_id": upload["_id"]})
+        return json_response({"file_id": str(existing)})
+
+    if tail:
+        db.fs.chunks.replace_one(
+            {"files_id": upload["_id"], "n": upload["received"] // DEFAULT_CHUNK_SIZE},
+            {"files_id": upload["_id"], "n": upload["received"] // DEFAULT_CHUNK_SIZE,
+             "data": Binary(tail)},
+            upsert=True
+        )
+    try:
+        db.fs.files.insert_one({
+            "_id":         upload["_id"],
+            "length":      upload["length"],
+            "chunkSize":   DEFAULT_CHUNK_SIZE,
+            "uploadDate":  datetime.utcnow(),
+            "filename":    upload["filename"],
+            "contentType": upload["content_type"],
+            "metadata":    {"owners": [upload["owner"]], "sha256": sha256, "refcount": 0,
+                            "pending_until": held_until}
+        })
+    except DuplicateKeyError:
+        # a concurrent /complete of this upload, or of the same bytes, got there first
+        if not db.fs.files.find_one({"_id": upload["_id"]}, {"_id": 1}):
+            existing = hold(db, sha256, upload["owner"], held_until)
+            if existing:
+                db.fs.chunks.delete_many({"files_id": upload["_id"]})
+                db.upload_sessions.delete_one({"_id": upload["_id"]})
+                return json_response({"file_id": str(existing)})
+    else:
+        derivatives.enqueue(upload["_id"])
+    db.upload_sessions.delete_one({"_id": upload["_id"]})
+    return json_response({"file_id": str(upload["_id"])})
+
+
+def owned_upload(db, file_id, owner):
+    """ObjectId of a finished upload of `owner`, or None."""
+    try:
+        oid = ObjectId(file_id)
+    except (InvalidId, TypeError):
+        return None
+    found = db.fs.files.find_one({"_id": oid, "metadata.owners": owner}, {"_id": 1})
+    return oid if found else None
+
+
+def claim_upload(db, file_id, owner):
+    """
+    Attach a finished upload of `owner`: takes a reference on it (released
+    with the issue or report) and returns its ObjectId, or None. Forms pass
+    the id they got from /complete; this keeps one user from attaching
+    another's file.
+    """
+    try:
+        oid = ObjectId(file_id)
+    except (InvalidId, TypeError):
+        return None
+    return oid if claim(db, oid, owner) else None
+
+
+def cleanup_abandoned_uploads(db, max_age_seconds):
+    """
+    Drop sessions idle for longer than `max_age_seconds` and their chunks,
+    and finished uploads whose hold ran out unclaimed.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=max_age_seconds)
+    removed = 0
+    for upload in db.upload_sessions.find({"updated": {"$lt": cutoff}}, {"_id": 1}):
+        db.fs.chunks.delete_many({"files_id": upload["_id"]})
+        removed += db.upload_sessions.delete_one({"_id": upload["_id"]}).deleted_count
+    purged = purge_unclaimed(db)
+    if purged:
+        log.info("Purged %d unclaimed uploads", purged)
+    return removed
+
+
+def start_upload_janitor(app, interval, max_age_seconds):
+    """Run cleanup_abandoned_uploads every `interval` seconds in a daemon thread."""
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                with app.app_context():
+                    cleanup_abandoned_uploads(app.mongo.db, max_age_seconds)
+            except Exception:
+                log.exception("Upload cleanup failed")
+
+    threading.Thread(target=loop, name="upload-janitor", daemon=True).start()
+    return stop
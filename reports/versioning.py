@@ -0,0 +1,142 @@
+# reports/versioning.py
+
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import current_app, request, make_response, session
+from pymongo import ReturnDocument
+
+from .stats import invalidate_stats
+
+# Single counter document in the `meta` collection. Every route that writes
+# to issues / done_issues / users bumps it, so it identifies the state of the
+# data, and stamps the documents it writes with a version from it.
+#
+# A stamped version is handed out before its write lands. Until the write
+# ends, a lease in `version_leases` {floor, at} says "some version above
+# `floor` is still being written", so delta sync (changes.py) never reports
+# a high-water mark past it. A lease left by a crashed process stops
+# counting after LEASE_TIMEOUT.
+VERSION_KEY = "issues_version"
+LEASE_TIMEOUT = timedelta(seconds=60)
+
+# leases taken by the running request (or command), released by bump_version()
+_held = threading.local()
+
+
+def current_version(db):
+    doc = db.meta.find_one({"_id": VERSION_KEY})
+    return doc["value"] if doc else 0
+
+
+def committed_version(db):
+    """The newest version up to which every write has landed."""
+    # counter first, then leases: a lease taken after the counter was read
+    # belongs to a version above it
+    version = current_version(db)
+    oldest = db.version_leases.find_one(
+        {"at": {"$gt": datetime.utcnow() - LEASE_TIMEOUT}}, sort=[("floor", 1)]
+    )
+    return min(version, oldest["floor"]) if oldest else version
+
+
+def _advance(db):
+    doc = db.meta.find_one_and_update(
+        {"_id": VERSION_KEY},
+        {"$inc": {"value": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return doc["value"]
+
+
+def next_version(db):
+    """
+    Advance the change-version and return it, to stamp on the documents a
+    write is about to touch (their `version` field, see changes.py). Holds a
+    lease until the write ends with bump_version(), which also keeps ETags
+    handed out while it was in flight from outliving it.
+    """
+    lease = db.version_leases.insert_one(
+        {"floor": current_version(db), "at": datetime.utcnow()}
+    ).inserted_id
+    if not hasattr(_held, "leases"):
+        _held.leases = []
+    _held.leases.append(lease)
+    return _advance(db)
+
+
+def release_versions(db):
+    """Drop the leases of this request's writes: they have landed (or failed)."""
+    leases = getattr(_held, "leases", None)
+    if leases:
+        _held.leases = []
+        db.version_leases.delete_many({"_id": {"$in": leases}})
+
+
+def teardown_versions(exc=None):
+    """App teardown: a write that failed before bump_version() releases here."""
+    if getattr(_held, "leases", None):
+        release_versions(current_app.mongo.db)
+
+
+def bump_version(db):
+    """Record a write: advance the change-version and drop derived caches."""
+    version = _advance(db)
+    release_versions(db)
+    invalidate_stats()
+    return version
+
+
+def record_deletion(db, collection, doc_id, version):
+    """Leave a tombstone so delta-syncing clients learn about the delete."""
+    db.tombstones.update_one(
+        {"collection": collection, "doc_id": doc_id},
+        {"$set": {"version": version, "deleted_at": datetime.utcnow()}},
+        upsert=True
+    )
+
+
+def make_etag(version, private=False):
+    # the same data version yields different bodies for different query
+    # strings, and JSON vs NDJSON depending on Accept
+    accept = request.headers.get("Accept", "")
+    key = f"{version}:{request.full_path}:{accept}"
+    if private:
+        key += f":{session.get('role')}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def etag_by_version(view=None, *, private=False):
+    """
+    Strong ETag for a read-only JSON view, derived from the change-version.
+    A matching If-None-Match is answered with 304 before the view runs, so
+    revalidation costs one read of the counter and never touches the data.
+
+    private=True for views whose body depends on the caller's role: the
+    role goes into the ETag and shared caches are told to keep out.
+    """
+    if view is None:
+        return lambda view: etag_by_version(view, private=private)
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = make_etag(current_version(current_app.mongo.db), private)
+        if request.if_none_match.contains(etag):
+            response = make_response("", 304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        response.vary.add("Accept")
+        # always revalidate, the 304 keeps it cheap
+        if private:
+            response.vary.add("Cookie")
+            response.headers["Cache-Control"] = "private, no-cache"
+        else:
+            response.headers["Cache-Control"] = "no-cache"
+        return response
+    return wrapper
@@ -0,0 +1,68 @@
+// Resumable photo uploads through /api/uploads (see reports/uploads.py).
+// ChunkedUpload.uploadFile(file, onProgress) resolves to the GridFS file id.
+// A dropped connection resumes from the offset the server already has
+// instead of sending the whole photo again.
+(function () {
+  const MAX_RETRIES = 5;
+
+  function sleep(ms) {
+    return new Promise(resolve => setTimeout(resolve, ms));
+  }
+
+  async function call(method, url, body, headers) {
+    const res = await fetch(url, { method, body, headers, credentials: 'same-origin' });
+    const data = await res.json().catch(() => ({}));
+    return { status: res.status, data };
+  }
+
+  async function uploadFile(file, onProgress) {
+    let res = await call('POST', '/api/uploads',
+      JSON.stringify({ filename: file.name, content_type: file.type, size: file.size }),
+      { 'Content-Type': 'application/json' });
+    if (res.status !== 201) {
+      throw new Error(res.data.error || 'Upload failed.');
+    }
+    const uploadId = res.data.upload_id;
+    const chunkSize = res.data.max_chunk;
+    let offset = res.data.offset;
+    let failures = 0;
+
+    while (offset < file.size) {
+      try {
+        res = await call('PUT', `/api/uploads/${uploadId}?offset=${offset}`,
+          file.slice(offset, offset + chunkSize),
+          { 'Content-Type': 'application/octet-stream' });
+      } catch (err) {
+        res = null;  // network error
+      }
+
+      if (res && (res.status === 200 || res.status === 409)) {
+        // 409: the server has a different offset, continue from there
+        offset = res.data.offset;
+        failures = 0;
+        if (onProgress) onProgress(offset / file.size);
+      } else if (res && res.status < 500) {
+        throw new Error(res.data.error || 'Upload failed.');
+      } else {
+        if (++failures > MAX_RETRIES) {
+          throw new Error('Upload failed, please check your connection.');
+        }
+        await sleep(1000 * 2 ** failures);
+        try {
+          const status = await call('GET', `/api/uploads/${uploadId}`);
+          if (status.status === 200) offset = status.data.offset;
+        } catch (err) {
+          // still offline, the next PUT will tell
+        }
+      }
+    }
+
+    res = await call('POST', `/api/uploads/${uploadId}/complete`);
+    if (res.status !== 200) {
+      throw new Error(res.data.error || 'Upload failed.');
+    }
+    return res.data.file_id;
+  }
+
+  window.ChunkedUpload = { uploadFile };
+})();
@@ -0,0 +1,113 @@
+# storage.py
+#
+# Where app.mongo comes from. Every blueprint reaches the data through
+# `current_app.mongo.db.<collection>` (and GridFS(db) for files), i.e. the
+# pymongo Database API, so that API is the storage interface and each
+# backend provides it:
+#
+#     STORAGE_BACKEND=mongo    MongoDB through Flask-PyMongo (default)
+#     STORAGE_BACKEND=memory   an in-process database (needs mongomock):
+#                              same query and update semantics, unique
+#                              indexes enforced, GridFS, nothing leaves the
+#                              process. For tests and offline benchmarks.
+#
+# The memory backend has no query planner (explain) and no $text search.
+
+import inspect
+import urllib.parse
+
+from flask_pymongo import PyMongo
+from flask_pymongo.helpers import BSONObjectIdConverter, BSONProvider
+
+try:
+    import mongomock
+    import mongomock.collection
+    import mongomock.filtering
+    import mongomock.gridfs
+except ImportError:  # optional: only the memory backend needs it
+    mongomock = None
+
+BACKENDS = ("mongo", "memory")
+
+
+class MemoryStorage:
+    """
+    The memory backend, shaped like flask_pymongo.PyMongo (`cx`, `db`).
+    Each instance is its own empty database. Connection pool options have
+    nothing to size here and are ignored.
+    """
+
+    def __init__(self, app, **client_options):
+        if mongomock is None:
+            raise RuntimeError("STORAGE_BACKEND=memory needs mongomock (pip install mongomock)")
+        _extend_mongomock()
+        self.cx = mongomock.MongoClient()
+        self.db = self.cx[_database_name(app.config.get("MONGO_URI")) or "App"]
+        # what Flask-PyMongo sets up, so routes behave the same on both backends
+        app.url_map.converters["ObjectId"] = BSONObjectIdConverter
+        app.json = BSONProvider(app)
+
+
+def _database_name(uri):
+    # no DNS lookups for mongodb+srv:// here, unlike pymongo's parse_uri
+    return urllib.parse.urlsplit(uri or "").path.lstrip("/") or None
+
+
+def open_storage(app, **client_options):
+    """The backend named by STORAGE_BACKEND, bound to `app`."""
+    backend = app.config.get("STORAGE_BACKEND", "mongo")
+    if backend == "mongo":
+        return PyMongo(app, **client_options)
+    if backend == "memory":
+        return MemoryStorage(app, **client_options)
+    raise ValueError(f"STORAGE_BACKEND must be one of {', '.join(BACKENDS)}, not {backend!r}")
+
+
+# ── mongomock gaps ─────────────────────────────────────────────────────
+# Query features the app uses that mongomock lacks, added once per process.
+
+_extended = False
+
+
+def _point_in_ring(x, y, ring):
+    inside = False
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+        if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+            inside = not inside
+    return inside
+
+
+def _geo_within(value, query):
+    """$geoWithin a GeoJSON Polygon (outer ring, holes excluded) for Points."""
+    if not isinstance(value, dict) or value.get("type") != "Point":
+        return False
+    geometry = query.get("$geometry") if isinstance(query, dict) else None
+    if not geometry or geometry.get("type") != "Polygon":
+        raise NotImplementedError("memory backend: $geoWithin supports $geometry Polygons only")
+    x, y = value["coordinates"][:2]
+    outer, *holes = geometry["coordinates"]
+    return _point_in_ring(x, y, outer) and not any(_point_in_ring(x, y, h) for h in holes)
+
+
+def _extend_mongomock():
+    global _extended
+    if _extended:
+        return
+    _extended = True
+
+    # GridFS(db) on mongomock databases
+    mongomock.gridfs.enable_gridfs_integration()
+
+    mongomock.filtering._filterer_inst._operator_map["$geoWithin"] = _geo_within
+
+    # pymongo >= 4.9 hands UpdateOne's `sort` to bulk builders that predate it
+    builder = mongomock.collection.BulkOperationBuilder
+    if "sort" not in inspect.signature(builder.add_update).parameters:
+        add_update = builder.add_update
+
+        def add_update_with_sort(self, *args, sort=None, **kwargs):
+            if sort:
+                raise NotImplementedError("memory backend: UpdateOne(sort=...) in bulk_write")
+            return add_update(self, *args, **kwargs)
+
+        builder.add_update = add_update_with_sort
@@ -0,0 +1,11 @@
+# tests/conftest.py
+#
+# The suite runs offline against the in-memory storage backend (storage.py).
+# Set STORAGE_BACKEND=mongo and MONGO_URI to run it against a real server.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("SECRET_KEY", "tests-only-secret")
@@ -0,0 +1,30 @@
+# tests/query_plans.py
+
+import pytest
+
+
+def plan_stages(plan):
+    """Yield every stage name in an explain() plan tree."""
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from plan_stages(item)
+
+
+def assert_no_collscan(collection, query, sort=None):
+    """Explain `find(query).sort(sort)` and fail if the winning plan scans the collection."""
+    cursor = collection.find(query)
+    if sort:
+        cursor = cursor.sort(sort)
+    if not hasattr(cursor, "explain"):
+        pytest.skip("backend does not support explain()")
+    explained = cursor.explain()
+    winning = explained.get("queryPlanner", {}).get("winningPlan", {})
+    stages = list(plan_stages(winning))
+    assert "COLLSCAN" not in stages, (
+        f"{collection.name}.find({query}).sort({sort}) falls back to COLLSCAN: {stages}"
+    )
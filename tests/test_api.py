@@ -0,0 +1,1053 @@
+# tests/test_api.py
+
+import io
+import json
+import time
+import pytest
+from datetime import datetime, timedelta
+from bson import ObjectId
+
+import run
+import migrations
+from run import app
+from auth.users import invalidate_user
+
+# ------------------------------------------------------------
+# FIXTURES
+# ------------------------------------------------------------
+@pytest.fixture
+def client():
+    app.config.update({
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+    })
+    return app.test_client()
+
+@pytest.fixture
+def mongodb():
+    return app.mongo.db
+
+# ------------------------------------------------------------
+# HELPERS
+# ------------------------------------------------------------
+API_REPORTER = "api-tests@example.com"
+
+
+def create_issues(db, count, reporter_email=API_REPORTER, **extra):
+    db.issues.delete_many({"reporter_email": reporter_email})
+    base = datetime.utcnow()
+    ids = []
+    for n in range(count):
+        doc = {
+            "reporter_email": reporter_email,
+            "description":    f"API issue {n}",
+            "city_street":    "Herzl St",
+            "category":       "pothole",
+            "location":       {"type": "Point", "coordinates": [35.21, 31.77]},
+            "status":         "pending",
+            "assigned_to":    None,
+            "timestamp":      base - timedelta(minutes=n)
+        }
+        doc.update(extra)
+        ids.append(str(db.issues.insert_one(doc).inserted_id))
+    return ids
+
+
+def create_user_session(client, db, email, role="user"):
+    db.users.delete_many({"email": email})
+    db.users.insert_one({"name": email.split("@")[0].capitalize(), "email": email,
+                         "password": "x", "role": role})
+    invalidate_user(email)
+    with client.session_transaction() as sess:
+        sess["user"] = email
+        sess["role"] = role
+
+# ------------------------------------------------------------
+# 1. CURSOR PAGINATION & FIELD PROJECTION
+# ------------------------------------------------------------
+def test_user_issues_cursor_pagination(client, mongodb):
+    ids = create_issues(mongodb, 5)
+
+    seen, cursor = [], None
+    while True:
+        url = f"/api/issues/user/{API_REPORTER}?limit=2"
+        if cursor:
+            url += f"&cursor={cursor}"
+        data = client.get(url).get_json()
+        assert len(data["issues"]) <= 2
+        seen += [i["_id"] for i in data["issues"]]
+        cursor = data["next_cursor"]
+        if not cursor:
+            break
+
+    # newest first, every issue exactly once
+    assert seen == ids
+
+
+def test_issues_field_projection(client, mongodb):
+    create_issues(mongodb, 1)
+    rv = client.get(f"/api/issues/user/{API_REPORTER}?fields=_id,location,status,category")
+    assert rv.status_code == 200
+    issue = rv.get_json()["issues"][0]
+    assert set(issue) == {"_id", "location", "status", "category"}
+
+
+def test_issues_date_range(client, mongodb):
+    ids = create_issues(mongodb, 4)
+    newest = mongodb.issues.find_one({"_id": ObjectId(ids[0])})["timestamp"]
+    since = (newest - timedelta(minutes=2, seconds=30)).isoformat() + "Z"
+    until = (newest - timedelta(seconds=30)).isoformat() + "Z"
+
+    data = client.get(f"/api/issues/user/{API_REPORTER}?since={since}&until={until}").get_json()
+    assert [i["_id"] for i in data["issues"]] == ids[1:3]
+    assert client.get("/api/issues?since=yesterday").status_code == 400
+
+
+def test_issues_bad_pagination_params(client):
+    assert client.get("/api/issues?cursor=not-a-cursor").status_code == 400
+    assert client.get("/api/issues?limit=0").status_code == 400
+    assert client.get("/api/issues?fields=password").status_code == 400
+
+# ------------------------------------------------------------
+# 2. GEOSPATIAL VIEWPORT QUERIES
+# ------------------------------------------------------------
+def test_bbox_returns_only_issues_in_viewport(client, mongodb):
+    inside = create_issues(mongodb, 2)
+    outside = str(mongodb.issues.insert_one({
+        "reporter_email": API_REPORTER,
+        "description":    "Far away",
+        "location":       {"type": "Point", "coordinates": [-0.12, 51.5]},
+        "status":         "pending",
+        "timestamp":      datetime.utcnow()
+    }).inserted_id)
+
+    rv = client.get("/api/issues/bbox?sw=31.7,35.1&ne=31.8,35.3&limit=500")
+    assert rv.status_code == 200
+    ids = {i["_id"] for i in rv.get_json()["issues"]}
+    assert set(inside) <= ids
+    assert outside not in ids
+    # the API keeps the {lat, lng} shape for clients
+    assert rv.get_json()["issues"][0]["location"].keys() == {"lat", "lng"}
+
+
+def test_world_bbox_is_cut_into_narrow_strips(mongodb):
+    from reports.geo import MAX_STRIP_DEGREES, bbox_query
+
+    query = bbox_query((-85, -180), (85, 180))
+    rings = [part["location"]["$geoWithin"]["$geometry"]["coordinates"][0]
+             for part in query["$or"]]
+    assert len(rings) == 4
+    lngs = [(ring[0][0], ring[1][0]) for ring in rings]
+    assert lngs[0][0] == -180 and lngs[-1][1] == 180
+    assert all(0 < east - west <= MAX_STRIP_DEGREES for west, east in lngs)
+    assert all(a[1] == b[0] for a, b in zip(lngs, lngs[1:]))
+
+    ids = mongodb.issues.insert_many([
+        {"location": {"type": "Point", "coordinates": [lng, 10.0]}} for lng in (-179.5, 0.5, 179.5)
+    ]).inserted_ids
+    found = mongodb.issues.count_documents({"$and": [query, {"_id": {"$in": ids}}]})
+    mongodb.issues.delete_many({"_id": {"$in": ids}})
+    assert found == 3
+
+
+def test_bbox_rejects_bad_corners(client):
+    assert client.get("/api/issues/bbox?sw=31.8,35.3&ne=31.7,35.1").status_code == 400
+    assert client.get("/api/issues/bbox?sw=abc&ne=31.7,35.1").status_code == 400
+
+
+def test_backfill_geojson_locations(mongodb):
+    mongodb.issues.delete_many({"reporter_email": API_REPORTER})
+    oid = mongodb.issues.insert_one({
+        "reporter_email": API_REPORTER,
+        "location":       {"lat": 31.77, "lng": 35.21},
+    }).inserted_id
+
+    assert migrations.backfill_geojson_locations(mongodb) >= 1
+    doc = mongodb.issues.find_one({"_id": oid})
+    assert doc["location"] == {"type": "Point", "coordinates": [35.21, 31.77]}
+    assert migrations.backfill_geojson_locations(mongodb) == 0
+
+# ------------------------------------------------------------
+# 3. SERVER-SIDE MARKER CLUSTERS
+# ------------------------------------------------------------
+def test_clusters_aggregate_dense_area(client, mongodb):
+    create_issues(mongodb, 3)
+    mongodb.issues.update_one({"reporter_email": API_REPORTER}, {"$set": {"status": "done"}})
+
+    rv = client.get("/api/issues/clusters?sw=31.7,35.1&ne=31.8,35.3&zoom=10")
+    assert rv.status_code == 200
+    clusters = rv.get_json()["clusters"]
+    cluster = next(c for c in clusters if abs(c["lat"] - 31.77) < 1e-6)
+    assert cluster["count"] >= 3
+    assert cluster["statuses"].get("done", 0) >= 1
+    assert abs(cluster["lng"] - 35.21) < 1e-6
+
+
+def test_clusters_require_zoom(client):
+    assert client.get("/api/issues/clusters?sw=31.7,35.1&ne=31.8,35.3").status_code == 400
+
+# ------------------------------------------------------------
+# 4. AGGREGATED HOME PAGE STATS
+# ------------------------------------------------------------
+def test_stats_counts_and_invalidation(client, mongodb):
+    before = client.get("/api/stats").get_json()
+    assert set(before) >= {"total", "week_reports", "month_fixed", "in_progress", "by_status"}
+
+    email = "stats@example.com"
+    create_user_session(client, mongodb, email)
+    rv = client.post("/report_issue", data={
+        "description": "Stats issue", "city_street": "Main St",
+        "category": "pothole", "lat": "31.77", "lng": "35.21"
+    })
+    assert rv.status_code == 302
+
+    # the write invalidated the cached counters
+    after = client.get("/api/stats").get_json()
+    assert after["total"] == before["total"] + 1
+    assert after["week_reports"] == before["week_reports"] + 1
+    mongodb.issues.delete_many({"reporter_email": email})
+
+
+def test_stats_follow_writes_of_other_processes(client, mongodb):
+    from reports.stats import compute_stats
+    from reports.versioning import _advance
+
+    before = client.get("/api/stats")
+    # another worker's write: the data and the version move, this process's cache isn't cleared
+    ids = create_issues(mongodb, 1, reporter_email="elsewhere@example.com")
+    _advance(mongodb)
+    rv = client.get("/api/stats", headers={"If-None-Match": before.headers["ETag"]})
+    assert rv.status_code == 200
+    assert rv.get_json()["total"] == compute_stats(mongodb)["total"]
+    mongodb.issues.delete_many({"_id": {"$in": [ObjectId(i) for i in ids]}})
+
+# ------------------------------------------------------------
+# 5. ETAG REVALIDATION
+# ------------------------------------------------------------
+def test_issues_etag_revalidation(client, mongodb):
+    ids = create_issues(mongodb, 1)
+
+    rv = client.get("/api/issues?limit=5")
+    etag = rv.headers["ETag"]
+    assert rv.status_code == 200 and etag
+
+    rv2 = client.get("/api/issues?limit=5", headers={"If-None-Match": etag})
+    assert rv2.status_code == 304
+    assert rv2.data == b""
+
+    # a different query string is a different representation
+    rv3 = client.get("/api/issues?limit=6", headers={"If-None-Match": etag})
+    assert rv3.status_code == 200
+
+    # any write through the app bumps the change-version
+    create_user_session(client, mongodb, "etag@example.com", role="maintenance")
+    mongodb.issues.update_one({"_id": ObjectId(ids[0])}, {"$set": {"assigned_to": "etag@example.com"}})
+    client.post(f"/maintenance/update_status/{ids[0]}", data={"status": "in progress"})
+    rv4 = client.get("/api/issues?limit=5", headers={"If-None-Match": etag})
+    assert rv4.status_code == 200
+    assert rv4.headers["ETag"] != etag
+
+# ------------------------------------------------------------
+# 6. NDJSON STREAMING
+# ------------------------------------------------------------
+def test_issues_ndjson_stream(client, mongodb):
+    ids = create_issues(mongodb, 3)
+
+    rv = client.get("/api/issues?stream=1&fields=_id,status")
+    assert rv.status_code == 200
+    assert rv.mimetype == "application/x-ndjson"
+    rows = [json.loads(line) for line in rv.data.decode().splitlines()]
+    assert set(ids) <= {r["_id"] for r in rows}
+    assert all(set(r) == {"_id", "status"} for r in rows)
+
+
+def test_done_reports_ndjson_via_accept(client, mongodb):
+    mongodb.done_issues.insert_one({
+        "original_issue_id": str(ObjectId()),
+        "completion_description": "streamed",
+        "timestamp": datetime.utcnow()
+    })
+    rv = client.get("/api/done_reports", headers={"Accept": "application/x-ndjson"})
+    assert rv.mimetype == "application/x-ndjson"
+    rows = [json.loads(line) for line in rv.data.decode().splitlines()]
+    assert any(r["completion_description"] == "streamed" for r in rows)
+
+# ------------------------------------------------------------
+# 7. SERIALIZATION LAYER
+# ------------------------------------------------------------
+def test_serializer_encodes_bson_types():
+    from reports import serializers
+
+    oid, img = ObjectId(), ObjectId()
+    doc = {
+        "_id":           oid,
+        "image_file_id": img,
+        "location":      {"type": "Point", "coordinates": [35.21, 31.77]},
+        "timestamp":     datetime(2024, 5, 1, 12, 30, 0, 250000),
+    }
+    out = json.loads(serializers.encode_issue(doc))
+    assert out == {
+        "_id":           str(oid),
+        "image_file_id": str(img),
+        "location":      {"lat": 31.77, "lng": 35.21},
+        "timestamp":     "2024-05-01T12:30:00.250000Z",
+    }
+    # the caller's document is left untouched
+    assert doc["_id"] is oid and doc["location"]["type"] == "Point"
+
+
+def test_serializer_normalizes_legacy_string_timestamps():
+    from reports import serializers
+
+    out = json.loads(serializers.encode_issue({"timestamp": "2024-05-01T12:30:00+00:00"}))
+    assert out["timestamp"] == "2024-05-01T12:30:00Z"
+
+# ------------------------------------------------------------
+# 8. ADMIN REVIEW QUEUE
+# ------------------------------------------------------------
+def test_review_queue_pages_and_filters(client, mongodb):
+    ids = create_issues(mongodb, 3, status="in progress")
+    mongodb.done_issues.delete_many({"technician": "queue-tech@example.com"})
+    # newer than anything else in the queue, so these come first
+    base = datetime.utcnow() + timedelta(days=1)
+    for n, issue_id in enumerate(ids):
+        mongodb.done_issues.insert_one({
+            "original_issue_id": ObjectId(issue_id),
+            "technician":        "queue-tech@example.com",
+            "status":            "accepted" if n == 0 else "pending",
+            "timestamp":         base - timedelta(minutes=n)
+        })
+    mongodb.issues.update_one({"_id": ObjectId(ids[0])}, {"$set": {"status": "done"}})
+
+    create_user_session(client, mongodb, "user@example.com", role="user")
+    assert client.get("/api/admin/review_queue").status_code == 403
+
+    create_user_session(client, mongodb, "admin@example.com", role="admin")
+    page = client.get("/api/admin/review_queue?limit=1").get_json()
+    assert [d["original_issue_id"] for d in page["done_reports"]] == [ids[1]]
+    assert page["done_reports"][0]["issue_status"] == "in progress"
+
+    page = client.get(f"/api/admin/review_queue?limit=1&cursor={page['next_cursor']}").get_json()
+    assert [d["original_issue_id"] for d in page["done_reports"]] == [ids[2]]
+
+    accepted = client.get("/api/admin/review_queue?status=accepted&limit=1").get_json()["done_reports"]
+    assert [(d["original_issue_id"], d["issue_status"]) for d in accepted] == [(ids[0], "done")]
+    assert client.get("/api/admin/review_queue?status=bogus").status_code == 400
+    mongodb.done_issues.delete_many({"technician": "queue-tech@example.com"})
+
+
+def test_backfill_datetime_timestamps(mongodb):
+    ids = create_issues(mongodb, 2)
+    mongodb.issues.update_one({"_id": ObjectId(ids[0])},
+                              {"$set": {"timestamp": "2024-05-01T12:30:00+02:00"}})
+    mongodb.issues.update_one({"_id": ObjectId(ids[1])},
+                              {"$set": {"timestamp": "2024-05-01T09:00:00.500000"}})
+
+    assert migrations.backfill_datetime_timestamps(mongodb, batch_size=1) >= 2
+    docs = {str(d["_id"]): d["timestamp"] for d in mongodb.issues.find({"reporter_email": API_REPORTER})}
+    assert docs[ids[0]] == datetime(2024, 5, 1, 10, 30)
+    assert docs[ids[1]] == datetime(2024, 5, 1, 9, 0, 0, 500000)
+    assert mongodb.issues.count_documents({"timestamp": {"$type": "string"}}) == 0
+
+
+def test_normalize_done_issues(mongodb):
+    ids = create_issues(mongodb, 2)
+    mongodb.issues.update_one({"_id": ObjectId(ids[0])}, {"$set": {"status": "done"}})
+    oids = [ObjectId(i) for i in ids]
+    mongodb.done_issues.delete_many({"original_issue_id": {"$in": ids + oids}})
+    mongodb.done_issues.insert_many([{"original_issue_id": i} for i in ids])
+
+    # other unmigrated reports in the collection are normalized too
+    assert migrations.normalize_done_issues(mongodb, batch_size=1) >= 2
+    docs = {str(d["original_issue_id"]): d for d in mongodb.done_issues.find({"original_issue_id": {"$in": oids}})}
+    assert set(docs) == set(ids)
+    assert all(isinstance(d["original_issue_id"], ObjectId) for d in docs.values())
+    assert docs[ids[0]]["status"] == "accepted"
+    assert docs[ids[1]]["status"] == "pending"
+    # re-running is a no-op
+    assert migrations.normalize_done_issues(mongodb) == 0
+    mongodb.done_issues.delete_many({"original_issue_id": {"$in": oids}})
+
+
+# ------------------------------------------------------------
+# 9. CURRENT-USER LOADER
+# ------------------------------------------------------------
+def test_current_user_cached_and_invalidated(client, mongodb):
+    email = "cached-user@example.com"
+    create_user_session(client, mongodb, email, role="maintenance")
+    assert client.get("/maintenance/dashboard").status_code == 200
+
+    # a write behind the app's back is not seen until the entry is invalidated
+    mongodb.users.update_one({"email": email}, {"$set": {"role": "user"}})
+    assert client.get("/maintenance/dashboard").status_code == 200
+
+    # the admin role editor invalidates by _id
+    user_id = str(mongodb.users.find_one({"email": email})["_id"])
+    create_user_session(client, mongodb, "roles-admin@example.com", role="admin")
+    rv = client.post("/admin/users/", data={"user_id": user_id, "role": "user"})
+    assert rv.status_code == 302
+
+    with client.session_transaction() as sess:
+        sess["user"] = email
+        sess["role"] = "user"
+    assert client.get("/maintenance/dashboard").status_code == 302
+
+# ------------------------------------------------------------
+# 10. STREAMED GRIDFS IMAGES
+# ------------------------------------------------------------
+def test_uploads_stream_with_range_and_etag(client, mongodb):
+    from gridfs import GridFS
+
+    data = bytes(range(256)) * 1200
+    file_id = GridFS(mongodb).put(data, filename="photo.jpg", content_type="image/jpeg")
+
+    rv = client.get(f"/uploads/{file_id}")
+    assert rv.status_code == 200
+    assert rv.data == data
+    assert rv.mimetype == "image/jpeg"
+    assert "immutable" in rv.headers["Cache-Control"]
+    etag = rv.headers["ETag"]
+
+    rv = client.get(f"/uploads/{file_id}", headers={"Range": "bytes=300000-300009"})
+    assert rv.status_code == 206
+    assert rv.data == data[300000:300010]
+    assert rv.headers["Content-Range"] == f"bytes 300000-300009/{len(data)}"
+
+    rv = client.get(f"/done_uploads/{file_id}", headers={"If-None-Match": etag})
+    assert rv.status_code == 304 and rv.data == b""
+
+    assert client.get("/uploads/not-an-id").status_code == 404
+    assert client.get(f"/uploads/{ObjectId()}").status_code == 404
+
+
+def test_thumbnails_rendered_and_served(client, mongodb):
+    pytest.importorskip("PIL")
+    from PIL import Image
+    from gridfs import GridFS
+    from reports import derivatives
+
+    photo = Image.new("RGB", (2000, 1000), "red")
+    exif = photo.getexif()
+    exif[0x010F] = "TestCam"
+    buf = io.BytesIO()
+    photo.save(buf, "JPEG", exif=exif)
+    file_id = GridFS(mongodb).put(buf.getvalue(), filename="big.jpg", content_type="image/jpeg")
+
+    # not rendered yet: the original stands in, without the immutable header
+    rv = client.get(f"/uploads/{file_id}?size=thumb")
+    assert rv.status_code == 200 and rv.data == buf.getvalue()
+    assert "immutable" not in rv.headers["Cache-Control"]
+
+    # the sweep queues it again, e.g. after its queued id was lost
+    def swept():
+        derivatives.enqueue_missing(mongodb)
+        ids = []
+        while not derivatives._queue.empty():
+            ids.append(derivatives._queue.get_nowait())
+        return ids
+    assert file_id in swept()
+
+    assert derivatives.generate_derivatives(mongodb, file_id)
+    assert not derivatives.generate_derivatives(mongodb, file_id)
+    assert mongodb.fs.files.find_one({"_id": file_id})["metadata"]["derivatives"] == "done"
+    assert file_id not in swept()
+    rv = client.get(f"/uploads/{file_id}?size=thumb")
+    thumb = Image.open(io.BytesIO(rv.data))
+    assert thumb.size == (320, 160)
+    assert not thumb.getexif()
+    assert "immutable" in rv.headers["Cache-Control"]
+    assert client.get(f"/uploads/{file_id}?size=huge").status_code == 400
+
+
+def test_undecodable_image_is_given_up_on(mongodb):
+    pytest.importorskip("PIL")
+    from gridfs import GridFS
+    from reports import derivatives
+
+    file_id = GridFS(mongodb).put(b"not really a jpeg", filename="broken.jpg",
+                                  content_type="image/jpeg")
+    for _ in range(derivatives.MAX_RENDER_ATTEMPTS):
+        with pytest.raises(Exception):
+            derivatives.generate_derivatives(mongodb, file_id)
+    metadata = mongodb.fs.files.find_one({"_id": file_id})["metadata"]
+    assert metadata["derivatives"] == "failed"
+    assert metadata["derivative_failures"] == derivatives.MAX_RENDER_ATTEMPTS
+    # no longer read, rendered or swept
+    assert not derivatives.generate_derivatives(mongodb, file_id)
+    assert file_id not in [doc["_id"] for doc in derivatives._originals(mongodb)]
+
+# ------------------------------------------------------------
+# 11. RESUMABLE CHUNKED UPLOADS
+# ------------------------------------------------------------
+def test_chunked_upload_resume_and_claim(client, mongodb):
+    email = "uploader@example.com"
+    create_user_session(client, mongodb, email)
+    data = bytes(range(256)) * 2800  # ~700 KB, not a multiple of the GridFS chunk size
+
+    rv = client.post("/api/uploads", json={"filename": "pothole.jpg",
+                                           "content_type": "image/jpeg", "size": len(data)})
+    assert rv.status_code == 201
+    upload_id = rv.get_json()["upload_id"]
+
+    step = 300 * 1024
+    assert client.put(f"/api/uploads/{upload_id}?offset=0", data=data[:step]).get_json()["offset"] == step
+    # a retried chunk is refused with the offset to resume from
+    rv = client.put(f"/api/uploads/{upload_id}?offset=0", data=data[:step])
+    assert rv.status_code == 409 and rv.get_json()["offset"] == step
+    assert client.get(f"/api/uploads/{upload_id}").get_json()["offset"] == step
+    assert client.post(f"/api/uploads/{upload_id}/complete").status_code == 409
+
+    for offset in range(step, len(data), step):
+        assert client.put(f"/api/uploads/{upload_id}?offset={offset}",
+                          data=data[offset:offset + step]).status_code == 200
+    file_id = client.post(f"/api/uploads/{upload_id}/complete").get_json()["file_id"]
+    assert file_id == upload_id
+    assert client.get(f"/uploads/{file_id}").data == data
+
+    rv = client.post("/report_issue", data={
+        "description": "Chunked", "city_street": "Main St", "category": "pothole",
+        "lat": "31.77", "lng": "35.21", "image_file_id": file_id
+    })
+    assert rv.status_code == 302
+    assert mongodb.issues.find_one({"reporter_email": email})["image_file_id"] == ObjectId(file_id)
+    mongodb.issues.delete_many({"reporter_email": email})
+
+    # someone else's file id can't be attached
+    create_user_session(client, mongodb, "other-uploader@example.com")
+    client.post("/report_issue", data={
+        "description": "Stolen", "city_street": "Main St", "category": "pothole",
+        "lat": "31.77", "lng": "35.21", "image_file_id": file_id
+    })
+    assert mongodb.issues.count_documents({"reporter_email": "other-uploader@example.com"}) == 0
+
+
+def test_chunked_upload_limits_and_cleanup(client, mongodb):
+    from reports.uploads import cleanup_abandoned_uploads
+
+    create_user_session(client, mongodb, "uploader@example.com")
+    too_big = app.config["MAX_UPLOAD_BYTES"] + 1
+    assert client.post("/api/uploads", json={"content_type": "image/png", "size": too_big}).status_code == 413
+    assert client.post("/api/uploads", json={"content_type": "text/html", "size": 10}).status_code == 415
+
+    upload_id = client.post("/api/uploads", json={"content_type": "image/png",
+                                                  "size": 300 * 1024}).get_json()["upload_id"]
+    client.put(f"/api/uploads/{upload_id}?offset=0", data=b"x" * (300 * 1024))
+    assert mongodb.fs.chunks.count_documents({"files_id": ObjectId(upload_id)}) == 1
+
+    mongodb.upload_sessions.update_one({"_id": ObjectId(upload_id)},
+                                       {"$set": {"updated": datetime.utcnow() - timedelta(days=2)}})
+    assert cleanup_abandoned_uploads(mongodb, 24 * 3600) == 1
+    assert mongodb.fs.chunks.count_documents({"files_id": ObjectId(upload_id)}) == 0
+    assert client.get(f"/api/uploads/{upload_id}").status_code == 404
+
+# ------------------------------------------------------------
+# 12. CONTENT-ADDRESSED UPLOADS
+# ------------------------------------------------------------
+def test_identical_uploads_share_one_file(client, mongodb):
+    from reports.filestore import store_upload, release, purge_unclaimed
+
+    data = b"same photo " * 40000  # spans two GridFS chunks
+    first = store_upload(mongodb, io.BytesIO(data), "a.jpg", "image/jpeg", "one@example.com")
+    second = store_upload(mongodb, io.BytesIO(data), "b.jpg", "image/jpeg", "two@example.com")
+    assert first == second
+    doc = mongodb.fs.files.find_one({"_id": first})
+    assert doc["metadata"]["refcount"] == 2
+    assert sorted(doc["metadata"]["owners"]) == ["one@example.com", "two@example.com"]
+    assert mongodb.fs.files.count_documents({"metadata.sha256": doc["metadata"]["sha256"]}) == 1
+
+    # the chunked upload path computes the same hash and reuses the file
+    create_user_session(client, mongodb, "three@example.com")
+    upload_id = client.post("/api/uploads", json={"content_type": "image/jpeg",
+                                                  "size": len(data)}).get_json()["upload_id"]
+    client.put(f"/api/uploads/{upload_id}?offset=0", data=data)
+    file_id = client.post(f"/api/uploads/{upload_id}/complete").get_json()["file_id"]
+    assert file_id == str(first)
+    assert mongodb.fs.chunks.count_documents({"files_id": ObjectId(upload_id)}) == 0
+    assert client.get(f"/uploads/{first}").headers["ETag"] == f'"{doc["metadata"]["sha256"]}"'
+
+    # /complete takes no reference: the two stored copies are the only ones,
+    # and the upload's hold keeps the file until it expires unclaimed
+    for _ in range(3):
+        release(mongodb, first)
+    assert mongodb.fs.files.count_documents({"_id": first}) == 1
+    mongodb.fs.files.update_one({"_id": first},
+                                {"$set": {"metadata.pending_until": datetime.utcnow() - timedelta(seconds=1)}})
+    assert purge_unclaimed(mongodb) == 1
+    assert mongodb.fs.files.count_documents({"_id": first}) == 0
+    assert mongodb.fs.chunks.count_documents({"files_id": first}) == 0
+
+
+def test_one_upload_attached_twice_is_referenced_twice(client, mongodb):
+    from reports.filestore import release
+
+    email = "twice@example.com"
+    create_user_session(client, mongodb, email)
+    data = b"shared chunked photo " * 1000
+    upload_id = client.post("/api/uploads", json={"content_type": "image/jpeg",
+                                                  "size": len(data)}).get_json()["upload_id"]
+    client.put(f"/api/uploads/{upload_id}?offset=0", data=data)
+    file_id = client.post(f"/api/uploads/{upload_id}/complete").get_json()["file_id"]
+    assert mongodb.fs.files.find_one({"_id": ObjectId(file_id)})["metadata"]["refcount"] == 0
+
+    mongodb.issues.delete_many({"reporter_email": email})
+    for n in range(2):
+        client.post("/report_issue", data={"description": f"Twice {n}", "city_street": "Main St",
+                                           "category": "pothole", "lat": "31.77", "lng": "35.21",
+                                           "image_file_id": file_id})
+    issues = list(mongodb.issues.find({"reporter_email": email}))
+    assert len(issues) == 2
+    assert mongodb.fs.files.find_one({"_id": ObjectId(file_id)})["metadata"]["refcount"] == 2
+
+    release(mongodb, issues[0]["image_file_id"])
+    assert client.get(f"/uploads/{file_id}").data == data
+    mongodb.issues.delete_many({"reporter_email": email})
+
+# ------------------------------------------------------------
+# 13. EMAIL OUTBOX
+# ------------------------------------------------------------
+class FakeSMTP:
+    """Local SMTP stand-in: records messages, fails the first `fail` sends."""
+    connections = 0
+
+    def __init__(self, fail=0):
+        self.fail = fail
+        self.sent = []
+
+    def __call__(self, config):
+        FakeSMTP.connections += 1
+        return self
+
+    def noop(self):
+        return (250, b"OK")
+
+    def send_message(self, msg):
+        if self.fail:
+            self.fail -= 1
+            raise ConnectionResetError("connection reset")
+        self.sent.append(msg)
+
+    def quit(self):
+        pass
+
+
+def test_outbox_queues_and_delivers_over_one_connection(client, mongodb):
+    from reports.outbox import OutboxWorker
+
+    recipients = ["tech@example.com", API_REPORTER, "outbox-admin@example.com"]
+    mongodb.outbox.delete_many({"to": {"$in": recipients}})
+    create_user_session(client, mongodb, "outbox-admin@example.com", role="admin")
+    issue_id = create_issues(mongodb, 1)[0]
+    resp = client.post(f"/reports/assign/{issue_id}", data={"maintenance_email": "tech@example.com"})
+    assert resp.status_code == 302
+    # the request only queued the two notifications
+    queued = list(mongodb.outbox.find({"status": "pending", "to": {"$in": recipients}}))
+    assert sorted(m["to"] for m in queued) == sorted(["tech@example.com", API_REPORTER])
+
+    smtp = FakeSMTP()
+    FakeSMTP.connections = 0
+    worker = OutboxWorker(app, smtp_factory=smtp)
+    # other tests' queued mail goes out in the same drain
+    assert worker.drain() >= 2
+    assert FakeSMTP.connections == 1
+    assert {m["To"] for m in smtp.sent} >= {"tech@example.com", API_REPORTER}
+    assert mongodb.outbox.count_documents({"status": "sent", "to": {"$in": recipients}}) == 2
+
+    # the connection is reused by the next round
+    with app.app_context():
+        from reports.email_utils import send_email
+        send_email("outbox-admin@example.com", "Hi", "again")
+    assert worker.drain() == 1
+    assert FakeSMTP.connections == 1
+
+
+def test_outbox_retries_with_backoff_then_dead_letters(mongodb):
+    from reports.outbox import OutboxWorker, enqueue_email
+
+    mongodb.outbox.delete_many({"to": "someone@example.com"})
+    msg_id = enqueue_email(mongodb, "someone@example.com", "Subject", "Body")
+    worker = OutboxWorker(app, smtp_factory=FakeSMTP(fail=100))
+    assert worker.drain() == 0
+    doc = mongodb.outbox.find_one({"_id": msg_id})
+    assert doc["status"] == "pending" and doc["attempts"] == 1
+    assert "connection reset" in doc["last_error"]
+    assert doc["next_attempt_at"] > datetime.utcnow()
+    # not due yet
+    assert worker.drain() == 0
+    assert mongodb.outbox.find_one({"_id": msg_id})["attempts"] == 1
+
+    for attempt in range(2, app.config["OUTBOX_MAX_ATTEMPTS"] + 1):
+        mongodb.outbox.update_one({"_id": msg_id}, {"$set": {"next_attempt_at": datetime.utcnow()}})
+        worker.drain()
+    doc = mongodb.outbox.find_one({"_id": msg_id})
+    assert doc["status"] == "dead"
+    assert doc["attempts"] == app.config["OUTBOX_MAX_ATTEMPTS"]
+
+
+def test_digest_mode_merges_notifications(client, mongodb):
+    from reports.digests import flush_digests
+
+    mongodb.outbox.delete_many({"to": {"$in": [API_REPORTER, "tech@example.com"]}})
+    mongodb.email_digests.delete_many({"to": API_REPORTER})
+    create_user_session(client, mongodb, API_REPORTER)
+    client.post("/update_profile", data={"notification_mode": "digest"})
+    assert mongodb.users.find_one({"email": API_REPORTER})["notification_mode"] == "digest"
+
+    create_user_session(client, mongodb, "outbox-admin@example.com", role="admin")
+    for issue_id in create_issues(mongodb, 3):
+        client.post(f"/reports/assign/{issue_id}", data={"maintenance_email": "tech@example.com"})
+    # the technician has no preference: one email per assignment
+    assert mongodb.outbox.count_documents({"to": "tech@example.com"}) == 3
+    assert mongodb.outbox.count_documents({"to": API_REPORTER}) == 0
+    assert len(mongodb.email_digests.find_one({"to": API_REPORTER})["items"]) == 3
+
+    flush_digests(mongodb)
+    # window still open
+    assert mongodb.email_digests.count_documents({"to": API_REPORTER}) == 1
+    assert mongodb.outbox.count_documents({"to": API_REPORTER}) == 0
+    mongodb.email_digests.update_many({"to": API_REPORTER},
+                                      {"$set": {"flush_at": datetime.utcnow() - timedelta(minutes=1)}})
+    assert flush_digests(mongodb) >= 1
+    digest = mongodb.outbox.find_one({"to": API_REPORTER})
+    assert digest["subject"].startswith("CityFix: 3 updates")
+    assert digest["body"].count("Your Report is Now Assigned") == 3
+    assert mongodb.email_digests.count_documents({"to": API_REPORTER}) == 0
+
+# ------------------------------------------------------------
+# 14. FULL-TEXT SEARCH
+# ------------------------------------------------------------
+def test_search_highlights_matches():
+    from reports.search import highlight, highlight_pattern
+
+    pattern = highlight_pattern('potholes near Herzl -flooding')
+    assert highlight("Deep pothole <b>here</b>", pattern) == "Deep <mark>pothole</mark> &lt;b&gt;here&lt;/b&gt;"
+    assert highlight("Herzl St", pattern) == "<mark>Herzl</mark> St"
+    assert highlight("flooding", pattern) is None
+    snippet = highlight("x " * 200 + "pothole" + " y" * 200, pattern)
+    assert snippet.startswith("…") and snippet.endswith("…") and "<mark>pothole</mark>" in snippet
+    assert len(snippet) < 200
+
+
+def test_search_requires_query(client):
+    assert client.get("/api/issues/search").status_code == 400
+    assert client.get("/api/issues/search?q=" + "x" * 300).status_code == 400
+
+
+def test_search_ranks_and_pages(client, mongodb):
+    from pymongo.errors import OperationFailure
+
+    create_issues(mongodb, 3, description="Deep pothole near the school", city_street="Herzl St")
+    create_issues(mongodb, 2, reporter_email="other@example.com",
+                  description="Broken streetlight", city_street="Jaffa Rd", category="lighting")
+    try:
+        rv = client.get("/api/issues/search?q=pothole herzl&limit=2")
+    except (NotImplementedError, OperationFailure):
+        pytest.skip("backend does not support $text")
+    assert rv.status_code == 200
+    body = rv.get_json()
+    assert len(body["issues"]) == 2 and body["next_cursor"]
+    assert "<mark>pothole</mark>" in body["issues"][0]["highlights"]["description"]
+    rest = client.get(f"/api/issues/search?q=pothole herzl&limit=2&cursor={body['next_cursor']}").get_json()
+    assert len(rest["issues"]) == 1 and rest["next_cursor"] is None
+    assert client.get("/api/issues/search?q=pothole&status=done").get_json()["issues"] == []
+
+# ------------------------------------------------------------
+# 15. SERVER-SIDE FILTERS & FACETS
+# ------------------------------------------------------------
+def test_issues_filters_and_facets(client, mongodb):
+    # categories and a street of its own, so other data in the collection doesn't count
+    ids = create_issues(mongodb, 3, category="facet_pothole")
+    ids += create_issues(mongodb, 2, reporter_email="lights@example.com",
+                         category="facet_lighting", city_street="Facetstreet Rd")
+    ids += create_issues(mongodb, 1, reporter_email="done@example.com",
+                         category="facet_pothole", status="done")
+
+    body = client.get("/api/issues?category=facet_pothole&facets=1").get_json()
+    assert len(body["issues"]) == 4
+    facets = body["facets"]
+    assert facets["total"] == 4
+    # the category counts ignore the category filter itself
+    categories = {c["value"]: c["count"] for c in facets["category"]}
+    assert categories["facet_pothole"] == 4 and categories["facet_lighting"] == 2
+    assert {s["value"]: s["count"] for s in facets["status"]} == {"pending": 3, "done": 1}
+
+    body = client.get("/api/issues?status=pending&street=Facetstr").get_json()
+    assert [i["city_street"] for i in body["issues"]] == ["Facetstreet Rd", "Facetstreet Rd"]
+    assert "facets" not in body
+    assert client.get("/api/issues?street=.*").get_json()["issues"] == []
+
+    rv = client.get("/reports")
+    assert rv.status_code == 200
+    assert b'value="facet_lighting"' in rv.data
+    mongodb.issues.delete_many({"_id": {"$in": [ObjectId(i) for i in ids]}})
+
+# ------------------------------------------------------------
+# 16. LIVE ISSUE EVENTS (SSE)
+# ------------------------------------------------------------
+def test_events_fan_out_to_subscribers(mongodb):
+    from reports.events import EventBroadcaster, publish_event
+
+    broadcaster = EventBroadcaster(app, change_streams=False, poll_interval=0.05)
+    first, second = broadcaster.subscribe(), broadcaster.subscribe()
+    time.sleep(0.2)  # let the poller take its starting point
+    issue_id = ObjectId()
+    publish_event(mongodb, "status", issue_id, status="resolved")
+    for q in (first, second):
+        event = q.get(timeout=2)
+        assert event["kind"] == "status" and event["issue_id"] == issue_id
+        assert event["data"] == {"status": "resolved"}
+    broadcaster.unsubscribe(second)
+    publish_event(mongodb, "deleted", issue_id)
+    assert first.get(timeout=2)["kind"] == "deleted"
+    assert second.empty()
+    broadcaster.stop.set()
+
+
+def test_events_stream_replays_after_last_event_id(client, mongodb, monkeypatch):
+    from reports.events import publish_event
+
+    monkeypatch.setitem(app.config, "EVENT_CHANGE_STREAMS", False)
+    start = ObjectId()
+    create_user_session(client, mongodb, API_REPORTER, role="maintenance")
+    issue_id = create_issues(mongodb, 1, assigned_to=API_REPORTER)[0]
+    client.post(f"/maintenance/update_status/{issue_id}", data={"status": "resolved"})
+    publish_event(mongodb, "deleted", ObjectId(issue_id))
+
+    rv = client.get("/api/issues/events", headers={"Last-Event-ID": str(start)}, buffered=False)
+    assert rv.mimetype == "text/event-stream"
+    frames = iter(rv.response)
+    assert next(frames).startswith(b"retry:")
+    status = next(frames).decode()
+    assert "event: status\n" in status
+    payload = json.loads(status.split("data: ", 1)[1])
+    assert payload == {"kind": "status", "issue_id": issue_id, "status": "resolved"}
+    assert b"event: deleted\n" in next(frames)
+    rv.close()
+
+
+def test_events_stream_ends_when_the_worker_stops(client, mongodb, monkeypatch):
+    from reports.events import EventBroadcaster
+
+    broadcaster = EventBroadcaster(app, change_streams=False, poll_interval=0.05)
+    monkeypatch.setitem(app.extensions, "issue_events", broadcaster)
+    create_user_session(client, mongodb, API_REPORTER)
+    rv = client.get("/api/issues/events", buffered=False)
+    frames = iter(rv.response)
+    assert next(frames).startswith(b"retry:")
+
+    t0 = time.time()
+    broadcaster.close()
+    assert list(frames) == []
+    assert time.time() - t0 < 2
+    rv.close()
+
+# ------------------------------------------------------------
+# 17. DELTA SYNC
+# ------------------------------------------------------------
+def test_issue_changes_since_version(client, mongodb):
+    from reports.versioning import current_version
+
+    create_user_session(client, mongodb, API_REPORTER)
+    start = current_version(mongodb)
+    for n in range(3):
+        client.post("/report_issue", data={"description": f"sync {n}", "city_street": "Herzl St",
+                                           "category": "pothole", "lat": "31.77", "lng": "35.21"})
+    body = client.get(f"/api/issues/changes?since={start}").get_json()
+    assert [i["description"] for i in body["issues"]] == ["sync 0", "sync 1", "sync 2"]
+    assert body["has_more"] is False and body["deleted"] == [] and "users" not in body
+    synced = body["version"]
+
+    gone = body["issues"][0]["_id"]
+    client.post(f"/delete_issue/{gone}")
+    later = client.get(f"/api/issues/changes?since={synced}").get_json()
+    assert later["issues"] == []
+    assert [(t["collection"], t["doc_id"]) for t in later["deleted"]] == [("issues", gone)]
+
+    page = client.get(f"/api/issues/changes?since={start}&limit=1").get_json()
+    assert len(page["issues"]) == 1 and page["has_more"] is True and page["next_cursor"]
+    assert page["deleted"] == []
+    assert client.get("/api/issues/changes?since=abc").status_code == 400
+    assert client.get("/api/issues/changes?cursor=abc").status_code == 400
+
+
+def test_user_deletion_leaves_tombstone_for_admins(client, mongodb):
+    from reports.versioning import current_version
+
+    start = current_version(mongodb)
+    mongodb.users.delete_many({"email": "leaving@example.com"})
+    user_id = mongodb.users.insert_one({"email": "leaving@example.com", "role": "user"}).inserted_id
+    create_user_session(client, mongodb, "sync-admin@example.com", role="admin")
+    client.post(f"/admin/users/delete/{user_id}")
+    body = client.get(f"/api/issues/changes?since={start}").get_json()
+    assert ("users", str(user_id)) in [(t["collection"], t["doc_id"]) for t in body["deleted"]]
+
+    create_user_session(client, mongodb, API_REPORTER)
+    body = client.get(f"/api/issues/changes?since={start}").get_json()
+    assert "users" not in body and all(t["collection"] != "users" for t in body["deleted"])
+
+
+def test_changes_are_private_per_role(client, mongodb):
+    from reports.versioning import committed_version
+
+    start = committed_version(mongodb)
+    mongodb.users.delete_many({"email": "newcomer@example.com"})
+    client.post("/auth/register", data={"name": "New", "email": "newcomer@example.com",
+                                        "password": "pw", "role": "user"})
+    create_user_session(client, mongodb, "sync-admin@example.com", role="admin")
+    admin = client.get(f"/api/issues/changes?since={start}")
+    assert "newcomer@example.com" in [u["email"] for u in admin.get_json()["users"]]
+    assert "private" in admin.headers["Cache-Control"] and "Cookie" in admin.headers["Vary"]
+
+    create_user_session(client, mongodb, API_REPORTER)
+    rv = client.get(f"/api/issues/changes?since={start}", headers={"If-None-Match": admin.headers["ETag"]})
+    assert rv.status_code == 200 and "users" not in rv.get_json()
+
+
+def test_backfill_versions(mongodb):
+    from migrations import backfill_versions
+
+    legacy = mongodb.issues.insert_one({"description": "old", "timestamp": datetime.utcnow()}).inserted_id
+    assert backfill_versions(mongodb) >= 1
+    assert mongodb.issues.find_one({"_id": legacy})["version"] > 0
+    assert backfill_versions(mongodb) == 0
+
+
+def test_changes_pages_through_a_shared_version(client, mongodb):
+    from migrations import backfill_versions
+    from reports.versioning import current_version
+
+    create_user_session(client, mongodb, API_REPORTER)
+    start = current_version(mongodb)
+    mongodb.issues.delete_many({"reporter_email": "legacy@example.com"})
+    legacy = mongodb.issues.insert_many([{"reporter_email": "legacy@example.com", "description": f"old {n}",
+                                          "timestamp": datetime.utcnow()} for n in range(10)]).inserted_ids
+    backfill_versions(mongodb)  # one version for all ten
+
+    seen, url = [], f"/api/issues/changes?since={start}&limit=3"
+    while True:
+        body = client.get(url).get_json()
+        seen += [i["_id"] for i in body["issues"]]
+        if not body["has_more"]:
+            break
+        url = f"/api/issues/changes?cursor={body['next_cursor']}&limit=3"
+    assert sorted(seen) == sorted(str(i) for i in legacy)
+    assert body["version"] == current_version(mongodb)
+
+
+def test_changes_stop_below_writes_in_flight(client, mongodb):
+    from reports import versioning
+
+    create_user_session(client, mongodb, API_REPORTER)
+    before = versioning.committed_version(mongodb)
+    reserved = versioning.next_version(mongodb)  # stamped, not written yet
+    try:
+        body = client.get(f"/api/issues/changes?since={before}").get_json()
+        assert body["version"] < reserved
+    finally:
+        versioning.bump_version(mongodb)
+    assert versioning.committed_version(mongodb) >= reserved
+
+# ------------------------------------------------------------
+# 18. APP FACTORY
+# ------------------------------------------------------------
+def test_create_app_builds_an_independent_app():
+    from config import Config
+
+    class SmallPool(Config):
+        MONGO_MAX_POOL_SIZE = 4
+        BACKGROUND_SERVICES = False
+
+    other = run.create_app(SmallPool)
+    assert other is not app
+    assert other.config["MONGO_MAX_POOL_SIZE"] == 4
+    assert other.mongo is not None
+    assert {"/api/issues/changes", "/api/issues/events"} <= {r.rule for r in other.url_map.iter_rules()}
+    assert "migrate" in other.cli.commands
+
+
+def test_start_and_stop_services(monkeypatch):
+    import threading
+
+    started = []
+
+    def fake_start(*args):
+        started.append(args)
+        return threading.Event()
+
+    for name in ("start_reconciler", "start_derivative_worker", "start_upload_janitor",
+                 "start_outbox_worker", "start_digest_flusher", "start_derivative_sweeper"):
+        monkeypatch.setattr(run, name, fake_start)
+    other = run.create_app()
+    other.mongo.db.meta.delete_many({"_id": "leader:background-services"})
+    run.start_services(other)
+    stops = list(other.extensions["background_services"])
+    deadline = time.time() + 5
+    while len(started) < 6 and time.time() < deadline:
+        time.sleep(0.01)
+    # the derivative worker here, the other five once the leader lease is taken
+    assert len(started) == 6 and len(stops) == 2
+    run.stop_services(other)
+    assert all(stop.is_set() for stop in stops)
+    assert "background_services" not in other.extensions
+
+
+def test_leader_lease_is_held_by_one_process(mongodb):
+    from reports.leader import LeaderLease
+
+    mongodb.meta.delete_many({"_id": "leader:lease-test"})
+    first, second = LeaderLease("lease-test", 30), LeaderLease("lease-test", 30)
+    assert first.acquire(mongodb) and first.acquire(mongodb)
+    assert not second.acquire(mongodb)
+    # an expired lease is taken over
+    mongodb.meta.update_one({"_id": "leader:lease-test"},
+                            {"$set": {"until": datetime.utcnow() - timedelta(seconds=1)}})
+    assert second.acquire(mongodb) and not first.acquire(mongodb)
+    second.release(mongodb)
+    assert first.acquire(mongodb)
+    first.release(mongodb)
+
+
+def test_create_app_requires_a_secret_key():
+    from config import Config
+
+    class NoSecret(Config):
+        SECRET_KEY = None
+
+    with pytest.raises(RuntimeError):
+        run.create_app(NoSecret)
+    assert run.create_app(NoSecret, dev=True).config["SECRET_KEY"]
+
+# ------------------------------------------------------------
+# 19. STORAGE BACKENDS
+# ------------------------------------------------------------
+def test_memory_backend_matches_mongo_semantics():
+    from pymongo.errors import DuplicateKeyError
+    from config import Config
+    from reports.geo import bbox_query
+
+    class Memory(Config):
+        STORAGE_BACKEND = "memory"
+
+    db = run.create_app(Memory).mongo.db
+    assert db.issues.count_documents({}) == 0  # a database of its own
+
+    inside = {"type": "Point", "coordinates": [35.21, 31.77]}
+    outside = {"type": "Point", "coordinates": [35.50, 31.77]}
+    db.issues.insert_many([{"location": inside}, {"location": outside}])
+    found = list(db.issues.find(bbox_query((31.7, 35.2), (31.8, 35.3))))
+    assert [d["location"] for d in found] == [inside]
+
+    db.tombstones.create_index([("collection", 1), ("doc_id", 1)], unique=True)
+    db.tombstones.insert_one({"collection": "issues", "doc_id": 1})
+    with pytest.raises(DuplicateKeyError):
+        db.tombstones.insert_one({"collection": "issues", "doc_id": 1})
+
+
+def test_unknown_storage_backend_is_rejected():
+    from config import Config
+
+    class Nowhere(Config):
+        STORAGE_BACKEND = "sqlite"
+
+    with pytest.raises(ValueError):
+        run.create_app(Nowhere)
+
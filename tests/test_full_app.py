@@ -121,7 +121,7 @@ def test_maintenance_dashboard_access(client, mongodb):
         sess['role'] = 'maintenance'
     rv = client.get("/maintenance/dashboard")
     assert rv.status_code == 200
-    assert b"Assigned Issues" in rv.data or b"See what happens" in rv.data
+    assert b"Assigned Tasks" in rv.data or b"No Tasks Assigned" in rv.data
 
 def test_maintenance_update_status(client, mongodb):
     db = mongodb
@@ -138,6 +138,65 @@ def test_maintenance_update_status(client, mongodb):
     updated = db.issues.find_one({"_id": ObjectId(issue_id)})
     assert updated['status'] == "in progress"
 
+def test_rejected_reports_batched_view(client, mongodb):
+    db = mongodb
+    email, pw = "maint3@example.com", "Maint123!"
+    create_user(db, email, pw, role="maintenance")
+    db.rejected_reports.delete_many({"technician": email})
+    open_id = create_job(db, "open@x.com")
+    done_id = create_job(db, "done@x.com")
+    db.issues.update_one({"_id": ObjectId(done_id)}, {"$set": {"status": "done"}})
+    for issue_id, reason in ((open_id, "still broken"), (done_id, "old news"), ("not-an-id", "bad id")):
+        db.rejected_reports.insert_one({
+            "original_issue_id": issue_id,
+            "technician":        email,
+            "rejection_reason":  reason,
+            "admin":             "admin@cityfix.com",
+            "timestamp":         datetime.now(timezone.utc).isoformat()
+        })
+
+    login(client, email, pw)
+    with client.session_transaction() as sess:
+        sess['user'] = email
+        sess['role'] = 'maintenance'
+    rv = client.get("/maintenance/rejected_reports")
+    assert rv.status_code == 200
+    assert b"still broken" in rv.data
+    assert b"old news" not in rv.data
+    assert client.get("/maintenance/dashboard").status_code == 200
+
+# ------------------------------------------------------------------
+# MATERIALIZED COUNTERS
+# ------------------------------------------------------------------
+def test_user_counters_follow_writes_and_reconcile(client, mongodb):
+    from reports.counters import get_user_counters, reconcile_counters
+
+    db = mongodb
+    email, pw = "counter@example.com", "Count123!"
+    create_user(db, email, pw)
+    db.issues.delete_many({"reporter_email": email})
+    db.user_counters.delete_many({"_id": email})
+
+    login(client, email, pw)
+    with client.session_transaction() as sess:
+        sess['user'] = email
+        sess['role'] = 'user'
+    for _ in range(2):
+        client.post('/report_issue', data={
+            'description': 'Counted', 'city_street': 'Main St',
+            'category': 'pothole', 'lat': '31.77', 'lng': '35.21'
+        })
+    assert get_user_counters(db, email)["issues_reported"] == 2
+
+    rid = str(db.issues.find_one({"reporter_email": email})["_id"])
+    client.post(f'/delete_issue/{rid}')
+    assert get_user_counters(db, email)["issues_reported"] == 1
+
+    # drift (e.g. a direct write) is repaired by the reconciler
+    db.user_counters.update_one({"_id": email}, {"$set": {"issues_reported": 42}})
+    reconcile_counters(db)
+    assert get_user_counters(db, email)["issues_reported"] == 1
+
 # ------------------------------------------------------------------
 # REPORT DETAIL PAGE
 # ------------------------------------------------------------------
@@ -0,0 +1,101 @@
+# tests/test_indexes.py
+
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from run import app
+from indexes import INDEXES, NEWEST_FIRST, QUERY_SHAPES, ensure_indexes
+from query_plans import assert_no_collscan
+from reports.done_reports import REVIEW_FILTERS
+from reports.filters import issue_filters
+from reports.geo import bbox_query
+from reports.pagination import encode_cursor, listing_query, page_filter
+
+# ------------------------------------------------------------
+# FIXTURES
+# ------------------------------------------------------------
+@pytest.fixture(scope="module")
+def mongodb():
+    db = app.mongo.db
+    ensure_indexes(db)
+    return db
+
+# ------------------------------------------------------------
+# INDEX BOOTSTRAP
+# ------------------------------------------------------------
+def test_ensure_indexes_is_idempotent(mongodb):
+    assert ensure_indexes(mongodb) == []
+    for collection, models in INDEXES.items():
+        existing = mongodb[collection].index_information()
+        for model in models:
+            assert model.document["name"] in existing
+
+
+@pytest.mark.parametrize(
+    "collection,query,sort", QUERY_SHAPES,
+    ids=[f"{c}:{','.join(q) or 'all'}" for c, q, _ in QUERY_SHAPES]
+)
+def test_hot_queries_use_an_index(mongodb, collection, query, sort):
+    assert_no_collscan(mongodb[collection], query, sort)
+
+# ------------------------------------------------------------
+# QUERIES AS THE ROUTES BUILD THEM
+# ------------------------------------------------------------
+# Built with the routes' own helpers, first page and next page, so a change
+# to a filter or to the keyset condition that loses its index fails here.
+NEXT_PAGE = encode_cursor({"timestamp": datetime(2024, 1, 1), "_id": ObjectId("0" * 24)})
+CITY      = ((31.72, 35.22), (31.78, 35.28))
+WORLD     = ((-85, -180), (85, 180))
+
+LISTING_ARGS = [
+    {},
+    {"category": "pothole"},
+    {"status": "pending"},
+    {"street": "Herzl"},
+    {"category": "pothole", "status": "pending", "since": "2024-01-01"},
+    {"since": "2024-01-01", "until": "2024-02-01"},
+]
+
+
+def _pages(query, args=None):
+    query = listing_query(query, args or {})
+    return [page_filter(query, None), page_filter(query, NEXT_PAGE)]
+
+
+def _named(args):
+    return ",".join(args) or "all"
+
+
+def route_shapes():
+    shapes = []
+    for args in LISTING_ARGS:                               # /api/issues
+        for query in _pages(issue_filters(args), args):
+            shapes.append((f"issues:{_named(args)}", "issues", query, NEWEST_FIRST))
+    for query in _pages({"reporter_email": "someone@example.com"}):
+        shapes.append(("issues:user", "issues", query, NEWEST_FIRST))
+    for name, box in (("city", CITY), ("world", WORLD)):    # /api/issues/bbox
+        for query in _pages(bbox_query(*box)):
+            shapes.append((f"bbox:{name}", "issues", query, NEWEST_FIRST))
+    for args in LISTING_ARGS[:3]:                           # /api/issues/clusters
+        query = bbox_query(*CITY)
+        query.update(issue_filters(args))
+        shapes.append((f"clusters:{_named(args)}", "issues", listing_query(query, args), None))
+    query = bbox_query(*WORLD)                              # clusters at zoom 0-1
+    shapes.append(("clusters:world", "issues", query, None))
+    for status, query in REVIEW_FILTERS.items():            # admin review queue
+        for page in _pages(query):
+            shapes.append((f"review:{status}", "done_issues", page, NEWEST_FIRST))
+    return shapes
+
+
+ROUTE_SHAPES = route_shapes()
+
+
+@pytest.mark.parametrize(
+    "collection,query,sort", [shape[1:] for shape in ROUTE_SHAPES],
+    ids=[f"{name}:{n}" for n, (name, *_) in enumerate(ROUTE_SHAPES)]
+)
+def test_route_queries_use_an_index(mongodb, collection, query, sort):
+    assert_no_collscan(mongodb[collection], query, sort)